@@ -0,0 +1,60 @@
+"""
+Проверка атомарности UserCRUD.points / add_duration под конкурентной нагрузкой.
+
+    python -m benchmarks.concurrent_counters --parallel 500
+
+Запускает parallel одновременных начислений и сверяет итог с ожидаемым.
+Код возврата 1 — потерянные обновления.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+_tmp_db = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{_tmp_db}"
+)
+
+from core.database.models import async_main, engine  # noqa: E402
+from core.database.requests import UserCRUD  # noqa: E402
+
+TID = 424242
+
+
+async def main(parallel: int) -> int:
+    await async_main()
+    await UserCRUD.create(tid=TID, chat_id=TID, name="bench", username="bench", points=0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(UserCRUD.points(TID, 1) for _ in range(parallel)))
+    await asyncio.gather(*(UserCRUD.add_duration(TID, 2) for _ in range(parallel)))
+    elapsed = time.perf_counter() - started
+
+    user = await UserCRUD.get_by_tid(TID)
+    expected_seconds = 2 * parallel
+    print(f"{engine.dialect.name}: {2 * parallel} обновлений за {elapsed:.2f}с")
+    print(f"  points:     {user.points} (ожидалось {parallel})")  # type: ignore
+    print(f"  total_seconds: {user.total_seconds} (ожидалось {expected_seconds})")  # type: ignore
+
+    # отсечка на нуле: списание больше остатка не уводит в минус
+    clamped = await UserCRUD.points(TID, -10 * parallel)
+    print(f"  points после списания сверх остатка: {clamped} (ожидалось 0)")
+
+    await engine.dispose()
+    ok = (
+        user.points == parallel  # type: ignore
+        and user.total_seconds == expected_seconds  # type: ignore
+        and clamped == 0
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--parallel", type=int, default=500)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.parallel)))
@@ -0,0 +1,87 @@
+"""
+Влияние настроек движка (пул, кэш запросов asyncpg, прагмы SQLite) на сценарий load_test.
+
+    python -m benchmarks.engine_config --users 200 --concurrency 100
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.engine_config
+
+Каждый пресет запускается отдельным процессом benchmarks.load_test, потому что
+движок создаётся один раз при импорте core.database.models из переменных окружения.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SQLITE_PRESETS = {
+    "по умолчанию SQLite (rollback journal, FULL)": {
+        "SQLITE_WAL": "0",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_BUSY_TIMEOUT": "0",
+        "DB_POOL_SIZE": "5",
+        "DB_MAX_OVERFLOW": "10",
+    },
+    "WAL + synchronous=NORMAL + busy_timeout": {
+        "SQLITE_WAL": "1",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+        "SQLITE_BUSY_TIMEOUT": "5000",
+        "DB_POOL_SIZE": "10",
+        "DB_MAX_OVERFLOW": "20",
+    },
+}
+
+POSTGRES_PRESETS = {
+    "по умолчанию SQLAlchemy, pre-ping, без кэша запросов": {
+        "DB_POOL_SIZE": "5",
+        "DB_MAX_OVERFLOW": "10",
+        "DB_POOL_PRE_PING": "1",
+        "DB_STATEMENT_CACHE_SIZE": "0",
+    },
+    "пул 20+20, кэш подготовленных запросов 100": {
+        "DB_POOL_SIZE": "20",
+        "DB_MAX_OVERFLOW": "20",
+        "DB_POOL_PRE_PING": "0",
+        "DB_STATEMENT_CACHE_SIZE": "100",
+    },
+}
+
+
+def run_preset(title: str, preset: dict[str, str], args, base_uid: int) -> str:
+    env = {**os.environ, **preset}
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.load_test",
+        "--users",
+        str(args.users),
+        "--concurrency",
+        str(args.concurrency),
+        "--sessions",
+        str(args.sessions),
+        "--base-uid",
+        str(base_uid),
+    ]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    summary = [line for line in result.stdout.splitlines() if line.startswith("Всего:")]
+    if result.returncode != 0 and not summary:
+        return f"ошибка (код {result.returncode}): {result.stderr.strip().splitlines()[-1:]}"
+    return summary[-1] if summary else "нет итоговой строки"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=2)
+    args = parser.parse_args()
+
+    postgres = os.getenv("BENCH_DATABASE_URL", "").startswith("postgresql")
+    presets = POSTGRES_PRESETS if postgres else SQLITE_PRESETS
+    for i, (title, preset) in enumerate(presets.items()):
+        print(f"▶ {title}")
+        # на общей базе PostgreSQL каждому прогону — свои пользователи
+        print(f"  {run_preset(title, preset, args, base_uid=1_000_000 * (i + 1))}")
+
+
+if __name__ == "__main__":
+    main()
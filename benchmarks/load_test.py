@@ -0,0 +1,331 @@
+"""
+Нагрузочный прогон настоящих роутеров user/user_finally на синтетических пользователях.
+
+    python -m benchmarks.load_test --users 200 --sessions 2 --api-latency 20
+
+Каждый пользователь проходит день целиком: /start, постановка целей, несколько
+сессий «Начать/Стоп», профиль, отметка выполненного и ночное подведение итогов.
+События собираются из JSON так же, как при вебхуке, Bot заменён заглушкой,
+которая только запоминает отправки и правки (с задержкой --api-latency мс).
+По умолчанию база — временная SQLite; для PostgreSQL укажите
+BENCH_DATABASE_URL=postgresql+asyncpg://...; --unit-of-work обрабатывает каждое
+обновление в одной транзакции (как DB_UNIT_OF_WORK=1 в боте).
+
+В отчёте по каждому шагу: p50/p95/p99 времени dp.handle, SQL-запросов и
+вызовов API на обновление; в конце — пропускная способность и ошибки.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+_tmp_db = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{_tmp_db}"
+)
+os.environ.setdefault("FSM_STORAGE", "memory")
+
+from sqlalchemy import event as sa_event  # noqa: E402
+from maxapi import Bot, Dispatcher  # noqa: E402
+from maxapi.methods.types.getted_updates import process_update_webhook  # noqa: E402
+
+from core.database.models import async_main, engine  # noqa: E402
+from core.database.requests import checkpoint, unit_of_work  # noqa: E402
+from core.user_handlers.user import user as user_router  # noqa: E402
+from core.user_handlers.finally_ import user_finally  # noqa: E402
+from utils.dispatch import scope_handlers  # noqa: E402
+from utils.storage import StorageContext, MemoryStorage  # noqa: E402
+
+BASE_UID = 1_000_000
+NOW_MS = int(time.time() * 1000)
+
+# счётчики текущего обновления: [SQL-запросов, вызовов API]
+_current: contextvars.ContextVar[list | None] = contextvars.ContextVar(
+    "load_test_current", default=None
+)
+
+
+def _count(slot: int) -> None:
+    counters = _current.get()
+    if counters is not None:
+        counters[slot] += 1
+
+
+class StubBot(Bot):
+    """Bot без сети: отправки и правки запоминаются, ответы — минимальные заглушки."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__("load-test", auto_requests=False)
+        self.latency = latency
+        self.last_attachments: dict[int, list] = {}
+
+    async def _api(self, user_id: int | None, attachments) -> None:
+        _count(1)
+        # как commit_before_api в боте: методы заглушки не ходят через BaseConnection.request
+        await checkpoint()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if user_id is not None and attachments:
+            self.last_attachments[user_id] = attachments
+
+    async def get_me(self):
+        return SimpleNamespace(user_id=0, username="load_test", first_name="load_test")
+
+    async def get_subscriptions(self):
+        return SimpleNamespace(subscriptions=[])
+
+    async def send_message(self, chat_id=None, user_id=None, text=None, attachments=None, **kwargs):
+        await self._api(user_id or chat_id, attachments)
+        return SimpleNamespace(message=SimpleNamespace(mid=f"m{user_id or chat_id}"))
+
+    async def edit_message(self, message_id=None, text=None, attachments=None, **kwargs):
+        # mid синтетических сообщений — "m<user_id>"
+        await self._api(int(message_id[1:]) if message_id else None, attachments)
+        return SimpleNamespace()
+
+    async def send_callback(self, *args, **kwargs):
+        await self._api(None, None)
+        return SimpleNamespace()
+
+    async def delete_message(self, *args, **kwargs):
+        await self._api(None, None)
+        return SimpleNamespace()
+
+    def payloads(self, user_id: int, prefix: str) -> list[str]:
+        """payload кнопок из последней клавиатуры пользователя, начинающиеся с prefix."""
+        found = []
+        for attachment in self.last_attachments.get(user_id, []):
+            rows = getattr(getattr(attachment, "payload", None), "buttons", None) or []
+            for row in rows:
+                for button in row:
+                    payload = getattr(button, "payload", None)
+                    if payload and payload.startswith(prefix):
+                        found.append(payload)
+        return found
+
+
+# ---------- Синтетические обновления ----------
+def _user(uid: int) -> dict:
+    return {
+        "user_id": uid,
+        "first_name": f"user{uid}",
+        "username": f"u{uid}",
+        "is_bot": False,
+        "last_activity_time": NOW_MS,
+    }
+
+
+def _message(uid: int, text: str | None) -> dict:
+    return {
+        "sender": _user(uid),
+        "recipient": {"chat_id": uid, "chat_type": "dialog", "user_id": 0},
+        "timestamp": NOW_MS,
+        "body": {"mid": f"m{uid}", "seq": 1, "text": text, "attachments": None},
+    }
+
+
+def bot_started(uid: int) -> dict:
+    return {
+        "update_type": "bot_started",
+        "timestamp": NOW_MS,
+        "chat_id": uid,
+        "user": _user(uid),
+        "payload": None,
+    }
+
+
+def message_created(uid: int, text: str) -> dict:
+    return {"update_type": "message_created", "timestamp": NOW_MS, "message": _message(uid, text)}
+
+
+def message_callback(uid: int, payload: str) -> dict:
+    return {
+        "update_type": "message_callback",
+        "timestamp": NOW_MS,
+        "callback": {
+            "timestamp": NOW_MS,
+            "callback_id": f"cb{uid}",
+            "payload": payload,
+            "user": _user(uid),
+        },
+        "message": _message(uid, "menu"),
+    }
+
+
+class ErrorCounter(logging.Handler):
+    """Диспетчер глотает исключения хендлеров и пишет их в лог — считаем их там."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+
+
+class LoadTest:
+    def __init__(self, dp, bot: StubBot):
+        self.dp = dp
+        self.bot = bot
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.queries: dict[str, list[int]] = defaultdict(list)
+        self.api_calls: dict[str, list[int]] = defaultdict(list)
+
+    async def send(self, step: str, payload: dict) -> None:
+        update = await process_update_webhook(event_json=payload, bot=self.bot)
+        counters = [0, 0]
+        token = _current.set(counters)
+        started = time.perf_counter()
+        try:
+            await self.dp.handle(update)
+        finally:
+            self.latency[step].append(time.perf_counter() - started)
+            _current.reset(token)
+        self.queries[step].append(counters[0])
+        self.api_calls[step].append(counters[1])
+
+    async def pick(self, step: str, uid: int, prefix: str) -> None:
+        """Нажать случайную кнопку с payload на prefix из последней клавиатуры."""
+        choices = self.bot.payloads(uid, prefix)
+        if choices:
+            await self.send(step, message_callback(uid, random.choice(choices)))
+
+    async def user_day(self, uid: int, sessions: int, targets: int) -> None:
+        await self.send("bot_started", bot_started(uid))
+        # первый клик без целей уводит в new_day, дальше — постановка целей
+        await self.send("get_profile", message_callback(uid, "get_profile"))
+        await self.send("create_new_target", message_callback(uid, "create_new_target"))
+        goals = ", ".join(f"цель {n} пользователя {uid}" for n in range(1, targets + 1))
+        await self.send("write_targets", message_created(uid, goals))
+        await self.send("confirm_targets", message_callback(uid, "right"))
+
+        for _ in range(sessions):
+            await self.send("start_session", message_callback(uid, "start_session"))
+            await self.pick("start_target", uid, "start_target:")
+            await self.send("stop_session", message_callback(uid, "stop_session"))
+
+        await self.send("get_profile", message_callback(uid, "get_profile"))
+        await self.send("target_is_done", message_callback(uid, "target_is_done"))
+        await self.pick("toggle_done", uid, "done:")
+        await self.send("commit_done", message_callback(uid, "commit_done"))
+
+        # ночное подведение итогов
+        await self.send("finally_open", message_callback(uid, "target_is_done_finally"))
+        await self.pick("finally_toggle", uid, "finally_done:")
+        await self.send("finally_commit", message_callback(uid, "commit_finally_done"))
+        await self.send("day_is_done", message_callback(uid, "day_is_done_finally"))
+
+    def report(self, elapsed: float, errors: int) -> None:
+        def pct(values: list[float], q: int) -> float:
+            if len(values) < 2:
+                return values[0] if values else 0.0
+            return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+        total = sum(len(v) for v in self.latency.values())
+        print(
+            f"{'шаг':<18}{'кол-во':>7}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+            f"{'SQL/upd':>9}{'API/upd':>9}"
+        )
+        for step, values in self.latency.items():
+            print(
+                f"{step:<18}{len(values):>7}"
+                f"{pct(values, 50) * 1000:>9.2f}{pct(values, 95) * 1000:>9.2f}"
+                f"{pct(values, 99) * 1000:>9.2f}"
+                f"{statistics.mean(self.queries[step]):>9.2f}"
+                f"{statistics.mean(self.api_calls[step]):>9.2f}"
+            )
+        all_latency = [v for values in self.latency.values() for v in values]
+        all_queries = [v for values in self.queries.values() for v in values]
+        print(
+            f"\nВсего: {total} обновлений за {elapsed:.2f}с — {total / elapsed:.1f} upd/s; "
+            f"p50={pct(all_latency, 50) * 1000:.2f}мс p95={pct(all_latency, 95) * 1000:.2f}мс "
+            f"p99={pct(all_latency, 99) * 1000:.2f}мс; SQL на обновление {statistics.mean(all_queries):.2f}; "
+            f"ошибок {errors}"
+        )
+
+
+async def main(
+    users: int,
+    sessions: int,
+    targets: int,
+    api_latency: float,
+    concurrency: int,
+    base_uid: int = BASE_UID,
+    use_unit_of_work: bool = False,
+) -> int:
+    await async_main()
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        _count(0)
+
+    sa_event.listen(engine.sync_engine, "before_cursor_execute", on_execute)
+
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    bot = StubBot(latency=api_latency / 1000)
+    dp = Dispatcher(storage=StorageContext, backend=MemoryStorage())
+    if use_unit_of_work:
+        scope_handlers(unit_of_work, user_finally, user_router)
+    dp.include_routers(user_finally, user_router)
+    await dp.startup(bot)
+
+    test = LoadTest(dp, bot)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(uid: int) -> None:
+        async with limit:
+            await test.user_day(uid, sessions, targets)
+
+    print(
+        f"{engine.dialect.name}: {users} пользователей, {sessions} сессий, "
+        f"{targets} целей, параллельно {concurrency}, задержка API {api_latency} мс"
+        + (", unit of work" if use_unit_of_work else "")
+    )
+    started = time.perf_counter()
+    await asyncio.gather(*(one(base_uid + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+
+    test.report(elapsed, errors.count)
+    sa_event.remove(engine.sync_engine, "before_cursor_execute", on_execute)
+    await engine.dispose()
+    return 1 if errors.count else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=2)
+    parser.add_argument("--targets", type=int, default=3)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="мс на вызов API")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument(
+        "--base-uid", type=int, default=BASE_UID, help="первый user_id (для повторных прогонов по одной базе)"
+    )
+    parser.add_argument(
+        "--unit-of-work", action="store_true", help="одна транзакция БД на обновление"
+    )
+    args = parser.parse_args()
+    sys.exit(
+        asyncio.run(
+            main(
+                args.users,
+                args.sessions,
+                args.targets,
+                args.api_latency,
+                args.concurrency,
+                args.base_uid,
+                args.unit_of_work,
+            )
+        )
+    )
@@ -0,0 +1,202 @@
+"""
+Ночной расчёт поинтов и уровней: поштучный calculate_points_and_level против
+calculate_points_and_levels_batch (два UPDATE на всех пользователей пояса).
+
+Запуск (по умолчанию — временная SQLite-база):
+    python -m benchmarks.scoring --users 100000 --legacy-sample 1000
+Для PostgreSQL укажите BENCH_DATABASE_URL=postgresql+asyncpg://...
+
+Поштучный расчёт прогоняется на --legacy-sample пользователях и
+экстраполируется на всех; результат batch сверяется с расчётом в Python
+по тем же исходным данным.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time as timer
+from datetime import datetime, date, time, timedelta
+
+_tmp_db = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{_tmp_db}"
+)
+
+from sqlalchemy import bindparam, event, insert, select, update  # noqa: E402
+
+from core.database.models import (  # noqa: E402
+    async_main,
+    async_session,
+    engine,
+    User,
+    Target,
+    Session,
+    DailyActivity,
+)
+from utils.cfg_points import (  # noqa: E402
+    ACTIVITY_BONUS,
+    ACTIVITY_BONUS_AFTER,
+    BOOST,
+    NO_TARGETS_PENALTY,
+    calculate_points_and_level,
+    calculate_points_and_levels_batch,
+    levels,
+    xyz,
+)
+from utils.dates import DEFAULT_UTC_OFFSET, local_today  # noqa: E402
+
+CHUNK = 10000
+
+
+async def seed(users: int, day: date) -> dict[int, tuple[int, int, int, int, float]]:
+    """
+    Пользователи с 0–5 целями за день (часть выполнена) и активностью 0–5 ч:
+    закрытая сессия (её читает поштучный расчёт) и её свёртка в daily_activity.
+    Возвращает {tid: (points, level, целей, выполнено, секунд активности)}.
+    """
+    noon = datetime.combine(day, time(12))
+    morning = datetime.combine(day, time(6))
+    state = {}
+    user_rows, target_rows, session_rows, activity_rows = [], [], [], []
+    for tid in range(1, users + 1):
+        points = random.randint(0, 1200)
+        level = levels.level_for(points)
+        total = random.choice((0, 0, 1, 2, 3, 4, 5))
+        done = random.randint(0, total)
+        seconds = random.choice((0.0, random.uniform(0, 5 * 3600)))
+        state[tid] = (points, level, total, done, seconds)
+        user_rows.append({"tid": tid, "chat_id": tid, "points": points, "level": level})
+        target_rows.extend(
+            {"user_id": tid, "description": f"цель {n}", "date_add": noon, "is_done": n < done}
+            for n in range(total)
+        )
+        if seconds:
+            session_rows.append(
+                {
+                    "user_id": tid,
+                    "target_id": None,
+                    "date_start": morning,
+                    "date_end": morning + timedelta(seconds=seconds),
+                    "is_active": False,
+                }
+            )
+            activity_rows.append({"user_id": tid, "target_id": 0, "day": day, "seconds": seconds})
+
+    async with async_session() as session:
+        for table, rows in (
+            (User, user_rows),
+            (Target, target_rows),
+            (Session, session_rows),
+            (DailyActivity, activity_rows),
+        ):
+            for i in range(0, len(rows), CHUNK):
+                await session.execute(insert(table), rows[i : i + CHUNK])
+        await session.commit()
+    return state
+
+
+def expected(state, levels) -> dict[int, tuple[int, int]]:
+    result = {}
+    for tid, (points, level, total, done, seconds) in state.items():
+        if total == 0:
+            earned = NO_TARGETS_PENALTY
+        else:
+            earned = xyz(total, done, BOOST)
+            if seconds > ACTIVITY_BONUS_AFTER.total_seconds():
+                earned += ACTIVITY_BONUS
+        points = max(points + earned, 0)
+        for threshold, candidate in levels:
+            if points >= threshold:
+                level = max(level, candidate)
+        result[tid] = (points, level)
+    return result
+
+
+async def snapshot() -> dict[int, tuple[int, int]]:
+    async with async_session() as session:
+        res = await session.execute(select(User.tid, User.points, User.level))
+        return {tid: (points, level) for tid, points, level in res.all()}
+
+
+async def main(users: int, legacy_sample: int) -> int:
+    await async_main()
+    day = local_today(DEFAULT_UTC_OFFSET)  # поштучный расчёт берёт «сегодня» пользователя
+    started = timer.perf_counter()
+    state = await seed(users, day)
+    print(
+        f"{engine.dialect.name}: {users} пользователей за {day}, "
+        f"посев {timer.perf_counter() - started:.1f}с"
+    )
+
+    statements = 0
+
+    def on_execute(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", on_execute)
+
+    # поштучно — на выборке, с подавленным выводом print
+    sample = random.sample(sorted(state), min(legacy_sample, users))
+    statements = 0
+    started = timer.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tid in sample:
+            await calculate_points_and_level(tid)
+    legacy_elapsed = timer.perf_counter() - started
+    legacy_statements = statements
+    legacy = await snapshot()
+
+    # откат к исходным поинтам и уровням
+    async with async_session() as session:
+        for i in range(0, users, CHUNK):
+            tids = list(range(i + 1, min(i + CHUNK, users) + 1))
+            await session.execute(
+                update(User.__table__)
+                .where(User.__table__.c.tid == bindparam("b_tid"))
+                .values(points=bindparam("b_points"), level=bindparam("b_level")),
+                [
+                    {"b_tid": tid, "b_points": state[tid][0], "b_level": state[tid][1]}
+                    for tid in tids
+                ],
+            )
+        await session.commit()
+
+    statements = 0
+    started = timer.perf_counter()
+    await calculate_points_and_levels_batch(day, DEFAULT_UTC_OFFSET)
+    batch_elapsed = timer.perf_counter() - started
+    batch_statements = statements
+    event.remove(engine.sync_engine, "before_cursor_execute", on_execute)
+    got = await snapshot()
+
+    per_user = legacy_elapsed / len(sample)
+    print(
+        f"  поштучно {per_user * 1000:8.3f} мс/польз., {legacy_statements / len(sample):.1f} "
+        f"SQL/польз. -> на {users}: ~{per_user * users:.1f}с"
+    )
+    print(f"  batch    {batch_elapsed:8.3f} с на всех, {batch_statements} SQL")
+    print(f"  ускорение ~{per_user * users / batch_elapsed:.0f}x")
+
+    want = expected(state, levels.items())
+    wrong = [tid for tid in want if got[tid] != want[tid]]
+    legacy_wrong = [tid for tid in sample if legacy[tid] != want[tid]]
+    print(f"  расхождений batch: {len(wrong)}, поштучного: {len(legacy_wrong)}")
+    if wrong:
+        tid = wrong[0]
+        print(f"  !!! tid={tid}: {state[tid]} -> ожидалось {want[tid]}, получено {got[tid]}")
+
+    await engine.dispose()
+    return 1 if wrong or legacy_wrong else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--legacy-sample", type=int, default=1000)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args.users, args.legacy_sample)))
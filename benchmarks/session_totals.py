@@ -0,0 +1,157 @@
+"""
+Сравнение SQL-агрегатов SessionCRUD со старым подсчётом в Python-цикле.
+
+Запуск (по умолчанию — временная SQLite-база):
+    python -m benchmarks.session_totals --sessions 5000 --repeat 20
+Для PostgreSQL укажите BENCH_DATABASE_URL=postgresql+asyncpg://...
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time as timer
+from datetime import datetime, timedelta, date, time
+
+_tmp_db = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{_tmp_db}"
+)
+
+from sqlalchemy import select, and_, insert  # noqa: E402
+
+from core.database.models import async_main, async_session, engine, Session  # noqa: E402
+from core.database.requests import SessionCRUD  # noqa: E402
+
+USER_ID = 1
+TARGET_ID = 1
+
+
+# ---------- Старые реализации (материализация ORM-объектов) ----------
+async def legacy_total_on_date(user_id: int, day: date) -> timedelta:
+    start_of_day = datetime.combine(day, time.min)
+    end_of_day = datetime.combine(day + timedelta(days=1), time.min)
+    async with async_session() as session:
+        res = await session.execute(
+            select(Session).where(
+                and_(
+                    Session.user_id == user_id,
+                    Session.date_start < end_of_day,
+                    Session.date_end >= start_of_day,
+                )
+            )
+        )
+        sessions = res.scalars().all()
+    total = timedelta(0)
+    for s in sessions:
+        start = max(s.date_start, start_of_day)
+        end = min(s.date_end, end_of_day)
+        if end > start:
+            total += end - start
+    return total
+
+
+async def legacy_total_for_week(user_id: int, today: date) -> timedelta:
+    start_of_week = today - timedelta(days=today.weekday())
+    end_of_week = start_of_week + timedelta(days=7)
+    async with async_session() as session:
+        res = await session.execute(
+            select(Session).where(
+                and_(
+                    Session.user_id == user_id,
+                    Session.date_start < end_of_week,
+                    Session.date_end >= start_of_week,
+                )
+            )
+        )
+        sessions = res.scalars().all()
+    total = timedelta(0)
+    for s in sessions:
+        start = max(s.date_start, datetime.combine(start_of_week, time.min))
+        end = min(s.date_end, datetime.combine(end_of_week, time.min))
+        if end > start:
+            total += end - start
+    return total
+
+
+async def legacy_total_for_target(target_id: int) -> timedelta:
+    async with async_session() as session:
+        res = await session.execute(select(Session).where(Session.target_id == target_id))
+        sessions = res.scalars().all()
+    total = timedelta(0)
+    for s in sessions:
+        if s.date_end and s.date_start:
+            total += s.date_end - s.date_start
+    return total
+
+
+async def seed(count: int, today: date) -> None:
+    """Сессии равномерно за последние 30 дней, часть переходит через полночь."""
+    base = datetime.combine(today, time.min) - timedelta(days=30)
+    rows = []
+    for _ in range(count):
+        start = base + timedelta(seconds=random.randint(0, 31 * 86400))
+        rows.append(
+            {
+                "user_id": USER_ID,
+                "target_id": TARGET_ID,
+                "date_start": start,
+                "date_end": start + timedelta(seconds=random.randint(60, 4 * 3600)),
+                "is_active": False,
+            }
+        )
+    async with async_session() as session:
+        await session.execute(insert(Session), rows)
+        await session.commit()
+
+
+async def measure(name: str, func, repeat: int):
+    started = timer.perf_counter()
+    for _ in range(repeat):
+        result = await func()
+    elapsed = (timer.perf_counter() - started) / repeat * 1000
+    print(f"  {name:<8} {elapsed:9.2f} ms/вызов  -> {result}")
+    return result
+
+
+async def main(sessions: int, repeat: int) -> None:
+    await async_main()
+    today = date.today()
+    await seed(sessions, today)
+    print(f"{engine.dialect.name}: {sessions} сессий, {repeat} повторов")
+
+    cases = [
+        (
+            "total_active_time_on_date",
+            lambda: legacy_total_on_date(USER_ID, today),
+            lambda: SessionCRUD.total_active_time_on_date(USER_ID, today),
+        ),
+        (
+            "get_total_time_for_week",
+            lambda: legacy_total_for_week(USER_ID, today),
+            lambda: SessionCRUD.get_total_time_for_week(USER_ID, today),
+        ),
+        (
+            "get_total_time_for_target",
+            lambda: legacy_total_for_target(TARGET_ID),
+            lambda: SessionCRUD.get_total_time_for_target(TARGET_ID),
+        ),
+    ]
+    for title, legacy, sql in cases:
+        print(title)
+        expected = await measure("python", legacy, repeat)
+        got = await measure("sql", sql, repeat)
+        drift = abs((expected - got).total_seconds())
+        if drift > 0.01:
+            print(f"  !!! расхождение {drift:.3f} c")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.repeat))
@@ -0,0 +1,237 @@
+"""
+Обслуживание схемы и данных для уже существующих баз.
+
+    python -m core.database.migrations backfill_daily_activity
+    python -m core.database.migrations create_indexes
+    python -m core.database.migrations check_indexes
+
+На SQLite индексы докатываются при старте бота (async_main). На PostgreSQL
+существующую базу нужно один раз прогнать через create_indexes: индексы
+строятся CONCURRENTLY и не блокируют запись в таблицы.
+"""
+
+import argparse
+import asyncio
+import re
+import sys
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import Index, event, exists, select, delete, insert, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from core.database.models import (
+    DROPPED_INDEXES,
+    Base,
+    _missing_indexes,
+    _sync_indexes,
+    async_main,
+    async_session,
+    engine,
+    Session,
+    DailyActivity,
+    User,
+)
+from core.database.requests import (
+    UserCRUD,
+    TargetCRUD,
+    SessionCRUD,
+    ProfileCRUD,
+    DailyActivityCRUD,
+)
+from utils.dates import split_by_day
+
+
+async def backfill_daily_activity(batch_size: int = 500) -> int:
+    """
+    Пересобирает daily_activity из закрытых сессий — по одному пользователю
+    в короткой транзакции, в памяти только свёртка этого пользователя.
+    Бота останавливать не нужно (см. _rebuild_user_activity).
+    Возвращает количество строк свёртки.
+    """
+    count = 0
+    async for user in UserCRUD.iter_all(batch_size=batch_size, columns=(User.tid,)):
+        count += await _rebuild_user_activity(user.tid)
+
+    # свёртка пользователей, которых уже нет в users; NOT EXISTS, а не NOT IN:
+    # один NULL в users.tid сделал бы NOT IN ложным для всех строк
+    async with async_session() as session:
+        await session.execute(
+            delete(DailyActivity).where(
+                ~exists().where(User.tid == DailyActivity.user_id)
+            )
+        )
+        await session.commit()
+    return count
+
+
+async def _rebuild_user_activity(tid: int) -> int:
+    """
+    Заменяет свёртку одного пользователя суммами по его закрытым сессиям,
+    разбитым по местным дням (users.utc_offset).
+    Порядок блокировок тот же, что у закрытия сессии (sessions, затем users):
+    закрытие, начатое раньше, успевает закоммитить и попадает в прочитанные
+    сессии, а начатое позже ждёт коммита и прибавляется upsert'ом поверх.
+    На SQLite FOR UPDATE не нужен — запись сериализует первый же DELETE.
+    """
+    async with async_session() as session:
+        await session.execute(
+            select(Session.id).where(Session.user_id == tid).with_for_update()
+        )
+        utc_offset = await session.scalar(
+            select(User.utc_offset).where(User.tid == tid).with_for_update()
+        )
+        await session.execute(delete(DailyActivity).where(DailyActivity.user_id == tid))
+
+        res = await session.execute(
+            select(Session.target_id, Session.date_start, Session.date_end).where(
+                Session.user_id == tid,
+                Session.is_active == False,
+                Session.date_start.is_not(None),
+                Session.date_end.is_not(None),
+            )
+        )
+        totals: dict[tuple[int, object], float] = defaultdict(float)
+        for row in res:
+            for day, seconds in split_by_day(row.date_start, row.date_end, utc_offset).items():
+                totals[(row.target_id or 0, day)] += seconds
+
+        values = [
+            {"user_id": tid, "target_id": target_id, "day": day, "seconds": seconds}
+            for (target_id, day), seconds in totals.items()
+        ]
+        for i in range(0, len(values), 1000):
+            await session.execute(insert(DailyActivity), values[i : i + 1000])
+        await session.commit()
+    return len(values)
+
+
+def _create_concurrently(index: Index) -> str:
+    """CREATE [UNIQUE] INDEX CONCURRENTLY ... для PostgreSQL."""
+    ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX CONCURRENTLY ", ddl)
+
+
+async def create_indexes() -> int:
+    """
+    Докатывает недостающие индексы на существующую базу. На PostgreSQL —
+    CREATE INDEX CONCURRENTLY вне транзакции (AUTOCOMMIT): запись в таблицы
+    не блокируется. Недостроенный после прерванной сборки индекс (INVALID)
+    удаляется и строится заново. Возвращает, сколько индексов создано.
+    """
+    if engine.dialect.name != "postgresql":
+        async with engine.begin() as conn:
+            missing = await conn.run_sync(_missing_indexes)
+            await conn.run_sync(_sync_indexes)
+        return len(missing)
+
+    created = 0
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                valid = await conn.scalar(
+                    text(
+                        "SELECT i.indisvalid FROM pg_index i "
+                        "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+                    ),
+                    {"name": index.name},
+                )
+                if valid:
+                    continue
+                if valid is False:
+                    await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}")
+                print(f"🔨 {index.name}")
+                await conn.exec_driver_sql(_create_concurrently(index))
+                created += 1
+        for name in DROPPED_INDEXES:
+            await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    return created
+
+
+async def _capture_read_queries() -> list[tuple[str, object]]:
+    """Прогоняет горячие read-запросы CRUD и собирает фактический SQL с параметрами."""
+    captured = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", on_execute)
+    try:
+        today = date.today()
+        await UserCRUD.get_by_tid(0)
+        await TargetCRUD.get_all_target_today(0)
+        await TargetCRUD.has_targets_today(0)
+        await SessionCRUD.get_active_session(0)
+        await SessionCRUD.get_all_active_session()
+        await SessionCRUD.get_all_active_session_by_user(0)
+        await SessionCRUD.list_by_user_on_date(0, today)
+        await SessionCRUD.total_active_time_on_date(0, today)
+        await SessionCRUD.get_total_time_for_week(0, today)
+        await ProfileCRUD.get(0)
+        await DailyActivityCRUD.total_for_range(0, today, today)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", on_execute)
+    return captured
+
+
+def _full_scans(plan: list[str]) -> list[str]:
+    if engine.dialect.name == "sqlite":
+        # "SCAN sessions" без "USING ... INDEX" — полный проход по таблице
+        return [
+            line
+            for line in plan
+            if line.startswith("SCAN ") and "INDEX" not in line and "CONSTANT" not in line
+        ]
+    return [line for line in plan if "Seq Scan" in line]
+
+
+async def check_indexes() -> bool:
+    """
+    EXPLAIN для каждого горячего запроса: True, если ни один не сканирует таблицу целиком.
+    На PostgreSQL seqscan отключается на время проверки — на пустых таблицах
+    планировщик иначе всегда выбирает его.
+    """
+    queries = await _capture_read_queries()
+    ok = True
+    async with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        else:
+            prefix = "EXPLAIN "
+            await conn.exec_driver_sql("SET enable_seqscan = off")
+        for statement, parameters in queries:
+            res = await conn.exec_driver_sql(prefix + statement, parameters)
+            plan = [str(row[-1]).strip() for row in res.all()]
+            scans = _full_scans(plan)
+            head = " ".join(statement.split())[:90]
+            if scans:
+                ok = False
+                print(f"❌ {head}\n    {'; '.join(scans)}")
+            else:
+                print(f"✅ {head}")
+    return ok
+
+
+async def _run(command: str) -> int:
+    await async_main()
+    code = 0
+    if command == "backfill_daily_activity":
+        count = await backfill_daily_activity()
+        print(f"✅ daily_activity пересобрана: {count} строк")
+    elif command == "create_indexes":
+        count = await create_indexes()
+        print(f"✅ Создано индексов: {count}")
+    elif command == "check_indexes":
+        code = 0 if await check_indexes() else 1
+    await engine.dispose()
+    return code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["backfill_daily_activity", "create_indexes", "check_indexes"])
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_run(args.command)))
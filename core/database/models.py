@@ -7,23 +7,92 @@ from sqlalchemy import (
     Integer,
     Boolean,
     DateTime,
+    Date,
+    Float,
+    Index,
+    UniqueConstraint,
+    inspect,
+    text,
+    event,
 )
-from datetime import datetime
+from sqlalchemy.engine import URL, make_url
+from datetime import datetime, date
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
-from utils.dates import UTC_PLUS_3
+from utils.dates import DEFAULT_UTC_OFFSET, server_now
 from dotenv import load_dotenv
 
 load_dotenv()
 
-engine = create_async_engine(
-    url=os.getenv("DATABASE_URL"),
-    echo=False,
-)
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes", "on")
+
+
+def _engine_options(url: URL) -> dict:
+    """
+    Настройки пула и драйвера из окружения:
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+        DB_STATEMENT_CACHE_SIZE — кэш подготовленных запросов asyncpg (0 за pgbouncer)
+        SQLITE_WAL, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT (мс) — прагмы SQLite
+    """
+    options: dict = {"echo": _env_bool("DB_ECHO", False)}
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return options
+        options["connect_args"] = {"timeout": _env_int("SQLITE_BUSY_TIMEOUT", 5000) / 1000}
+
+    options.update(
+        pool_size=_env_int("DB_POOL_SIZE", 10),
+        max_overflow=_env_int("DB_MAX_OVERFLOW", 20),
+        pool_timeout=_env_int("DB_POOL_TIMEOUT", 30),
+        pool_recycle=_env_int("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=_env_bool("DB_POOL_PRE_PING", False),
+    )
+    if url.get_driver_name() == "asyncpg":
+        cache_size = _env_int("DB_STATEMENT_CACHE_SIZE", 100)
+        options["connect_args"] = {"statement_cache_size": cache_size}
+    return options
+
+
+def _database_url() -> URL:
+    url = make_url(os.getenv("DATABASE_URL"))  # type: ignore
+    if url.get_driver_name() == "asyncpg" and "prepared_statement_cache_size" not in url.query:
+        # кэш SQLAlchemy поверх asyncpg — тот же размер, что и у драйвера
+        url = url.update_query_dict(
+            {"prepared_statement_cache_size": str(_env_int("DB_STATEMENT_CACHE_SIZE", 100))}
+        )
+    return url
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    if _env_bool("SQLITE_WAL", True):
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT', 5000)}")
+    cursor.close()
+
+
+_url = _database_url()
+engine = create_async_engine(_url, **_engine_options(_url))
+if _url.get_backend_name() == "sqlite" and _url.database not in (None, "", ":memory:"):
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
 
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
+def pool_capacity() -> int | None:
+    """Сколько соединений пул выдаст одновременно; None — пул без ограничения."""
+    options = _engine_options(_url)
+    if "pool_size" not in options:
+        return None
+    return options["pool_size"] + options["max_overflow"]
+
+
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
@@ -42,9 +111,20 @@ class User(Base):
     state: Mapped[str] = mapped_column(String(255), default="Default")
 
     date_add: Mapped[DateTime] = mapped_column(
-        DateTime, default=datetime.now(UTC_PLUS_3)
+        DateTime, default=server_now
+    )
+    # часовой пояс: смещение от UTC в минутах, по нему ночной переход дня
+    utc_offset: Mapped[int] = mapped_column(
+        Integer,
+        default=DEFAULT_UTC_OFFSET,
+        server_default=str(DEFAULT_UTC_OFFSET),
+        index=True,
     )
-    count_time: Mapped[str | None] = mapped_column(DateTime, nullable=True)
+    # накопленное время активности в секундах
+    total_seconds: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    # устарело: DateTime вида EPOCH + секунды, переносится в total_seconds
+    # при старте (_convert_count_time), после переноса — NULL. Колонка не пишется.
+    count_time: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     targets: Mapped[list["Target"]] = relationship(
         back_populates="user",
@@ -63,15 +143,18 @@ class User(Base):
 
 class Target(Base):
     __tablename__ = "targets"
+    __table_args__ = (
+        # get_all_target_today: user_id = ? AND date_add в диапазоне дня
+        Index("ix_targets_user_id_date_add", "user_id", "date_add"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"),
-        index=True,
     )
     description: Mapped[str] = mapped_column(String(1500))
     date_add: Mapped[DateTime] = mapped_column(
-        DateTime, default=datetime.now(UTC_PLUS_3)
+        DateTime, default=server_now
     )
     is_done: Mapped[bool] = mapped_column(Boolean, default=False)
 
@@ -85,11 +168,29 @@ class Target(Base):
 
 class Session(Base):
     __tablename__ = "sessions"
+    __table_args__ = (
+        # выборки сессий пользователя по окну дня/недели
+        Index(
+            "ix_sessions_user_id_date_start_date_end",
+            "user_id",
+            "date_start",
+            "date_end",
+        ),
+        # get_active_session / get_all_active_session_by_user
+        Index("ix_sessions_user_id_is_active", "user_id", "is_active"),
+        # частичный индекс: активных сессий единицы, а get_all_active_session
+        # иначе сканирует всю таблицу
+        Index(
+            "ix_sessions_active",
+            "user_id",
+            sqlite_where=text("is_active = 1"),
+            postgresql_where=text("is_active"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"),
-        index=True,
     )
 
     target_id: Mapped[int | None] = mapped_column(
@@ -100,7 +201,7 @@ class Session(Base):
     date_end: Mapped[datetime] = mapped_column(DateTime)
     is_active: Mapped[bool] = mapped_column(Boolean, default=False)
     date_add: Mapped[DateTime] = mapped_column(
-        DateTime, default=datetime.now(UTC_PLUS_3)
+        DateTime, default=server_now
     )
 
     user: Mapped[User] = relationship(back_populates="sessions")
@@ -111,6 +212,172 @@ class Session(Base):
         return f"<Session id={self.id} user_id={self.user_id} date_start={self.date_start} date_end={self.date_end} active={self.is_active}>"
 
 
+class DailyActivity(Base):
+    """Свёртка закрытых сессий: секунды активности на (пользователь, цель, день)."""
+
+    __tablename__ = "daily_activity"
+    # порядок колонок: выборки по user_id + диапазону дней идут по префиксу
+    __table_args__ = (UniqueConstraint("user_id", "day", "target_id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # tid пользователя, как и sessions.user_id — поэтому без внешнего ключа на users.id
+    user_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    # 0 — сессия без цели (цель удалена или не указана)
+    target_id: Mapped[int] = mapped_column(Integer, default=0, index=True)
+    day: Mapped[date] = mapped_column(Date)
+    seconds: Mapped[float] = mapped_column(Float, default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailyActivity user_id={self.user_id} target_id={self.target_id} day={self.day} seconds={self.seconds}>"
+
+
+class ScoredDay(Base):
+    """
+    Отметка «местный день day пояса utc_offset уже оценён» (SCORING_MODE=batch).
+    Пишется в одной транзакции с начислением поинтов: уникальный ключ не даёт
+    оценить день дважды (повторный тик, несколько реплик).
+    """
+
+    __tablename__ = "scored_days"
+    __table_args__ = (UniqueConstraint("utc_offset", "day"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    utc_offset: Mapped[int] = mapped_column(Integer)
+    day: Mapped[date] = mapped_column(Date)
+    scored_at: Mapped[datetime] = mapped_column(DateTime, default=server_now)
+
+    def __repr__(self) -> str:
+        return f"<ScoredDay utc_offset={self.utc_offset} day={self.day}>"
+
+
+# Одноколоночные индексы, которые перекрыты составными выше
+DROPPED_INDEXES = ("ix_targets_user_id", "ix_sessions_user_id")
+
+
+def _missing_indexes(conn) -> list[Index]:
+    insp = inspect(conn)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = {ix["name"] for ix in insp.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+
+def _sync_indexes(conn) -> None:
+    """
+    create_all не трогает существующие таблицы — докатываем на них новые индексы.
+    На PostgreSQL обычный CREATE INDEX блокирует запись в таблицу на всё время
+    сборки, поэтому на существующей базе индексы строит только
+    `python -m core.database.migrations create_indexes` (CONCURRENTLY),
+    а при старте бот лишь сообщает о недостающих.
+    """
+    if conn.dialect.name == "postgresql":
+        missing = _missing_indexes(conn)
+        if missing:
+            print(
+                f"⚠️ Нет индексов: {', '.join(index.name for index in missing)} — "
+                f"запустите python -m core.database.migrations create_indexes"
+            )
+        return
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    for name in DROPPED_INDEXES:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def _add_total_seconds_column(conn) -> None:
+    """Добавляет users.total_seconds в старую базу."""
+    columns = {c["name"] for c in inspect(conn).get_columns("users")}
+    if "total_seconds" not in columns:
+        # ADD COLUMN с константным DEFAULT не переписывает таблицу (SQLite, PostgreSQL 11+)
+        conn.exec_driver_sql(
+            "ALTER TABLE users ADD COLUMN total_seconds BIGINT NOT NULL DEFAULT 0"
+        )
+
+
+def _add_utc_offset_column(conn) -> None:
+    """Добавляет users.utc_offset в старую базу (до _sync_indexes — на ней индекс)."""
+    columns = {c["name"] for c in inspect(conn).get_columns("users")}
+    if "utc_offset" not in columns:
+        conn.exec_driver_sql(
+            f"ALTER TABLE users ADD COLUMN utc_offset INTEGER NOT NULL DEFAULT {DEFAULT_UTC_OFFSET}"
+        )
+
+
+def _drop_daily_activity_fk(conn) -> None:
+    """
+    В старых базах daily_activity.user_id ссылается на users.id, а пишется туда tid:
+    убираем внешний ключ. PostgreSQL — DROP CONSTRAINT, SQLite умеет только
+    пересобрать таблицу (свёртка небольшая, копируется одним INSERT ... SELECT).
+    """
+    foreign_keys = [
+        fk
+        for fk in inspect(conn).get_foreign_keys("daily_activity")
+        if fk["referred_table"] == "users"
+    ]
+    if not foreign_keys:
+        return
+    if conn.dialect.name != "sqlite":
+        for fk in foreign_keys:
+            name = fk["name"]
+            conn.exec_driver_sql(f'ALTER TABLE daily_activity DROP CONSTRAINT "{name}"')
+        conn.exec_driver_sql("ALTER TABLE daily_activity ALTER COLUMN user_id TYPE BIGINT")
+        return
+
+    table = DailyActivity.__table__
+    for index in inspect(conn).get_indexes("daily_activity"):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index['name']}")
+    conn.exec_driver_sql("ALTER TABLE daily_activity RENAME TO daily_activity_old")
+    table.create(conn)
+    columns = ", ".join(column.name for column in table.columns)
+    conn.exec_driver_sql(
+        f"INSERT INTO daily_activity ({columns}) SELECT {columns} FROM daily_activity_old"
+    )
+    conn.exec_driver_sql("DROP TABLE daily_activity_old")
+
+
+# count_time обнуляется тем же UPDATE, что переносит его в total_seconds:
+# NULL — признак перенесённой строки, не зависящий от значения total_seconds
+_NOT_CONVERTED = "count_time IS NOT NULL"
+
+
+async def _convert_count_time(batch_size: int = 10000) -> None:
+    """
+    Переносит count_time (EPOCH + секунды) в total_seconds пачками по id,
+    каждая пачка — отдельная короткая транзакция, таблица не блокируется целиком.
+    Перенесённой строке в том же UPDATE ставится count_time = NULL, поэтому
+    прерванный перенос безопасно продолжается при следующем старте, а
+    перенесённое время не начисляется повторно. Время, набранное после
+    добавления total_seconds, сохраняется — count_time к нему прибавляется.
+    """
+    if engine.dialect.name == "sqlite":
+        seconds = "CAST(ROUND((julianday(count_time) - 2440587.5) * 86400) AS INTEGER)"
+    else:
+        seconds = "CAST(ROUND(EXTRACT(EPOCH FROM count_time)) AS BIGINT)"
+
+    async with engine.connect() as conn:
+        bounds = (
+            await conn.execute(
+                text(f"SELECT MIN(id), MAX(id) FROM users WHERE {_NOT_CONVERTED}")
+            )
+        ).one()
+    if bounds[0] is None:
+        return
+    update = text(
+        f"UPDATE users SET total_seconds = total_seconds + {seconds}, count_time = NULL "
+        f"WHERE {_NOT_CONVERTED} AND id > :lo AND id <= :hi"
+    )
+    for lo in range(bounds[0] - 1, bounds[1], batch_size):
+        async with engine.begin() as conn:
+            await conn.execute(update, {"lo": lo, "hi": lo + batch_size})
+
+
 async def async_main():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_utc_offset_column)
+        await conn.run_sync(_drop_daily_activity_fk)
+        await conn.run_sync(_sync_indexes)
+        await conn.run_sync(_add_total_seconds_column)
+    await _convert_count_time()
@@ -1,15 +1,174 @@
-from datetime import datetime, timedelta, timezone, date, time
-from typing import Optional, Sequence, Union
-from sqlalchemy import select, update, delete
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, date
+from typing import Callable, Optional, Sequence, Union
+from sqlalchemy import select, insert, update, delete, func, extract, bindparam, case, DateTime
 from sqlalchemy.exc import IntegrityError
-from core.database.models import async_session, User, Target, Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.database.models import (
+    engine,
+    async_session,
+    User,
+    Target,
+    Session,
+    DailyActivity,
+    ScoredDay,
+)
+from utils.dates import checkoff_day, day_bounds, local_today, split_by_day
+from utils.targets_cache import targets_today
 from sqlalchemy import and_
 from sqlalchemy.orm import selectinload
 
-EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 DurationInput = Union[int, float, timedelta]
 
 
+# ---------- SQL helpers ----------
+def _is_sqlite() -> bool:
+    return engine.dialect.name == "sqlite"
+
+
+def _seconds_between(start, end):
+    """SQL-выражение: длительность интервала (end - start) в секундах."""
+    if _is_sqlite():
+        return (func.julianday(end) - func.julianday(start)) * 86400.0
+    return extract("epoch", end - start)
+
+
+def _clipped_seconds(lo: datetime, hi: datetime):
+    """SQL-выражение: длительность сессии, обрезанной окном [lo, hi), в секундах."""
+    if _is_sqlite():
+        start = func.max(Session.date_start, lo)
+        end = func.min(Session.date_end, hi)
+    else:
+        start = func.greatest(Session.date_start, lo, type_=DateTime)
+        end = func.least(Session.date_end, hi, type_=DateTime)
+    return _seconds_between(start, end)
+
+
+def _greatest(a, b, type_=None):
+    """SQL GREATEST(a, b): на SQLite это скалярная max(a, b)."""
+    if _is_sqlite():
+        return func.max(a, b, type_=type_)
+    return func.greatest(a, b, type_=type_)
+
+
+def _overlaps_window(user_id, lo: datetime, hi: datetime):
+    """Сессии пользователя с ненулевым пересечением с окном [lo, hi)."""
+    return and_(
+        Session.user_id == user_id,
+        Session.date_start < hi,
+        Session.date_end >= lo,
+        Session.date_end > Session.date_start,
+    )
+
+
+def _to_timedelta(seconds) -> timedelta:
+    # julianday даёт погрешность в десятки микросекунд на сессию, и на сумме она
+    # доходит до миллисекунд: 6:34:19 превращалось в 6:34:18.999, а format_duration
+    # отбрасывает дробь. Показываем целые секунды — округляем до них
+    return timedelta(seconds=round(float(seconds or 0)))
+
+
+# ---------- Unit of work ----------
+_unit: ContextVar[Optional[AsyncSession]] = ContextVar("db_unit_of_work", default=None)
+
+
+class _UnitSession:
+    """
+    Сессия unit_of_work в том виде, в каком её видят методы CRUD:
+    commit() только сбрасывает изменения (flush), транзакцию фиксирует
+    владелец unit_of_work. Запросы идут с populate_existing, чтобы объекты
+    из identity map обновлялись после UPDATE в той же единице работы.
+    rollback() откатывает всю единицу работы.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    @staticmethod
+    def _fresh(kwargs: dict) -> dict:
+        options = kwargs.get("execution_options") or {}
+        kwargs["execution_options"] = {"populate_existing": True, **options}
+        return kwargs
+
+    async def commit(self) -> None:
+        await self._session.flush()
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await self._session.execute(statement, params, **self._fresh(kwargs))
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return await self._session.scalars(statement, params, **self._fresh(kwargs))
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await self._session.scalar(statement, params, **self._fresh(kwargs))
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """
+    Одна сессия и одна транзакция на блок (например, на обработку обновления):
+    методы CRUD внутри берут её из contextvar вместо своей async_session().
+    Коммит — при выходе без исключения, иначе откат. Вложенный вызов
+    переиспользует внешнюю единицу работы.
+    """
+    current = _unit.get()
+    if current is not None:
+        yield current
+        return
+    async with async_session() as session:
+        token = _unit.set(session)
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            _unit.reset(token)
+        for callback, arg in session.info.pop("after_commit", ()):
+            callback(arg)
+
+
+async def checkpoint() -> None:
+    """
+    Фиксирует текущую единицу работы перед долгим внешним вызовом (запросом
+    к Max API): изменения коммитятся, соединение возвращается в пул, а
+    следующие запросы хендлера начнут новую транзакцию в той же сессии.
+    Вне unit_of_work и без открытой транзакции ничего не делает.
+    """
+    current = _unit.get()
+    if current is None or not current.in_transaction():
+        return
+    await current.commit()
+    for callback, arg in current.info.pop("after_commit", ()):
+        callback(arg)
+
+
+@asynccontextmanager
+async def _session_scope():
+    """Сессия текущего unit_of_work, а вне его — своя на один вызов CRUD."""
+    current = _unit.get()
+    if current is not None:
+        yield _UnitSession(current)
+        return
+    async with async_session() as session:
+        yield session
+
+
+def _after_commit(callback: Callable[[int], None], arg: int) -> None:
+    """Обновление кэшей после фиксации: сразу или по коммиту unit_of_work."""
+    current = _unit.get()
+    if current is None:
+        callback(arg)
+    else:
+        current.info.setdefault("after_commit", []).append((callback, arg))
+
+
 # ---------- Users ----------
 class UserCRUD:
     @staticmethod
@@ -21,9 +180,9 @@ class UserCRUD:
         username: Optional[str],
         points: int = 50,
         level: int = 1,
-        count_time: Optional[str | None] = None,
+        total_seconds: int = 0,
     ) -> User:
-        async with async_session() as session:
+        async with _session_scope() as session:
             user = User(
                 tid=tid,
                 chat_id=chat_id,
@@ -31,7 +190,7 @@ class UserCRUD:
                 username=username,
                 points=points,
                 level=level,
-                count_time=count_time,
+                total_seconds=total_seconds,
             )
             session.add(user)
             try:
@@ -44,24 +203,64 @@ class UserCRUD:
 
     @staticmethod
     async def get_by_id(user_id: int) -> Optional[User]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(select(User).where(User.id == user_id))
             return res.scalar_one_or_none()
 
     @staticmethod
     async def get_by_tid(tid: int) -> Optional[User]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(select(User).where(User.tid == tid))
             return res.scalar_one_or_none()
 
     @staticmethod
     async def list(limit: int = 100, offset: int = 0) -> Sequence[User]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(User).order_by(User.id).limit(limit).offset(offset)
             )
             return res.scalars().all()
 
+    @staticmethod
+    async def count(*where) -> int:
+        async with _session_scope() as session:
+            res = await session.execute(select(func.count(User.id)).where(*where))
+            return res.scalar_one()
+
+    @staticmethod
+    async def iter_all(batch_size: int = 1000, columns: Sequence = (), where: Sequence = ()):
+        """
+        Отдаёт всех пользователей пачками по keyset-пагинации (id > last_id).
+        columns — если заданы (например User.tid, User.chat_id), выбираются только они
+        (плюс id) и отдаются строки, а не ORM-объекты.
+        where — дополнительные условия отбора (например, User.utc_offset.in_(...)).
+        Сессия закрывается между пачками, соединение не держится на время обработки.
+        """
+        last_id = 0
+        while True:
+            async with async_session() as session:
+                if columns:
+                    res = await session.execute(
+                        select(User.id, *columns)
+                        .where(User.id > last_id, *where)
+                        .order_by(User.id)
+                        .limit(batch_size)
+                    )
+                    rows = res.all()
+                else:
+                    res = await session.execute(
+                        select(User)
+                        .where(User.id > last_id, *where)
+                        .order_by(User.id)
+                        .limit(batch_size)
+                    )
+                    rows = res.scalars().all()
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+
     @staticmethod
     async def update(
         user_id: int,
@@ -72,8 +271,9 @@ class UserCRUD:
         level: Optional[int] = None,
         score: Optional[int] = None,
         state: Optional[str] = None,
-        count_time: Optional[str | None] = None,
+        total_seconds: Optional[int] = None,
         tid: Optional[int] = None,
+        utc_offset: Optional[int] = None,
     ) -> Optional[User]:
         values = {}
         if name is not None:
@@ -88,12 +288,14 @@ class UserCRUD:
             values["score"] = score
         if state is not None:
             values["state"] = state
-        if count_time is not None:
-            values["count_time"] = count_time
+        if total_seconds is not None:
+            values["total_seconds"] = total_seconds
         if tid is not None:
             values["tid"] = tid
+        if utc_offset is not None:
+            values["utc_offset"] = utc_offset
 
-        async with async_session() as session:
+        async with _session_scope() as session:
             if values:
                 try:
                     await session.execute(
@@ -103,6 +305,9 @@ class UserCRUD:
                 except IntegrityError as e:
                     await session.rollback()
                     raise ValueError(f"Конфликт уникального tid: {e}") from e
+                if utc_offset is not None:
+                    # сменился пояс — сменились и границы «сегодня»
+                    _after_commit(targets_today.invalidate, user_id)
             res = await session.execute(select(User).where(User.tid == user_id))
             return res.scalar_one_or_none()
 
@@ -111,7 +316,7 @@ class UserCRUD:
         """
         Возвращает True, если пользователь существовал и был удалён.
         """
-        async with async_session() as session:
+        async with _session_scope() as session:
             # Проверка существования
             res = await session.execute(select(User.id).where(User.id == user_id))
             exists = res.scalar_one_or_none()
@@ -122,113 +327,173 @@ class UserCRUD:
             await session.commit()
             return True
 
+    @staticmethod
+    async def _shift_duration(user_id: int, seconds: float) -> Optional["User"]:
+        """Один UPDATE ... RETURNING: total_seconds += seconds с отсечкой на нуле."""
+        async with _session_scope() as session:
+            res = await session.scalars(
+                update(User)
+                .where(User.tid == user_id)
+                .values(
+                    total_seconds=_greatest(User.total_seconds + round(seconds), 0)
+                )
+                .returning(User)
+                .execution_options(synchronize_session=False)
+            )
+            user = res.one_or_none()
+            await session.commit()
+            return user
+
     @staticmethod
     async def add_duration(user_id: int, amount: DurationInput) -> Optional["User"]:
         """
-        Прибавляет длительность к полю count_time пользователя.
-        Храним как DateTime = EPOCH + total_seconds. Если count_time=None — считаем 0.
-        amount: timedelta | секунды (int/float).
+        Прибавляет длительность к total_seconds пользователя (целые секунды).
+        amount: timedelta | секунды (int/float). Отрицательное значение вычитает.
+        Сложение выполняется атомарно на стороне БД.
         """
-        # нормализуем вход
         seconds = (
             amount.total_seconds() if isinstance(amount, timedelta) else float(amount)
         )
-        if seconds < 0:
-            # если дали отрицательное — делегируем на subtract, либо считаем как вычитание
-            return await UserCRUD.subtract_duration(user_id, -seconds)
-
-        async with async_session() as session:
-            # забираем текущего пользователя
-            res = await session.execute(select(User).where(User.tid == user_id))
-            user = res.scalar_one_or_none()
-            if user is None:
-                return None
-
-            # переводим текущее значение в накопленные секунды
-            current_dt: Optional[datetime] = user.count_time  # type: ignore
-            if current_dt is None:
-                current_seconds = 0.0
-            else:
-                # Если current_dt без tzinfo, считаем, что это UTC naive → добавим UTC tzinfo
-                if current_dt.tzinfo is None:
-                    current_dt = current_dt.replace(tzinfo=timezone.utc)
-                current_seconds = (current_dt - EPOCH).total_seconds()
-
-            new_total_seconds = current_seconds + seconds
-            new_dt_utc = EPOCH + timedelta(seconds=new_total_seconds)
-
-            # Храним как naive (без tzinfo), т.к. SQLite не поддерживает TZ нормально
-            store_dt = new_dt_utc.replace(tzinfo=None)
-
-            await session.execute(
-                update(User).where(User.tid == user_id).values(count_time=store_dt)
-            )
-            await session.commit()
-
-            # вернуть актуального пользователя
-            res2 = await session.execute(select(User).where(User.tid == user_id))
-            return res2.scalar_one_or_none()
+        return await UserCRUD._shift_duration(user_id, seconds)
 
     @staticmethod
     async def subtract_duration(
         user_id: int, amount: DurationInput
     ) -> Optional["User"]:
         """
-        Вычитает длительность из поля count_time. Не даём уйти ниже нуля.
+        Вычитает длительность из total_seconds. Не даём уйти ниже нуля.
         amount: timedelta | секунды (int/float).
         """
         seconds = (
             amount.total_seconds() if isinstance(amount, timedelta) else float(amount)
         )
-        if seconds < 0:
-            # отрицательное вычитание = прибавление
-            return await UserCRUD.add_duration(user_id, -seconds)
+        return await UserCRUD._shift_duration(user_id, -seconds)
 
-        async with async_session() as session:
-            res = await session.execute(select(User).where(User.tid == user_id))
-            user = res.scalar_one_or_none()
-            if user is None:
-                return None
+    @staticmethod
+    async def points(user_id: int, points: int) -> Optional[int]:
+        """
+        Сколько поинтов начислить юзеру (отрицательное — списать, не ниже нуля).
+        Атомарный UPDATE ... RETURNING, возвращает новое значение или None.
+        """
+        async with _session_scope() as session:
+            res = await session.execute(
+                update(User)
+                .where(User.tid == user_id)
+                .values(points=_greatest(User.points + int(points), 0))
+                .returning(User.points)
+                .execution_options(synchronize_session=False)
+            )
+            new_points = res.scalar_one_or_none()
+            await session.commit()
+            return new_points
 
-            current_dt: Optional[datetime] = user.count_time  # type: ignore
-            if current_dt is None:
-                current_seconds = 0.0
-            else:
-                if current_dt.tzinfo is None:
-                    current_dt = current_dt.replace(tzinfo=timezone.utc)
-                current_seconds = (current_dt - EPOCH).total_seconds()
+    @staticmethod
+    async def score_day(
+        day: date,
+        utc_offset: int,
+        *,
+        levels: Sequence[tuple[int, int]],
+        done_points: float,
+        bonus: int,
+        bonus_after: timedelta,
+        penalty: int,
+    ) -> Optional[tuple[int, int]]:
+        """
+        Начисляет поинты за местный день day всем пользователям пояса utc_offset
+        двумя UPDATE в одной транзакции, без выборки строк в Python:
+        1) points += penalty, если целей за день нет, иначе
+           int(выполнено / всего * done_points) + bonus при активности > bonus_after
+           (не ниже нуля);
+        2) level — максимальный из levels [(порог, уровень)], который набран;
+           уровень не понижается.
+        В той же транзакции пишется scored_days (utc_offset, day): уже оценённый
+        день пропускается, параллельная оценка того же дня (другая реплика) ждёт
+        коммита первой и тоже пропускает его.
+        Возвращает (сколько пользователей оценено, у скольких вырос уровень)
+        или None, если день уже оценён.
+        """
+        users_where = (User.utc_offset == utc_offset,)
+        start_dt, next_day_dt = day_bounds(day, utc_offset)
+        day_targets = (
+            Target.user_id == User.tid,
+            Target.date_add >= start_dt,
+            Target.date_add < next_day_dt,
+        )
+        total = select(func.count(Target.id)).where(*day_targets).scalar_subquery()
+        done = (
+            select(func.count(Target.id))
+            .where(*day_targets, Target.is_done == True)
+            .scalar_subquery()
+        )
+        active_seconds = (
+            select(func.coalesce(func.sum(DailyActivity.seconds), 0))
+            .where(DailyActivity.user_id == User.tid, DailyActivity.day == day)
+            .scalar_subquery()
+        )
+        # int(done / total * done_points) в целых числах: CAST в PostgreSQL
+        # округлял бы, а // компилируется в целочисленное деление на обоих диалектах
+        scale = 10000
+        earned = case(
+            (total == 0, penalty),
+            else_=(done * round(done_points * scale)) // (total * scale)
+            + case((active_seconds > bonus_after.total_seconds(), bonus), else_=0),
+        )
 
-            new_total_seconds = max(0.0, current_seconds - seconds)
-            new_dt_utc = EPOCH + timedelta(seconds=new_total_seconds)
-            store_dt = new_dt_utc.replace(tzinfo=None)
+        dialect_insert = sqlite.insert if _is_sqlite() else postgresql.insert
+        mark = (
+            dialect_insert(ScoredDay)
+            .values(utc_offset=utc_offset, day=day)
+            .on_conflict_do_nothing(index_elements=["utc_offset", "day"])
+            .returning(ScoredDay.id)
+        )
 
-            await session.execute(
-                update(User).where(User.tid == user_id).values(count_time=store_dt)
+        async with _session_scope() as session:
+            if (await session.execute(mark)).scalar_one_or_none() is None:
+                return None
+            scored = await session.execute(
+                update(User)
+                .where(*users_where)
+                .values(points=_greatest(User.points + earned, 0))
+                .execution_options(synchronize_session=False)
             )
+            leveled = None
+            if levels:
+                reached = case(
+                    *[
+                        (User.points >= threshold, level)
+                        for threshold, level in sorted(levels, reverse=True)
+                    ],
+                    else_=User.level,
+                )
+                leveled = await session.execute(
+                    update(User)
+                    .where(*users_where, User.level < reached)
+                    .values(level=reached)
+                    .execution_options(synchronize_session=False)
+                )
             await session.commit()
+        return scored.rowcount, leveled.rowcount if leveled is not None else 0
+
+    @staticmethod
+    async def offsets() -> Sequence[int]:
+        """Часовые пояса (users.utc_offset), в которых есть пользователи."""
+        async with _session_scope() as session:
+            res = await session.execute(select(User.utc_offset).distinct())
+            return list(res.scalars().all())
 
-            res2 = await session.execute(select(User).where(User.tid == user_id))
-            return res2.scalar_one_or_none()
 
+# ---------- Scored days ----------
+class ScoredDayCRUD:
     @staticmethod
-    async def points(user_id: int, points: int):
-        """Сколько поинтов начислить юзеру"""
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.tid == user_id))
-            result = result.scalar_one_or_none()
-            if not result:
-                return None
-            try:
-                obj = (
-                    update(User)
-                    .where(User.tid == user_id)
-                    .values(points=int(result.points) + int(points))
+    async def last_days() -> dict[int, date]:
+        """{пояс: последний оценённый местный день}."""
+        async with _session_scope() as session:
+            res = await session.execute(
+                select(ScoredDay.utc_offset, func.max(ScoredDay.day)).group_by(
+                    ScoredDay.utc_offset
                 )
-                await session.execute(obj)
-                await session.commit()
-                return 1
-            except Exception as e:
-                return e
+            )
+            return {utc_offset: day for utc_offset, day in res}
 
 
 # ---------- Targets ----------
@@ -237,16 +502,36 @@ class TargetCRUD:
     async def create(
         *, user_id: int, description: str, is_done: bool = False
     ) -> Target:
-        async with async_session() as session:
+        async with _session_scope() as session:
             obj = Target(user_id=user_id, description=description, is_done=is_done)
             session.add(obj)
             await session.commit()
             await session.refresh(obj)
-            return obj
+        return obj
+
+    @staticmethod
+    async def bulk_create(user_id: int, descriptions: Sequence[str]) -> Sequence[Target]:
+        """
+        Создаёт цели пачкой: один INSERT ... RETURNING в одной транзакции
+        вместо create + commit + refresh на каждую цель.
+        """
+        if not descriptions:
+            return []
+        async with _session_scope() as session:
+            res = await session.scalars(
+                insert(Target).returning(Target),
+                [
+                    {"user_id": user_id, "description": description}
+                    for description in descriptions
+                ],
+            )
+            targets = res.all()
+            await session.commit()
+        return targets
 
     @staticmethod
     async def get_by_id(target_id: int) -> Optional[Target]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(select(Target).where(Target.id == target_id))
             return res.scalar_one_or_none()
 
@@ -254,7 +539,7 @@ class TargetCRUD:
     async def list_by_user(
         user_id: int, limit: int = 100, offset: int = 0
     ) -> Sequence[Target]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Target)
                 .where(Target.user_id == user_id)
@@ -277,7 +562,7 @@ class TargetCRUD:
         if is_done is not None:
             values["is_done"] = is_done
 
-        async with async_session() as session:
+        async with _session_scope() as session:
             if values:
                 await session.execute(
                     update(Target).where(Target.id == target_id).values(**values)
@@ -286,16 +571,47 @@ class TargetCRUD:
             res = await session.execute(select(Target).where(Target.id == target_id))
             return res.scalar_one_or_none()
 
+    @staticmethod
+    async def set_done_bulk(
+        done_ids: Sequence[int], undone_ids: Sequence[int]
+    ) -> tuple[int, int]:
+        """
+        Проставляет is_done пачкой: не больше двух UPDATE ... WHERE id IN (...)
+        в одной транзакции. Возвращает (отмечено, снято) — только реально изменённые строки.
+        """
+        marked = unmarked = 0
+        if not done_ids and not undone_ids:
+            return marked, unmarked
+        async with _session_scope() as session:
+            if done_ids:
+                res = await session.execute(
+                    update(Target)
+                    .where(Target.id.in_(done_ids), Target.is_done == False)
+                    .values(is_done=True)
+                )
+                marked = res.rowcount
+            if undone_ids:
+                res = await session.execute(
+                    update(Target)
+                    .where(Target.id.in_(undone_ids), Target.is_done == True)
+                    .values(is_done=False)
+                )
+                unmarked = res.rowcount
+            await session.commit()
+        return marked, unmarked
+
     @staticmethod
     async def delete(target_id: int) -> bool:
-        async with async_session() as session:
-            res = await session.execute(select(Target.id).where(Target.id == target_id))
-            exists = res.scalar_one_or_none()
-            if exists is None:
+        async with _session_scope() as session:
+            res = await session.execute(
+                delete(Target).where(Target.id == target_id).returning(Target.user_id)
+            )
+            user_id = res.scalar_one_or_none()
+            if user_id is None:
                 return False
-            await session.execute(delete(Target).where(Target.id == target_id))
             await session.commit()
-            return True
+        _after_commit(targets_today.invalidate, user_id)
+        return True
 
     @staticmethod
     async def bulk_delete(target_ids: list[int]) -> int:
@@ -305,28 +621,61 @@ class TargetCRUD:
         """
         if not target_ids:
             return 0
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
-                select(Target.id).where(Target.id.in_(target_ids))
-            )
-            existing = [r[0] for r in res.all()]
-            if not existing:
-                return 0
-            result = await session.execute(
-                delete(Target).where(Target.id.in_(existing))
+                delete(Target)
+                .where(Target.id.in_(target_ids))
+                .returning(Target.user_id)
             )
+            user_ids = res.scalars().all()
             await session.commit()
-            # result.rowcount may not be reliable on some DBs; return len(existing)
-            return len(existing)
+        for user_id in set(user_ids):
+            _after_commit(targets_today.invalidate, user_id)
+        return len(user_ids)
+
+    @staticmethod
+    async def has_targets_today(user_id: int) -> Optional[tuple[bool, int]]:
+        """
+        Есть ли у пользователя цели на его сегодня (по users.utc_offset).
+        Возвращает (есть ли цели, utc_offset) или None, если такого пользователя нет.
+        """
+        async with _session_scope() as session:
+            utc_offset = await session.scalar(
+                select(User.utc_offset).where(User.tid == user_id)
+            )
+            if utc_offset is None:
+                return None
+            start_dt, next_day_dt = day_bounds(local_today(utc_offset), utc_offset)
+            has_targets = await session.scalar(
+                select(
+                    select(Target.id)
+                    .where(
+                        Target.user_id == user_id,
+                        Target.date_add >= start_dt,
+                        Target.date_add < next_day_dt,
+                    )
+                    .exists()
+                )
+            )
+            return bool(has_targets), utc_offset
 
     @staticmethod
-    async def get_all_target_today(user_id: int, day: date):
-        start_dt = datetime.combine(day, time.min)
-        next_day_dt = start_dt + timedelta(days=1)
-        async with async_session() as session:
+    async def get_all_target_today(
+        user_id: int, day: Optional[date] = None, checkoff_window: int = 0
+    ):
+        """
+        (пользователь, его цели за местный день day). day=None — сегодня
+        в поясе пользователя (users.utc_offset), а с checkoff_window — день,
+        который ещё открыт для отметок (см. utils.dates.checkoff_day).
+        """
+        async with _session_scope() as session:
             # 1) Грузим пользователя
             user_result = await session.execute(select(User).where(User.tid == user_id))
             user = user_result.scalar_one_or_none()
+            utc_offset = user.utc_offset if user is not None else None
+            if day is None:
+                day = checkoff_day(utc_offset, checkoff_window)
+            start_dt, next_day_dt = day_bounds(day, utc_offset)
 
             # 2) Грузим таргеты за день
             targets_result = await session.execute(
@@ -353,7 +702,7 @@ class SessionCRUD:
         date_end: datetime,
         is_active: bool = False,
     ) -> Session:
-        async with async_session() as session:
+        async with _session_scope() as session:
             obj = Session(
                 user_id=user_id,
                 target_id=target_id,
@@ -368,7 +717,7 @@ class SessionCRUD:
 
     @staticmethod
     async def get_by_id(session_id: int) -> Optional[Session]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(select(Session).where(Session.id == session_id))
             return res.scalar_one_or_none()
 
@@ -376,7 +725,7 @@ class SessionCRUD:
     async def list_by_user(
         user_id: int, limit: int = 100, offset: int = 0
     ) -> Sequence[Session]:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Session)
                 .where(Session.user_id == user_id)
@@ -405,7 +754,7 @@ class SessionCRUD:
         if target_id is not None:
             values["target_id"] = target_id
 
-        async with async_session() as session:
+        async with _session_scope() as session:
             if values:
                 await session.execute(
                     update(Session).where(Session.id == session_id).values(**values)
@@ -416,7 +765,7 @@ class SessionCRUD:
 
     @staticmethod
     async def delete(session_id: int) -> bool:
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Session.id).where(Session.id == session_id)
             )
@@ -428,15 +777,16 @@ class SessionCRUD:
             return True
 
     @staticmethod
-    async def list_by_user_on_date(user_id: int, day: date) -> Sequence["Session"]:
+    async def list_by_user_on_date(
+        user_id: int, day: date, utc_offset: Optional[int] = None
+    ) -> Sequence["Session"]:
         """
-        Возвращает все сессии пользователя за конкретный календарный день.
-        Диапазон: [day 00:00:00, (day+1) 00:00:00), по полю date_start.
+        Возвращает все сессии пользователя за его местный день day (пояс utc_offset).
+        Диапазон: [day 00:00:00, (day+1) 00:00:00) местного времени, по полю date_start.
         """
-        start_of_day = datetime.combine(day, datetime.min.time())
-        end_of_day = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        start_of_day, end_of_day = day_bounds(day, utc_offset)
 
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Session)
                 .where(
@@ -451,85 +801,68 @@ class SessionCRUD:
             return res.scalars().all()
 
     @staticmethod
-    async def total_active_time_on_date(user_id: int, day: date) -> timedelta:
+    async def total_active_time_on_date(
+        user_id: int, day: date, utc_offset: Optional[int] = None
+    ) -> timedelta:
         """
-        Возвращает суммарное активное время за указанный день как timedelta.
-        Для каждой сессии берём пересечение с окном дня:
-        [start_of_day, end_of_day), и суммируем (end - start).
+        Возвращает суммарное активное время за местный день day (пояс utc_offset)
+        как timedelta. Каждая сессия обрезается окном дня [start_of_day, end_of_day),
+        суммирование выполняется на стороне БД.
         """
-        start_of_day = datetime.combine(day, time.min)
-        end_of_day = datetime.combine(day + timedelta(days=1), time.min)
+        start_of_day, end_of_day = day_bounds(day, utc_offset)
 
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
-                select(Session).where(
-                    and_(
-                        Session.user_id == user_id,
-                        Session.date_start < end_of_day,  # началась до конца дня
-                        Session.date_end
-                        >= start_of_day,  # закончилась после начала дня
+                select(
+                    func.coalesce(
+                        func.sum(_clipped_seconds(start_of_day, end_of_day)), 0
                     )
-                )
+                ).where(_overlaps_window(user_id, start_of_day, end_of_day))
             )
-            sessions: Sequence["Session"] = res.scalars().all()
-
-        total = timedelta(0)
-        for s in sessions:
-            # Границы пересечения строго datetime
-            start: datetime = max(s.date_start, start_of_day)  # type: ignore
-            end: datetime = min(s.date_end, end_of_day)  # type: ignore
-            if end > start:
-                total += end - start
-
-        return total
+            return _to_timedelta(res.scalar_one())
 
     @staticmethod
-    async def get_total_time_for_week(user_id: int, today: date) -> timedelta:
+    async def get_total_time_for_week(
+        user_id: int, today: date, utc_offset: Optional[int] = None
+    ) -> timedelta:
         """
-        Возвращает суммарное активное время за текущую неделю (с понедельника по сегодня).
+        Возвращает суммарное активное время за текущую неделю (с понедельника по сегодня)
+        по местному времени пользователя (пояс utc_offset).
         """
-        start_of_week = today - timedelta(days=today.weekday())  # Понедельник
+        start_of_week, _ = day_bounds(
+            today - timedelta(days=today.weekday()), utc_offset
+        )  # Понедельник
         end_of_week = start_of_week + timedelta(days=7)  # Следующий понедельник
 
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
-                select(Session).where(
-                    and_(
-                        Session.user_id == user_id,
-                        Session.date_start < end_of_week,
-                        Session.date_end >= start_of_week,
+                select(
+                    func.coalesce(
+                        func.sum(_clipped_seconds(start_of_week, end_of_week)), 0
                     )
-                )
+                ).where(_overlaps_window(user_id, start_of_week, end_of_week))
             )
-            sessions: Sequence["Session"] = res.scalars().all()
-
-        total = timedelta(0)
-        for s in sessions:
-            start: datetime = max(s.date_start, datetime.combine(start_of_week, time.min))  # type: ignore
-            end: datetime = min(s.date_end, datetime.combine(end_of_week, time.min))  # type: ignore
-            if end > start:
-                total += end - start
-        return total
+            return _to_timedelta(res.scalar_one())
 
     @staticmethod
     async def get_total_time_for_target(target_id: int) -> timedelta:
         """Возвращает суммарное время по всем сессиям для одной цели."""
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
-                select(Session).where(Session.target_id == target_id)
+                select(
+                    func.coalesce(
+                        func.sum(
+                            _seconds_between(Session.date_start, Session.date_end)
+                        ),
+                        0,
+                    )
+                ).where(Session.target_id == target_id)
             )
-            sessions: Sequence["Session"] = res.scalars().all()
-
-        total = timedelta(0)
-        for s in sessions:
-            # Для завершенных сессий просто считаем разницу
-            if s.date_end and s.date_start:
-                total += s.date_end - s.date_start
-        return total
+            return _to_timedelta(res.scalar_one())
 
     @staticmethod
     async def get_active_session(user_id: int):
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Session).where(
                     and_(Session.user_id == user_id, Session.is_active == True)
@@ -539,7 +872,7 @@ class SessionCRUD:
 
     @staticmethod
     async def get_all_active_session():
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Session).where((Session.is_active == True))
             )
@@ -547,10 +880,256 @@ class SessionCRUD:
 
     @staticmethod
     async def get_all_active_session_by_user(user_id: int):
-        async with async_session() as session:
+        async with _session_scope() as session:
             res = await session.execute(
                 select(Session).where(
                     and_(Session.user_id == user_id, Session.is_active == True)
                 )
             )
         return res.scalars().all()
+
+    @staticmethod
+    async def close_active(now: datetime, users_where: Sequence = ()) -> Sequence:
+        """
+        Закрывает все активные сессии одним UPDATE ... RETURNING и в той же
+        транзакции учитывает их: дневная свёртка (daily_activity) и
+        users.total_seconds. users_where — условия на User, чьи сессии закрывать
+        (например, User.utc_offset.in_(...)); пусто — все.
+        Возвращает строки (user_id, target_id, date_start) закрытых сессий.
+        """
+        stmt = (
+            update(Session)
+            .where(Session.is_active == True)
+            .values(is_active=False, date_end=now)
+            .returning(Session.user_id, Session.target_id, Session.date_start)
+            .execution_options(synchronize_session=False)
+        )
+        if users_where:
+            # sessions.user_id хранит tid пользователя
+            stmt = stmt.where(Session.user_id.in_(select(User.tid).where(*users_where)))
+
+        async with _session_scope() as session:
+            closed = (await session.execute(stmt)).all()
+            if closed:
+                await _account_intervals(
+                    session,
+                    [(row.user_id, row.target_id, row.date_start, now) for row in closed],
+                )
+                await session.commit()
+        return closed
+
+    @staticmethod
+    async def add_closed(
+        user_id: int,
+        target_id: Optional[int],
+        date_start: datetime,
+        date_end: datetime,
+    ) -> Optional[User]:
+        """
+        Записывает закрытую сессию (ручная корректировка времени) и в той же
+        транзакции учитывает её в daily_activity и users.total_seconds.
+        Возвращает обновлённого пользователя или None, если его нет.
+        """
+        async with _session_scope() as session:
+            exists = await session.scalar(select(User.id).where(User.tid == user_id))
+            if exists is None:
+                return None
+            session.add(
+                Session(
+                    user_id=user_id,
+                    target_id=target_id,
+                    date_start=date_start,
+                    date_end=date_end,
+                    is_active=False,
+                )
+            )
+            await session.flush()
+            await _account_intervals(session, [(user_id, target_id, date_start, date_end)])
+            await session.commit()
+            res = await session.execute(select(User).where(User.tid == user_id))
+            return res.scalar_one_or_none()
+
+
+async def _account_intervals(session, intervals: Sequence[tuple]) -> None:
+    """
+    Учитывает закрытые интервалы (user_id, target_id, начало, конец) в текущей
+    транзакции: users.total_seconds (executemany) и дневная свёртка
+    daily_activity (upsert с разбивкой по местным дням пользователя).
+    Коммит — за вызывающим.
+    """
+    seconds_by_user: dict[int, float] = {}
+    for user_id, _, date_start, date_end in intervals:
+        seconds_by_user[user_id] = (
+            seconds_by_user.get(user_id, 0)
+            + (date_end.replace(tzinfo=None) - date_start.replace(tzinfo=None)).total_seconds()
+        )
+
+    # сначала строки users: их блокировка упорядочивает запись с пересборкой
+    # свёртки (migrations.backfill_daily_activity)
+    users = User.__table__
+    await session.execute(
+        update(users)
+        .where(users.c.tid == bindparam("u_tid"))
+        .values(total_seconds=_greatest(users.c.total_seconds + bindparam("u_seconds"), 0)),
+        [
+            {"u_tid": user_id, "u_seconds": round(seconds)}
+            for user_id, seconds in seconds_by_user.items()
+        ],
+    )
+
+    user_ids = list(seconds_by_user)
+    offsets: dict[int, int] = {}
+    for i in range(0, len(user_ids), 1000):
+        res = await session.execute(
+            select(User.tid, User.utc_offset).where(User.tid.in_(user_ids[i : i + 1000]))
+        )
+        offsets.update((tid, utc_offset) for tid, utc_offset in res)
+
+    seconds_by_day: dict[tuple, float] = {}
+    for user_id, target_id, date_start, date_end in intervals:
+        for day, seconds in split_by_day(date_start, date_end, offsets.get(user_id)).items():
+            key = (user_id, target_id or 0, day)
+            seconds_by_day[key] = seconds_by_day.get(key, 0) + seconds
+
+    # в одном INSERT ... ON CONFLICT ключ не должен повторяться (PostgreSQL)
+    rows = [
+        {"user_id": user_id, "target_id": target_id, "day": day, "seconds": seconds}
+        for (user_id, target_id, day), seconds in seconds_by_day.items()
+    ]
+    for i in range(0, len(rows), 1000):
+        await session.execute(DailyActivityCRUD._upsert(rows[i : i + 1000]))
+
+
+# ---------- Daily activity ----------
+class DailyActivityCRUD:
+    @staticmethod
+    def _upsert(rows: list[dict]):
+        """INSERT ... ON CONFLICT (user_id, day, target_id) DO UPDATE seconds += excluded."""
+        dialect_insert = sqlite.insert if _is_sqlite() else postgresql.insert
+        stmt = dialect_insert(DailyActivity).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=["user_id", "day", "target_id"],
+            set_={"seconds": DailyActivity.seconds + stmt.excluded.seconds},
+        )
+
+    @staticmethod
+    async def add_interval(
+        user_id: int,
+        target_id: Optional[int],
+        date_start: datetime,
+        date_end: datetime,
+        utc_offset: Optional[int] = None,
+    ) -> None:
+        """Учитывает закрытую сессию в дневной свёртке (с разбивкой по местным дням)."""
+        rows = [
+            {
+                "user_id": user_id,
+                "target_id": target_id or 0,
+                "day": day,
+                "seconds": seconds,
+            }
+            for day, seconds in split_by_day(date_start, date_end, utc_offset).items()
+        ]
+        async with _session_scope() as session:
+            await session.execute(DailyActivityCRUD._upsert(rows))
+            await session.commit()
+
+    @staticmethod
+    async def total_for_range(user_id: int, day_from: date, day_to: date) -> timedelta:
+        """Сумма за дни [day_from, day_to)."""
+        async with _session_scope() as session:
+            res = await session.execute(
+                select(func.coalesce(func.sum(DailyActivity.seconds), 0)).where(
+                    DailyActivity.user_id == user_id,
+                    DailyActivity.day >= day_from,
+                    DailyActivity.day < day_to,
+                )
+            )
+            return _to_timedelta(res.scalar_one())
+
+    @staticmethod
+    async def total_for_target(target_id: int) -> timedelta:
+        async with _session_scope() as session:
+            res = await session.execute(
+                select(func.coalesce(func.sum(DailyActivity.seconds), 0)).where(
+                    DailyActivity.target_id == target_id
+                )
+            )
+            return _to_timedelta(res.scalar_one())
+
+
+# ---------- Profile ----------
+class ProfileStats:
+    """Read-модель профиля: пользователь, активность за день/неделю и время по целям."""
+
+    def __init__(
+        self,
+        user: User,
+        time_today: timedelta,
+        time_week: timedelta,
+        targets: list,
+    ):
+        self.user = user
+        self.time_today = time_today
+        self.time_week = time_week
+        # список кортежей (row(id, description), timedelta)
+        self.targets = targets
+
+
+class ProfileCRUD:
+    @staticmethod
+    async def get(user_id: int, limit: int = 100) -> Optional[ProfileStats]:
+        """
+        Собирает всё для экрана профиля за три запроса:
+        1) пользователь — его utc_offset задаёт местные «сегодня» и неделю;
+        2) суммы за день и неделю по дневной свёртке (один SELECT);
+        3) время по целям через LEFT JOIN daily_activity + GROUP BY.
+        """
+
+        def range_total(day_from: date, day_to: date):
+            return (
+                select(func.coalesce(func.sum(DailyActivity.seconds), 0))
+                .where(
+                    DailyActivity.user_id == user_id,
+                    DailyActivity.day >= day_from,
+                    DailyActivity.day < day_to,
+                )
+                .scalar_subquery()
+            )
+
+        async with _session_scope() as session:
+            res = await session.execute(select(User).where(User.tid == user_id))
+            user = res.scalar_one_or_none()
+            if user is None:
+                return None
+            today = local_today(user.utc_offset)
+            week_start = today - timedelta(days=today.weekday())
+
+            res = await session.execute(
+                select(
+                    range_total(today, today + timedelta(days=1)),
+                    range_total(week_start, week_start + timedelta(days=7)),
+                )
+            )
+            time_today, time_week = res.one()
+
+            res = await session.execute(
+                select(
+                    Target.id,
+                    Target.description,
+                    func.coalesce(func.sum(DailyActivity.seconds), 0).label("seconds"),
+                )
+                .outerjoin(DailyActivity, DailyActivity.target_id == Target.id)
+                .where(Target.user_id == user_id)
+                .group_by(Target.id, Target.description)
+                .order_by(Target.id)
+                .limit(limit)
+            )
+            targets = [(t, _to_timedelta(t.seconds)) for t in res.all()]
+
+        return ProfileStats(
+            user=user,
+            time_today=_to_timedelta(time_today),
+            time_week=_to_timedelta(time_week),
+            targets=targets,
+        )
@@ -1,4 +1,3 @@
-from datetime import datetime
 from maxapi import Router, F
 from maxapi.types import MessageCreated, MessageCallback, Command
 from maxapi.context import MemoryContext
@@ -8,14 +7,16 @@ from utils.states import UserStates
 from core.user_handlers.kb import (
     stop_kb,
     Item,
-    inline_keyboard_from_items_with_checks_finally,
+    pack_items,
+    unpack_items,
+    items_keyboard,
     checking_done_target_kb,
     create_new_target_kb,
 )
 
 from utils.message_utils import update_menu
 from core.database.requests import TargetCRUD
-from utils.cfg_points import calculate_points_and_level
+from utils.cfg_points import CHECKOFF_WINDOW, SCORING_MODE, calculate_points_and_level
 from utils.random_text import get_text
 
 ERROR_TEXT = "Произошла ошибка! Попробуйте снова("
@@ -38,7 +39,7 @@ async def make_target_is_done_finally(
     user_state = await context.get_state()
     if user_state == "UserStates:counted_time":
         return
-    items = await TargetCRUD.get_all_target_today(callback.from_user.user_id, datetime.today())  # type: ignore
+    _, items = await TargetCRUD.get_all_target_today(callback.from_user.user_id, checkoff_window=CHECKOFF_WINDOW)  # type: ignore
     if not items:
         try:
             await callback.message.edit(
@@ -50,36 +51,23 @@ async def make_target_is_done_finally(
             )
         return
 
-    initial_checked = set()
-    for group in items:
-        for t in group:
-            if getattr(t, "is_done", False):
-                initial_checked.add(t.id)
-    await context.set_data({"items": items, "pending_done": list(initial_checked)})
+    initial_checked = {t.id for t in items if t.is_done}
+    await context.set_data({"items": pack_items(items), "pending_done": list(initial_checked)})
 
-    model_groups = []
-    for group in items:
-        row = []
-        for t in group:
-            row.append(Item(id=t.id, description=t.description))
-        model_groups.append(row)
+    keyboard = items_keyboard("finally", items, "finally_done", initial_checked, user_id=callback.from_user.user_id)  # type: ignore
 
     try:
         try:
-            await callback.message.edit(text="Выбери что ты выполнил(а):", attachments=[inline_keyboard_from_items_with_checks_finally(model_groups, initial_checked, "finally_done")])  # type: ignore
+            await callback.message.edit(text="Выбери что ты выполнил(а):", attachments=[keyboard])  # type: ignore
         except Exception:
             await update_menu(
                 context,
                 callback.message,
                 text="Выбери что ты выполнил(а) f:",
-                attachments=[
-                    inline_keyboard_from_items_with_checks_finally(
-                        model_groups, initial_checked, "finally_done"
-                    )
-                ],
+                attachments=[keyboard],
             )  # type: ignore
     except Exception:
-        await callback.message.answer(context, callback.message, text="Выбери что ты выполнил(а):", attachments=[inline_keyboard_from_items_with_checks_finally(model_groups, initial_checked, "finally_done")])  # type: ignore
+        await callback.message.answer(context, callback.message, text="Выбери что ты выполнил(а):", attachments=[keyboard])  # type: ignore
 
 
 @user_finally.message_callback(F.callback.payload.startswith("finally_done:"))
@@ -98,11 +86,11 @@ async def take_id_and_change_finally_isdone(
     target_id = int(payload.split(":")[1])
 
     data = await context.get_data() or {}
-    items = data.get("items")
+    items = unpack_items(data.get("items"))
     if not items:
         # reload items from db as fallback
-        items = await TargetCRUD.get_all_target_today(callback.from_user.user_id, datetime.today())  # type: ignore
-        await context.set_data({"items": items})
+        _, targets = await TargetCRUD.get_all_target_today(callback.from_user.user_id, checkoff_window=CHECKOFF_WINDOW)  # type: ignore
+        items = [Item.from_target(t) for t in targets]
 
     pending = set(data.get("pending_done", []))
     if target_id in pending:
@@ -110,20 +98,15 @@ async def take_id_and_change_finally_isdone(
     else:
         pending.add(target_id)
 
-    await context.set_data({"items": items, "pending_done": list(pending)})
+    await context.set_data({"items": pack_items(items), "pending_done": list(pending)})
 
-    model_groups = []
-    for group in items:
-        row = []
-        for t in group:
-            row.append(Item(id=t.id, description=t.description))
-        model_groups.append(row)
+    keyboard = items_keyboard("finally", items, "finally_done", pending, user_id=callback.from_user.user_id)  # type: ignore
 
     try:
-        await callback.message.edit(text="Выбери что ты выполнил(а):", attachments=[inline_keyboard_from_items_with_checks_finally(model_groups, pending, "finally_done")])  # type: ignore
+        await callback.message.edit(text="Выбери что ты выполнил(а):", attachments=[keyboard])  # type: ignore
     except Exception:
         # fallback to creating/updating the persistent menu when edit is not available
-        await update_menu(context, callback.message, text="Выбери что ты выполнил(а):", attachments=[inline_keyboard_from_items_with_checks_finally(model_groups, pending, "finally_done")])  # type: ignore
+        await update_menu(context, callback.message, text="Выбери что ты выполнил(а):", attachments=[keyboard])  # type: ignore
 
 
 @user_finally.message_callback(F.callback.payload == "commit_finally_done")
@@ -132,30 +115,16 @@ async def commit_done_handler_finally(
 ):
     data = await context.get_data() or {}
     pending = set(data.get("pending_done", []))
-    items = data.get("items", [])
+    items = unpack_items(data.get("items"))
     if not items:
         await update_menu(context, callback.message, text="Нет задач для подтверждения.")  # type: ignore
         await context.clear()
         return
 
-    applied = 0
-    for group in items:
-        for t in group:
-            if t.id in pending and not t.is_done:
-                await TargetCRUD.update(target_id=t.id, is_done=True)  # type: ignore
-                applied += 1
-
-    desired = pending
-    applied = 0
-    removed = 0
-    for group in items:
-        for t in group:
-            if t.id in desired and not t.is_done:
-                await TargetCRUD.update(target_id=t.id, is_done=True)  # type: ignore
-                applied += 1
-            if t.id not in desired and t.is_done:
-                await TargetCRUD.update(target_id=t.id, is_done=False)  # type: ignore
-                removed += 1
+    await TargetCRUD.set_done_bulk(
+        done_ids=[t.id for t in items if t.id in pending and not t.is_done],
+        undone_ids=[t.id for t in items if t.id not in pending and t.is_done],
+    )
     await context.clear()
     try:
         await callback.message.edit(
@@ -184,7 +153,10 @@ async def cancel_change_finally_target(
 
 @user_finally.message_callback(F.callback.payload == "day_is_done_finally")
 async def day_is_done_finally(callback: MessageCallback, context: MemoryContext):
-    await calculate_points_and_level(callback.from_user.user_id)
+    # в режиме batch поинты за день начисляет проход по поясу, когда закроется
+    # окно отметок CHECKOFF_WINDOW, — отметки, сделанные до этого, в него попадут
+    if SCORING_MODE == "user":
+        await calculate_points_and_level(callback.from_user.user_id)
     try:
         await update_menu(context, callback.message, text="Теперь пора ставить новые цели, жми кнопку как будешь готов", attachments=[create_new_target_kb])  # type: ignore
     except Exception:
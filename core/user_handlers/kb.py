@@ -1,118 +1,165 @@
-from typing import List
+import os
+from typing import Any, List
 from maxapi.types import CallbackButton, ChatButton  # Только эти импортируем
 from maxapi.utils.inline_keyboard import InlineKeyboardBuilder
+from utils.cache import BoundedCache
 from utils.random_text import get_text
 
 
 class Item:
     """Модель элемента (цель, задача и т.д.)"""
 
+    __slots__ = ("id", "description", "is_done")
+
     def __init__(self, id: int, description: str, is_done: bool = False):
         self.id = id
         self.description = description
         self.is_done = is_done
 
+    @classmethod
+    def from_target(cls, target) -> "Item":
+        return cls(target.id, target.description, bool(getattr(target, "is_done", False)))
 
-def inline_keyboard_from_items(items: List[Item], callback_prefix: str):
-    kb = InlineKeyboardBuilder()
 
-    if not items:
-        kb.row(CallbackButton(text="Ошибка!", payload="ERROR"))
-        return kb.as_markup()
+def pack_items(items) -> list[list]:
+    """
+    Цели (Target или Item) -> компактный payload для context.set_data:
+    [[id, description, is_done], ...] — только JSON-типы, без ORM-объектов.
+    """
+    return [
+        [item.id, item.description, bool(getattr(item, "is_done", False))]
+        for item in items
+    ]
 
-    index = 1
-    for item in items:
-        kb.row(
-            CallbackButton(
-                text=f"{index}. {item.description}",
-                payload=f"{callback_prefix}:{item.id}",
-            )
-        )
 
-    kb.row(CallbackButton(text="Назад", payload="back_to_menu"))
+def unpack_items(payload) -> List[Item]:
+    """Обратно из payload в список Item; пустой/отсутствующий payload -> []."""
+    return [Item(id, description, is_done) for id, description, is_done in payload or []]
 
-    return kb.as_markup()
 
+# ---------- Клавиатуры со списком целей ----------
+# Ряды кнопок целей кэшируются на (пользователь, вид клавиатуры, префикс) вместе с
+# версией списка — кортежем (id, description, is_done). Пока список тот же,
+# при переключении отметки пересоздаётся только кнопка изменившейся цели.
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "10000"))
+_keyboards = BoundedCache("keyboards", KEYBOARD_CACHE_SIZE, ttl=3600)
 
-def inline_keyboard_from_items_with_checks(
-    items: List[List[Item]], checked_ids: set[int], callback_prefix: str
-):
-    """
-    Построить inline-клавиатуру где у каждой кнопки есть чекбокс, отражающий checked_ids.
-    checked_ids: set of target.id, отмеченные как выбранные (готовые).
-    callback_prefix: префикс для payload — например 'done' или 'select'.
-    Внизу добавляем кнопки Готово (commit) и Отмена (cancel_done).
-    """
-    kb = InlineKeyboardBuilder()
 
-    if not items:
-        kb.row(CallbackButton(text="Ошибка!", payload="ERROR"))
-        return kb.as_markup()
-
-    index = 1
-    for group in items:
-        row = []
-        for item in group:
-            # use ✅ for done and ❌ for not done
-            checked = "✅ " if item.id in checked_ids else "❌ "
-            row.append(
-                CallbackButton(
-                    text=f"{checked}{index}. {item.description}",
-                    payload=f"{callback_prefix}:{item.id}",
-                )
-            )
-            index += 1
-        if row:
-            kb.row(*row)
+def _no_mark(item, selected: bool) -> str:
+    return ""
 
-    # Контролы внизу: Готово (commit) и Отмена
-    kb.row(
-        CallbackButton(text="Готово", payload="commit_done"),
-        CallbackButton(text="Назад", payload="cancel_change_target"),
+
+def _check_mark(item, selected: bool) -> str:
+    return "✅ " if selected else "❌ "
+
+
+def _delete_mark(item, selected: bool) -> str:
+    # выбранное на удаление — 🗑️, иначе видно, выполнена ли цель
+    if selected:
+        return "🗑️ "
+    return "✅ " if getattr(item, "is_done", False) else "❌ "
+
+
+def _footer(*rows) -> list[list[CallbackButton]]:
+    return [[CallbackButton(text=text, payload=payload) for text, payload in row] for row in rows]
+
+
+# вид -> (отметка у кнопки цели, нижние ряды); нижние кнопки собираются один раз
+ITEM_KEYBOARDS = {
+    "list": (_no_mark, _footer([("Назад", "back_to_menu")])),
+    "done": (
+        _check_mark,
+        _footer([("Готово", "commit_done"), ("Назад", "cancel_change_target")]),
+    ),
+    "delete": (
+        _delete_mark,
+        _footer([("Удалить", "commit_delete"), ("Назад", "cancel_delete")]),
+    ),
+    "finally": (
+        _check_mark,
+        _footer([("Готово", "commit_finally_done"), ("Назад", "cancel_change_finally_target")]),
+    ),
+}
+_ERROR_ROWS = _footer([("Ошибка!", "ERROR")])
+
+
+class _RenderedItems:
+    __slots__ = ("version", "selected", "rows", "positions")
+
+    def __init__(self, version: tuple, selected: frozenset, rows: list, positions: dict):
+        self.version = version
+        self.selected = selected
+        self.rows = rows
+        self.positions = positions
+
+
+def _item_button(kind: str, item, index: int, selected: bool, callback_prefix: str):
+    mark, _ = ITEM_KEYBOARDS[kind]
+    return CallbackButton(
+        text=f"{mark(item, selected)}{index}. {item.description}",
+        payload=f"{callback_prefix}:{item.id}",
     )
 
+
+def _render_items(kind: str, items, selected: frozenset, callback_prefix: str) -> list:
+    return [
+        [_item_button(kind, item, index, item.id in selected, callback_prefix)]
+        for index, item in enumerate(items, start=1)
+    ]
+
+
+def _markup(rows) -> Any:
+    kb = InlineKeyboardBuilder()
+    for row in rows:
+        kb.row(*row)
     return kb.as_markup()
 
 
-def inline_keyboard_from_items_for_delete(
-    items: List[List[Item]], selected_ids: set[int], callback_prefix: str
+def items_keyboard(
+    kind: str,
+    items,
+    callback_prefix: str,
+    selected_ids=(),
+    user_id: int | None = None,
 ):
     """
-    Построить inline-клавиатуру для выбора на удаление. Показывает '🗑️' для выбранных и '❌' для не выбранных.
-    Внизу добавляет кнопки "Удалить" (commit_delete) и "Отмена" (cancel_delete).
+    Inline-клавиатура со списком целей, по кнопке на цель, и нижними кнопками вида kind:
+    list — просто выбор цели; done / finally — отметка выполненного (✅/❌);
+    delete — выбор на удаление (🗑️). selected_ids — id отмеченных целей.
+    items — Item или Target. С user_id ряды берутся из кэша и меняются только
+    кнопки, у которых сменилась отметка.
     """
-    kb = InlineKeyboardBuilder()
-
     if not items:
-        kb.row(CallbackButton(text="Ошибка!", payload="ERROR"))
-        return kb.as_markup()
-
-    index = 1
-    for group in items:
-        row = []
-        for item in group:
-            # If item already done, show ✅ as secondary indicator; selection for deletion overrides marker
-            sel_mark = (
-                "🗑️ "
-                if item.id in selected_ids
-                else ("✅ " if getattr(item, "is_done", False) else "❌ ")
-            )
-            row.append(
-                CallbackButton(
-                    text=f"{sel_mark}{index}. {item.description}",
-                    payload=f"{callback_prefix}:{item.id}",
-                )
-            )
-            index += 1
-        if row:
-            kb.row(*row)
+        return _markup(_ERROR_ROWS)
 
-    kb.row(
-        CallbackButton(text="Удалить", payload="commit_delete"),
-        CallbackButton(text="Назад", payload="cancel_delete"),
+    _, footer = ITEM_KEYBOARDS[kind]
+    selected = frozenset(selected_ids)
+    if user_id is None:
+        return _markup(_render_items(kind, items, selected, callback_prefix) + footer)
+
+    key = (user_id, kind, callback_prefix)
+    version = tuple(
+        (item.id, item.description, bool(getattr(item, "is_done", False))) for item in items
     )
+    rendered = _keyboards.get(key)
+    if rendered is None or rendered.version != version:
+        rendered = _RenderedItems(
+            version,
+            selected,
+            _render_items(kind, items, selected, callback_prefix),
+            {item.id: i for i, item in enumerate(items)},
+        )
+        _keyboards.set(key, rendered)
+    elif rendered.selected != selected:
+        for target_id in rendered.selected ^ selected:
+            i = rendered.positions.get(target_id)
+            if i is not None:
+                rendered.rows[i] = [
+                    _item_button(kind, items[i], i + 1, target_id in selected, callback_prefix)
+                ]
+        rendered.selected = selected
 
-    return kb.as_markup()
+    return _markup(rendered.rows + footer)
 
 
 def create_profile_targets_keyboard(targets_with_time: list):
@@ -264,44 +311,6 @@ def checking_done_target():
 checking_done_target_kb = checking_done_target()
 
 
-def inline_keyboard_from_items_with_checks_finally(
-    items: List[List[Item]], checked_ids: set[int], callback_prefix: str
-):
-    """
-    Построить inline-клавиатуру где у каждой кнопки есть чекбокс, отражающий checked_ids.
-    checked_ids: set of target.id, отмеченные как выбранные (готовые).
-    callback_prefix: префикс для payload — например 'done' или 'select'.
-    Внизу добавляем кнопки Готово (commit) и Отмена (cancel_done).
-    """
-    kb = InlineKeyboardBuilder()
-
-    if not items:
-        kb.row(CallbackButton(text="Ошибка!", payload="ERROR"))
-        return kb.as_markup()
-
-    index = 1
-    for group in items:
-        row = []
-        for item in group:
-            # use ✅ for done and ❌ for not done
-            checked = "✅ " if item.id in checked_ids else "❌ "
-            row.append(
-                CallbackButton(
-                    text=f"{checked}{index}. {item.description}",
-                    payload=f"{callback_prefix}:{item.id}",
-                )
-            )
-            index += 1
-        if row:
-            kb.row(*row)
-
-    kb.row(
-        CallbackButton(text="Готово", payload="commit_finally_done"),
-        CallbackButton(text="Назад", payload="cancel_change_finally_target"),
-    )
-    return kb.as_markup()
-
-
 def create_new_target():
     kb = InlineKeyboardBuilder()
     kb.row(CallbackButton(text="Поставить цели", payload="create_new_target"))
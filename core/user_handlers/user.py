@@ -17,25 +17,31 @@ from core.user_handlers.kb import (
     start_kb,
     stop_kb,
     change_target,
-    inline_keyboard_from_items,
-    inline_keyboard_from_items_with_checks,
+    items_keyboard,
     cancel_button_kb,
     change_time_activity_kb,
     back_to_profile_kb,
     create_profile_targets_keyboard,
     Item,
-    inline_keyboard_from_items_for_delete,
+    pack_items,
+    unpack_items,
     confirmation_finally,
     create_new_target_kb,
 )
 
 from utils.random_text import get_text
 from utils.message_utils import update_menu
-from core.database.requests import UserCRUD, TargetCRUD, SessionCRUD
+from core.database.requests import (
+    UserCRUD,
+    TargetCRUD,
+    SessionCRUD,
+    ProfileCRUD,
+)
+from core.database.models import User
 
 # from utils.redis import get_redis_async
-from utils.dates import UTC_PLUS_3, format_total_duration
-from utils.cfg_points import get_levels_config
+from utils.dates import UTC_PLUS_3, format_total_duration, format_utc_offset, parse_utc_offset
+from utils.cfg_points import levels
 from utils.dates import hhmmss_to_seconds, format_duration
 from utils.guards import look_if_not_target
 
@@ -153,11 +159,41 @@ async def helper(message: MessageCreated, context: MemoryContext):
         "В Профиле теперь отображается вся детальная статистика: Ваш уровень, очки, а также полный список целей с точным временем, затраченным на каждую. Если Вы забыли выключить таймер, не страшно! Вы можете изменить время для конкретной задачи прямо в профиле.\n\n"
         "Как зарабатывать очки?\n"
         "Вы получаете очки за выполнение целей. На Вашу награду влияет не только количество выполненных задач, но и процент их завершения от общего плана на день. Точные формулы — секрет, но главный совет прост: старайтесь выполнять всё, что запланировали, чтобы быстрее повышать свой уровень!\n\n"
+        "Часовой пояс\n"
+        "День закрывается в полночь по Вашему времени. По умолчанию это UTC+3 (Москва), поменять можно командой /timezone, например: /timezone +5\n\n"
         "Удачи в достижении Ваших целей!"
     )
     await message.message.answer(help_text, attachments=[button_in_help])
 
 
+@user.message_created(Command("timezone"))
+@look_if_not_target
+async def set_timezone(message: MessageCreated, context: MemoryContext):
+    args = (message.message.body.text or "").split()[1:]
+    if not args:
+        user_data = await UserCRUD.get_by_tid(message.from_user.user_id)  # type: ignore
+        if not user_data:
+            await message.message.answer(ERROR_TEXT)
+            return
+        await message.message.answer(
+            f"Ваш часовой пояс: {format_utc_offset(user_data.utc_offset)}.\n"
+            "Чтобы изменить, отправьте /timezone и смещение от UTC, например: /timezone +5 или /timezone -3:30"
+        )
+        return
+    offset = parse_utc_offset(args[0])
+    if offset is None:
+        await message.message.answer(
+            "Не понял часовой пояс( Укажите смещение от UTC от -12 до +14, например: /timezone +5"
+        )
+        return
+    if not await UserCRUD.update(message.from_user.user_id, utc_offset=offset):  # type: ignore
+        await message.message.answer(ERROR_TEXT)
+        return
+    await message.message.answer(
+        f"Готово! Часовой пояс: {format_utc_offset(offset)}. Итоги дня придут в полночь по этому времени."
+    )
+
+
 # Процесс получения и добавления целей в базу данных ----------<<<<<<<
 @user.message_callback(F.callback.payload.in_({"back_wright_target", "not_right"}))
 @look_if_not_target
@@ -212,8 +248,7 @@ async def get_and_wright_targets_in_db_R(
     if not targets:
         await update_menu(context, callback.message, text=ERROR_TEXT, attachments=[start_kb])  # type: ignore
         return
-    for target in targets:
-        await TargetCRUD.create(user_id=callback.from_user.user_id, description=target)  # type: ignore
+    await TargetCRUD.bulk_create(callback.from_user.user_id, targets)  # type: ignore
     await update_menu(context, callback.message, text="Успешно!", attachments=[start_kb])  # type: ignore
     await context.clear()
 
@@ -225,36 +260,31 @@ async def get_and_wright_targets_in_db_R(
 @look_if_not_target
 async def change_targets(callback: MessageCallback, context: MemoryContext):
     """Хендлер для возврата назад откуда либо прямиком в меню"""
-    _, items = await TargetCRUD.get_all_target_today(callback.from_user.user_id, datetime.today())  # type: ignore
+    _, items = await TargetCRUD.get_all_target_today(callback.from_user.user_id)  # type: ignore
     if not items:
         return
+    keyboard = items_keyboard("list", items, "item", user_id=callback.from_user.user_id)  # type: ignore
     try:
-        await callback.message.edit(text="Выбери что хочешь изменить:", attachments=[inline_keyboard_from_items(items, "item")])  # type: ignore
+        await callback.message.edit(text="Выбери что хочешь изменить:", attachments=[keyboard])  # type: ignore
     except Exception:
-        await update_menu(context, callback.message, text="Выбери что хочешь изменить:", attachments=[inline_keyboard_from_items(items, "item")])  # type: ignore
-    await context.set_data({"items": items})
+        await update_menu(context, callback.message, text="Выбери что хочешь изменить:", attachments=[keyboard])  # type: ignore
+    await context.set_data({"items": pack_items(items)})
 
 
 @user.message_callback(F.callback.payload == "target_is_done")
 @look_if_not_target
 async def make_target_is_done(callback: MessageCallback, context: MemoryContext):
-    _, items = await TargetCRUD.get_all_target_today(callback.from_user.user_id, datetime.today())  # type: ignore
+    _, items = await TargetCRUD.get_all_target_today(callback.from_user.user_id)  # type: ignore
     if not items:
         return
-    initial_checked = set()
-    for t in items:
-        if getattr(t, "is_done", False):
-            initial_checked.add(t.id)
-    await context.set_data({"items": items, "pending_done": list(initial_checked)})
-    model_groups = []
-    for t in items:
-        row = [Item(id=t.id, description=t.description)]
-        model_groups.append(row)
+    initial_checked = {t.id for t in items if t.is_done}
+    await context.set_data({"items": pack_items(items), "pending_done": list(initial_checked)})
+    keyboard = items_keyboard("done", items, "done", initial_checked, user_id=callback.from_user.user_id)  # type: ignore
 
     try:
-        await callback.message.edit(text="Выбери что ты выполнил(а):", attachments=[inline_keyboard_from_items_with_checks(model_groups, initial_checked, "done")])  # type: ignore
+        await callback.message.edit(text="Выбери что ты выполнил(а):", attachments=[keyboard])  # type: ignore
     except Exception:
-        await update_menu(context, callback.message, text="Выбери что ты выполнил(а):", attachments=[inline_keyboard_from_items_with_checks(model_groups, initial_checked, "done")])  # type: ignore
+        await update_menu(context, callback.message, text="Выбери что ты выполнил(а):", attachments=[keyboard])  # type: ignore
 
 
 @user.message_callback(F.callback.payload == "cancel_change_target")
@@ -262,7 +292,7 @@ async def make_target_is_done(callback: MessageCallback, context: MemoryContext)
 async def cancel_change_targets(callback: MessageCallback, context: MemoryContext):
     data = await context.get_data()
     if not data:
-        _, data = await TargetCRUD.get_all_target_today(user_id=callback.from_user.user_id, day=datetime.today())  # type: ignore
+        _, data = await TargetCRUD.get_all_target_today(user_id=callback.from_user.user_id)  # type: ignore
 
     answer = ""
     ind = 1
@@ -272,7 +302,7 @@ async def cancel_change_targets(callback: MessageCallback, context: MemoryContex
             answer += f"{ind}. {mark} {j.description}\n"
             ind += 1
     else:
-        for item in data.get("items", []):
+        for item in unpack_items(data.get("items")):
             mark = "✅" if getattr(item, "is_done", False) else "❌"
             answer += f"{ind}. {mark} {item.description}\n"
             ind += 1
@@ -330,30 +360,22 @@ async def add_target(callback: MessageCallback, context: MemoryContext):
 @user.message_callback(F.callback.payload == "back_delete_target")
 @look_if_not_target
 async def delete_target(callback: MessageCallback, context: MemoryContext):
-    _, items = await TargetCRUD.get_all_target_today(user_id=callback.from_user.user_id, day=datetime.today())  # type: ignore
+    _, items = await TargetCRUD.get_all_target_today(user_id=callback.from_user.user_id)  # type: ignore
     if not items:
         await update_menu(context, callback.message, text="Нет задач для удаления.")
         return
 
-    await context.set_data({"items": items, "pending_delete": []})
+    await context.set_data({"items": pack_items(items), "pending_delete": []})
 
-    # Построим model groups
-    model_groups = []
-    for t in items:
-        row = [
-            Item(
-                id=t.id, description=t.description, is_done=getattr(t, "is_done", False)
-            )
-        ]
-        model_groups.append(row)
+    keyboard = items_keyboard("delete", items, "delete", user_id=callback.from_user.user_id)  # type: ignore
 
     try:
-        await callback.message.edit(text="Выбери что ты хочешь удалить:", attachments=[inline_keyboard_from_items_for_delete(model_groups, set(), "delete")])  # type: ignore
+        await callback.message.edit(text="Выбери что ты хочешь удалить:", attachments=[keyboard])  # type: ignore
     except Exception:
         try:
-            await callback.message.edit(text="Выбери что ты хочешь удалить:", attachments=[inline_keyboard_from_items_for_delete(model_groups, set(), "delete")])  # type: ignore
+            await callback.message.edit(text="Выбери что ты хочешь удалить:", attachments=[keyboard])  # type: ignore
         except Exception:
-            await update_menu(context, callback.message, text="Выбери что ты хочешь удалить:", attachments=[inline_keyboard_from_items_for_delete(model_groups, set(), "delete")])  # type: ignore
+            await update_menu(context, callback.message, text="Выбери что ты хочешь удалить:", attachments=[keyboard])  # type: ignore
 
 
 @user.message_callback(F.callback.payload.startswith("delete:"))
@@ -367,9 +389,10 @@ async def delete_target_callback(callback: MessageCallback, context: MemoryConte
     target_id = int(payload.split(":")[1])
 
     data = await context.get_data() or {}
-    items = data.get("items")
+    items = unpack_items(data.get("items"))
     if not items:
-        _, items = await TargetCRUD.get_all_target_today(user_id=callback.from_user.user_id, day=datetime.today())  # type: ignore
+        _, targets = await TargetCRUD.get_all_target_today(user_id=callback.from_user.user_id)  # type: ignore
+        items = [Item.from_target(t) for t in targets]
 
     pending = set(data.get("pending_delete", []))
     if target_id in pending:
@@ -377,21 +400,14 @@ async def delete_target_callback(callback: MessageCallback, context: MemoryConte
     else:
         pending.add(target_id)
 
-    await context.set_data({"items": items, "pending_delete": list(pending)})
+    await context.set_data({"items": pack_items(items), "pending_delete": list(pending)})
 
-    model_groups = []
-    for t in items:
-        row = [
-            Item(
-                id=t.id, description=t.description, is_done=getattr(t, "is_done", False)
-            )
-        ]
-        model_groups.append(row)
+    keyboard = items_keyboard("delete", items, "delete", pending, user_id=callback.from_user.user_id)  # type: ignore
 
     try:
-        await callback.message.edit(text="Выбери что Вы хотите удалить:", attachments=[inline_keyboard_from_items_for_delete(model_groups, pending, "delete")])  # type: ignore
+        await callback.message.edit(text="Выбери что Вы хотите удалить:", attachments=[keyboard])  # type: ignore
     except Exception:
-        await update_menu(context, callback.message, text="Выбери что Вы хотите удалить:", attachments=[inline_keyboard_from_items_for_delete(model_groups, pending, "delete")])  # type: ignore
+        await update_menu(context, callback.message, text="Выбери что Вы хотите удалить:", attachments=[keyboard])  # type: ignore
 
 
 @user.message_callback(F.callback.payload == "commit_delete")
@@ -432,11 +448,11 @@ async def take_id_and_change_isdone(callback: MessageCallback, context: MemoryCo
     target_id = int(payload.split(":")[1])
 
     data = await context.get_data() or {}
-    items = data.get("items")
+    items = unpack_items(data.get("items"))
     if not items:
         # reload items from db as fallback
-        _, items = await TargetCRUD.get_all_target_today(callback.from_user.user_id, datetime.today())  # type: ignore
-        await context.set_data({"items": items})
+        _, targets = await TargetCRUD.get_all_target_today(callback.from_user.user_id)  # type: ignore
+        items = [Item.from_target(t) for t in targets]
 
     pending = set(data.get("pending_done", []))
     if target_id in pending:
@@ -444,18 +460,15 @@ async def take_id_and_change_isdone(callback: MessageCallback, context: MemoryCo
     else:
         pending.add(target_id)
 
-    await context.set_data({"items": items, "pending_done": list(pending)})
+    await context.set_data({"items": pack_items(items), "pending_done": list(pending)})
 
-    model_groups = []
-    for t in items:
-        row = Item(id=t.id, description=t.description)
-        model_groups.append(row)
+    keyboard = items_keyboard("done", items, "done", pending, user_id=callback.from_user.user_id)  # type: ignore
 
     try:
-        await callback.message.edit(text="Выберите что Вы выполнили:", attachments=[inline_keyboard_from_items_with_checks(model_groups, pending, "done")])  # type: ignore
+        await callback.message.edit(text="Выберите что Вы выполнили:", attachments=[keyboard])  # type: ignore
     except Exception:
         # fallback to creating/updating the persistent menu when edit is not available
-        await update_menu(context, callback.message, text="Выберите что Вы выполнили:", attachments=[inline_keyboard_from_items_with_checks(model_groups, pending, "done")])  # type: ignore
+        await update_menu(context, callback.message, text="Выберите что Вы выполнили:", attachments=[keyboard])  # type: ignore
 
 
 @user.message_created(UserStates.change_targets)
@@ -475,11 +488,11 @@ async def change_target_in_db(message: MessageCreated, context: MemoryContext):
 
     await TargetCRUD.update(target_id=id, description=msg)  # type: ignore
     await message.message.answer("Готово!")
-    _, items = await TargetCRUD.get_all_target_today(message.from_user.user_id, datetime.today())  # type: ignore
+    _, items = await TargetCRUD.get_all_target_today(message.from_user.user_id)  # type: ignore
     if not items:
         return
-    await message.message.answer("Выберите что хотите изменить:", attachments=[inline_keyboard_from_items(items, "item")])  # type: ignore
-    await context.set_data({"items": items})
+    await message.message.answer("Выберите что хотите изменить:", attachments=[items_keyboard("list", items, "item", user_id=message.from_user.user_id)])  # type: ignore
+    await context.set_data({"items": pack_items(items)})
 
 
 # Коммит и отмена для пометки выполненных задач
@@ -490,28 +503,16 @@ async def change_target_in_db(message: MessageCreated, context: MemoryContext):
 async def commit_done_handler(callback: MessageCallback, context: MemoryContext):
     data = await context.get_data() or {}
     pending = set(data.get("pending_done", []))
-    items = data.get("items", [])
+    items = unpack_items(data.get("items"))
     if not items:
         await update_menu(context, callback.message, text="Нет задач для подтверждения.")  # type: ignore
         await context.clear()
         return
 
-    applied = 0
-    for t in items:
-        if t.id in pending and not t.is_done:
-            await TargetCRUD.update(target_id=t.id, is_done=True)  # type: ignore
-            applied += 1
-
-    desired = pending
-    applied = 0
-    removed = 0
-    for t in items:
-        if t.id in desired and not t.is_done:
-            await TargetCRUD.update(target_id=t.id, is_done=True)  # type: ignore
-            applied += 1
-        if t.id not in desired and t.is_done:
-            await TargetCRUD.update(target_id=t.id, is_done=False)  # type: ignore
-            removed += 1
+    applied, removed = await TargetCRUD.set_done_bulk(
+        done_ids=[t.id for t in items if t.id in pending and not t.is_done],
+        undone_ids=[t.id for t in items if t.id not in pending and t.is_done],
+    )
 
     msg_parts = []
     if applied:
@@ -537,7 +538,7 @@ async def cancel_done_handler(callback: MessageCallback, context: MemoryContext)
 @user.message_callback(F.callback.payload == "start_session")
 @look_if_not_target
 async def start_session_choose_target(message: MessageCallback, context: MemoryContext):
-    _, targets_raw = await TargetCRUD.get_all_target_today(message.from_user.user_id, datetime.today())  # type: ignore
+    _, targets_raw = await TargetCRUD.get_all_target_today(message.from_user.user_id)  # type: ignore
 
     # Распаковываем вложенный список
     targets = [sublist for sublist in targets_raw]
@@ -557,7 +558,9 @@ async def start_session_choose_target(message: MessageCallback, context: MemoryC
         context,
         message.message,
         text="Выберите цель, над которой начинаете работать:",
-        attachments=[inline_keyboard_from_items(items_for_kb, "start_target")],
+        attachments=[
+            items_keyboard("list", items_for_kb, "start_target", user_id=message.from_user.user_id)  # type: ignore
+        ],
     )
     await context.set_state(UserStates.choosing_target_for_session)
 
@@ -614,17 +617,17 @@ async def stop_going(message: MessageCallback, context: MemoryContext):
     now = datetime.now(UTC_PLUS_3)
     now = now.replace(tzinfo=None)
 
-    session = await SessionCRUD.get_active_session(message.from_user.user_id)
-    if not session:
+    # закрытие, дневная свёртка и total_seconds — одной транзакцией
+    closed = await SessionCRUD.close_active(
+        now, (User.tid == message.from_user.user_id,)
+    )
+    if not closed:
         await update_menu(
             context, message.message, text=ERROR_TEXT, attachments=[start_kb]
         )
         return
 
-    await SessionCRUD.update(session_id=session.id, date_end=now, is_active=False)
-
-    elapsed = now - session.date_start
-    await UserCRUD.add_duration(message.from_user.user_id, elapsed)
+    elapsed = sum((now - row.date_start for row in closed), timedelta())
 
     elapsed_str = format_duration(elapsed)
     await update_menu(
@@ -638,37 +641,33 @@ async def stop_going(message: MessageCallback, context: MemoryContext):
 async def draw_profile(
     message: MessageCallback | MessageCreated, context: MemoryContext
 ):
-    user_data = await UserCRUD.get_by_tid(message.from_user.user_id)
-
-    today = datetime.now(UTC_PLUS_3).date()
-
-    time_today = await SessionCRUD.total_active_time_on_date(user_data.tid, today)  # type: ignore
-    time_week = await SessionCRUD.get_total_time_for_week(user_data.tid, today)  # type: ignore
-
-    next_level = None
+    profile = await ProfileCRUD.get(message.from_user.user_id)
+    if profile is None:
+        await update_menu(
+            context, message.message, text=ERROR_TEXT, attachments=[start_kb]
+        )
+        return
+    user_data = profile.user
 
-    lp = get_levels_config()
-    for i in sorted(lp.keys(), key=int):
-        if int(user_data.points) < int(i):  # type: ignore
-            next_level = int(i)
-            break
+    to_next = levels.points_to_next(int(user_data.points))
+    progress = (
+        f"до следующего уровня {to_next}" if to_next is not None else "максимальный уровень"
+    )
 
     answer = (
         f"👤 {user_data.name}, {user_data.level} уровень\n"
-        f"📈 Поинтов: {user_data.points}, до следующего уровня {next_level - int(user_data.points)}\n\n"  # type: ignore
+        f"📈 Поинтов: {user_data.points}, {progress}\n\n"
         f"⏱️ Активность:\n"
-        f"За сегодня: {format_duration(time_today)}\n"
-        f"За неделю: {format_duration(time_week)}\n"
-        f"Всего: {format_total_duration(user_data.count_time)}\n\n"  # type: ignore
+        f"За сегодня: {format_duration(profile.time_today)}\n"
+        f"За неделю: {format_duration(profile.time_week)}\n"
+        f"Всего: {format_total_duration(user_data.total_seconds)}\n\n"  # type: ignore
         f"🎯 Время по целям:"
     )
 
-    targets_raw = await TargetCRUD.list_by_user(user_data.tid)  # type: ignore
-
-    targets_with_time = []
-    for target in targets_raw:
-        target_time = await SessionCRUD.get_total_time_for_target(target.id)
-        targets_with_time.append((target, format_duration(target_time)))
+    targets_with_time = [
+        (target, format_duration(target_time))
+        for target, target_time in profile.targets
+    ]
 
     profile_kb = create_profile_targets_keyboard(targets_with_time)
     user_state = await context.get_state()
@@ -756,7 +755,10 @@ async def adjust_target_time_finish(message: MessageCreated, context: MemoryCont
     now = datetime.now(UTC_PLUS_3)
     duration = timedelta(seconds=seconds)
 
-    user_updated = await UserCRUD.add_duration(message.from_user.user_id, duration)
+    # сессия, дневная свёртка и total_seconds — одной транзакцией
+    user_updated = await SessionCRUD.add_closed(
+        message.from_user.user_id, target_id, now, now + duration
+    )
     if not user_updated:
         await update_menu(
             context,
@@ -767,14 +769,6 @@ async def adjust_target_time_finish(message: MessageCreated, context: MemoryCont
         await context.clear()
         return
 
-    await SessionCRUD.create(
-        user_id=user_updated.tid,
-        target_id=target_id,
-        date_start=now,
-        date_end=now + duration,
-        is_active=False,
-    )
-
     await context.clear()
     await message.message.answer("Время успешно обновлено!")
 
@@ -814,7 +808,7 @@ async def get_time(message: MessageCreated, context: MemoryContext):
 @user.message_callback(F.callback.payload == "get_targets")
 @look_if_not_target
 async def get_targets(message: MessageCreated, context: MemoryContext):
-    _, target = await TargetCRUD.get_all_target_today(message.from_user.user_id, datetime.today())  # type: ignore
+    _, target = await TargetCRUD.get_all_target_today(message.from_user.user_id)  # type: ignore
     if not target:
         await update_menu(
             context,
@@ -836,4 +830,4 @@ async def get_targets(message: MessageCreated, context: MemoryContext):
         text=f"Ваши цели на сегодня:\n{answer}",
         attachments=[change_target],
     )
-    await context.set_data({"items": target})
+    await context.set_data({"items": pack_items(target)})
@@ -4,10 +4,23 @@ import logging
 
 from core.user_handlers.user import user
 from core.user_handlers.finally_ import user_finally
-from core.database.models import async_main
+from core.database.models import async_main, engine, pool_capacity
+from core.database.requests import unit_of_work
 from utils.sheduler import setup_midnight_messages
+from utils.storage import StorageContext, create_storage
+from utils.dispatch import (
+    DISPATCH_CONCURRENCY,
+    OrderedDispatcher,
+    commit_before_api,
+    create_event_isolation,
+    scope_handlers,
+)
+from utils.webhook import WebhookServer
+from utils.metrics import setup_metrics
+from utils.broadcast import retry_after_trace
 
-from maxapi import Bot, Dispatcher
+from maxapi import Bot
+from maxapi.client.default import DefaultConnectionProperties
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,13 +28,49 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 token = os.getenv("TOKEN", "NOT_FIND_TOKEN")
-bot = Bot(token)
-dp = Dispatcher()
+# polling — long polling (по умолчанию), webhook — HTTP-сервер из utils/webhook.py
+updates_mode = os.getenv("UPDATES_MODE", "polling")
+# 1 — одна сессия и одна транзакция БД на обновление вместо сессии на каждый вызов CRUD;
+# на SQLite не включается: длинная транзакция с записью упирается в "database is locked"
+db_unit_of_work = (
+    os.getenv("DB_UNIT_OF_WORK", "0") not in ("", "0", "false", "False")
+    and engine.dialect.name != "sqlite"
+)
+# повторы запросов — забота Broadcaster: встроенный retry maxapi повторяет и отправку
+# сообщения после обрыва уже ушедшего запроса, что дублирует сообщения
+bot = Bot(
+    token,
+    default_connection=DefaultConnectionProperties(
+        max_retries=0, trace_configs=[retry_after_trace()]
+    ),
+)
+concurrency = DISPATCH_CONCURRENCY
+if db_unit_of_work:
+    # хендлер держит соединение до коммита — хендлеров не больше, чем соединений в пуле
+    concurrency = min(concurrency, pool_capacity() or concurrency)
+# polling запускает каждое событие в своей задаче; порядок по пользователю
+# и лимит параллельности держит изоляция событий OrderedDispatcher
+dp = OrderedDispatcher(
+    storage=StorageContext,
+    backend=create_storage(),
+    use_create_task=True,
+    event_isolation=create_event_isolation(concurrency),
+)
 
 
 async def main():
     scheduler = setup_midnight_messages(bot)
-    await dp.start_polling(bot)
+    metrics_task = setup_metrics(engine, (user_finally, user))
+    try:
+        if updates_mode == "webhook":
+            await WebhookServer(dp, bot).serve()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        if metrics_task is not None:
+            metrics_task.cancel()
+            await asyncio.gather(metrics_task, return_exceptions=True)
 
 
 async def init():
@@ -29,6 +78,10 @@ async def init():
 
 
 if __name__ == "__main__":
+    if db_unit_of_work:
+        # транзакция на хендлер; перед каждым запросом к Max API она фиксируется
+        scope_handlers(unit_of_work, user_finally, user)
+        commit_before_api()
     dp.include_routers(user_finally, user)
     asyncio.run(init())
     asyncio.run(main())
@@ -0,0 +1,45 @@
+"""
+Общие фикстуры: временная SQLite-база на сессию тестов и запуск корутин.
+
+DATABASE_URL задаётся до импорта core.database.models — движок создаётся при импорте.
+Корутины запускаются через asyncio.run, поэтому пул соединений закрывается
+в том же цикле событий, в котором открывался.
+"""
+
+import asyncio
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = (
+    f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+)
+os.environ.setdefault("FSM_STORAGE", "memory")
+
+import pytest  # noqa: E402
+
+from core.database.models import Base, async_main, engine  # noqa: E402
+
+
+def run(coro):
+    """Выполняет корутину в новом цикле событий и закрывает пул соединений."""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+async def _reset() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await async_main()
+
+
+@pytest.fixture
+def db():
+    """Чистая схема для теста; возвращает run."""
+    run(_reset())
+    return run
@@ -0,0 +1,119 @@
+"""Повторы Broadcaster.call (неидемпотентная отправка не дублируется) и общий лимит."""
+
+import asyncio
+
+import pytest
+from aiohttp import ClientConnectorError, ServerDisconnectedError
+from aiohttp.client_reqrep import ConnectionKey
+from maxapi.exceptions.max import MaxApiError, MaxConnection
+
+from utils import broadcast
+from utils.broadcast import Broadcaster, RedisRateLimiter
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(broadcast.asyncio, "sleep", sleep)
+    return delays
+
+
+def _connection_error(cause: Exception) -> MaxConnection:
+    try:
+        raise MaxConnection(f"Ошибка при отправке запроса: {cause}") from cause
+    except MaxConnection as e:
+        return e
+
+
+def _not_connected() -> MaxConnection:
+    key = ConnectionKey("platform-api2.max.ru", 443, True, True, None, None, None)
+    return _connection_error(ClientConnectorError(key, OSError("refused")))
+
+
+def _failing(*errors, result="ok"):
+    calls = []
+
+    async def func(**kwargs):
+        calls.append(kwargs)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return func, calls
+
+
+def test_send_retried_when_not_sent():
+    func, calls = _failing(_not_connected())
+    assert asyncio.run(Broadcaster(rate=1000).call(func, text="hi")) == "ok"
+    assert len(calls) == 2
+
+
+def test_send_not_retried_after_disconnect():
+    func, calls = _failing(_connection_error(ServerDisconnectedError()))
+    with pytest.raises(MaxConnection):
+        asyncio.run(Broadcaster(rate=1000).call(func, text="hi"))
+    assert len(calls) == 1
+
+
+def test_send_not_retried_on_5xx():
+    func, calls = _failing(MaxApiError(code=502, raw={}))
+    with pytest.raises(MaxApiError):
+        asyncio.run(Broadcaster(rate=1000).call(func, text="hi"))
+    assert len(calls) == 1
+
+
+def test_idempotent_retried_after_disconnect():
+    func, calls = _failing(
+        _connection_error(ServerDisconnectedError()), MaxApiError(code=502, raw={})
+    )
+    result = asyncio.run(Broadcaster(rate=1000).call(func, idempotent=True, text="hi"))
+    assert result == "ok"
+    assert len(calls) == 3
+
+
+def test_429_waits_retry_after(no_sleep):
+    async def func(**kwargs):
+        if not no_sleep:
+            # так заголовок запоминает retry_after_trace
+            broadcast._retry_after.set(42.0)
+            raise MaxApiError(code=429, raw={})
+        return "ok"
+
+    assert asyncio.run(Broadcaster(rate=1000).call(func, text="hi")) == "ok"
+    assert no_sleep == [42.0]
+
+
+def test_parse_retry_after():
+    assert broadcast._parse_retry_after("7") == 7.0
+    assert broadcast._parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert broadcast._parse_retry_after(None) is None
+
+
+def test_broadcasters_share_one_limiter():
+    assert Broadcaster().bucket is Broadcaster().bucket
+
+
+def test_redis_limiter_caps_each_second(monkeypatch, no_sleep):
+    fakeredis = pytest.importorskip("fakeredis")
+    clock = [100.2]
+    monkeypatch.setattr(broadcast.time, "time", lambda: clock[0])
+
+    async def sleep(delay):
+        no_sleep.append(delay)
+        clock[0] += delay
+
+    monkeypatch.setattr(broadcast.asyncio, "sleep", sleep)
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        # два лимитера — две реплики с общим Redis
+        first, second = RedisRateLimiter(redis, 2), RedisRateLimiter(redis, 2)
+        for limiter in (first, second, first):
+            await limiter.acquire()
+
+    asyncio.run(scenario())
+    assert len(no_sleep) == 1 and int(clock[0]) == 101
@@ -0,0 +1,45 @@
+"""Атомарность UserCRUD.points / add_duration (см. benchmarks/concurrent_counters.py)."""
+
+import asyncio
+
+from core.database.requests import UserCRUD
+
+TID = 424242
+PARALLEL = 200
+
+
+async def _create_user():
+    await UserCRUD.create(tid=TID, chat_id=TID, name="test", username="test", points=0)
+
+
+def test_concurrent_points_are_not_lost(db):
+    async def scenario():
+        await _create_user()
+        await asyncio.gather(*(UserCRUD.points(TID, 1) for _ in range(PARALLEL)))
+        return await UserCRUD.get_by_tid(TID)
+
+    user = db(scenario())
+    assert user.points == PARALLEL
+
+
+def test_concurrent_durations_are_not_lost(db):
+    async def scenario():
+        await _create_user()
+        await asyncio.gather(*(UserCRUD.add_duration(TID, 2) for _ in range(PARALLEL)))
+        return await UserCRUD.get_by_tid(TID)
+
+    user = db(scenario())
+    assert user.total_seconds == 2 * PARALLEL
+
+
+def test_points_are_clamped_at_zero(db):
+    async def scenario():
+        await _create_user()
+        await UserCRUD.points(TID, 5)
+        return await UserCRUD.points(TID, -100)
+
+    assert db(scenario()) == 0
+
+
+def test_points_for_unknown_user(db):
+    assert db(UserCRUD.points(TID, 1)) is None
@@ -0,0 +1,98 @@
+"""
+OrderedDispatcher: события пользователя по очереди, двойное нажатие отбрасывается,
+длинная очередь одного пользователя не держит остальных.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from maxapi import Dispatcher
+
+from utils.dispatch import OrderedDispatcher
+from utils.webhook import WebhookServer
+
+
+class FakeEvent:
+    def __init__(self, user_id: int, payload: str | None = None):
+        self.user_id = user_id
+        self.callback = SimpleNamespace(payload=payload) if payload else None
+
+    def get_ids(self):
+        return None, self.user_id
+
+
+def _dispatcher(monkeypatch, handled: list, delay: float = 0.01, **kwargs):
+    """OrderedDispatcher, у которого тело Dispatcher.handle — запись события под изоляцией."""
+
+    async def handle(self, event):
+        async with self.event_isolation.lock(event.get_ids()):
+            handled.append(("start", event.user_id))
+            await asyncio.sleep(delay)
+            handled.append(("end", event.user_id))
+
+    monkeypatch.setattr(Dispatcher, "handle", handle)
+    return OrderedDispatcher(**kwargs)
+
+
+def test_same_user_is_serialized(monkeypatch):
+    handled = []
+
+    async def scenario():
+        dp = _dispatcher(monkeypatch, handled)
+        await asyncio.gather(*(dp.handle(FakeEvent(1)) for _ in range(3)), dp.handle(FakeEvent(2)))
+
+    asyncio.run(scenario())
+    own = [step for step, user in handled if user == 1]
+    assert own == ["start", "end"] * 3
+    # второй пользователь не ждёт очереди первого
+    assert handled.index(("start", 2)) < handled.index(("end", 1))
+
+
+def test_double_click_dropped(monkeypatch):
+    handled = []
+
+    async def scenario():
+        dp = _dispatcher(monkeypatch, handled)
+        await asyncio.gather(dp.handle(FakeEvent(1, "done")), dp.handle(FakeEvent(1, "done")))
+        # после завершения та же кнопка снова принимается
+        await dp.handle(FakeEvent(1, "done"))
+        return dp.dropped
+
+    assert asyncio.run(scenario()) == 1
+    assert handled.count(("start", 1)) == 2
+
+
+def test_busy_user_does_not_stall_webhook(monkeypatch):
+    handled = []
+
+    async def scenario():
+        dp = _dispatcher(monkeypatch, handled, delay=0.001)
+        server = WebhookServer(dp, bot=None)
+        consumer = asyncio.create_task(server._consume())
+        # очередь одного пользователя длиннее лимита параллельности
+        for _ in range(100):
+            server.queue.put_nowait(FakeEvent(1))
+        server.queue.put_nowait(FakeEvent(2))
+        await server.queue.join()
+        consumer.cancel()
+
+    asyncio.run(scenario())
+    assert handled.count(("end", 1)) == 100
+    assert handled.index(("end", 2)) < handled.index(("start", 1)) + 10
+
+
+def test_pending_events_are_bounded(monkeypatch):
+    handled = []
+
+    async def scenario():
+        dp = _dispatcher(monkeypatch, handled, max_pending=2)
+        dp.spawn_handle_task(FakeEvent(1))
+        dp.spawn_handle_task(FakeEvent(2))
+        peak = dp.pending
+        await dp.wait_for_room()
+        return peak, dp.pending, len(handled)
+
+    peak, after, steps = asyncio.run(scenario())
+    assert peak == 2 and after < 2
+    # место освободилось только когда событие обработано
+    assert steps >= 2
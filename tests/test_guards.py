@@ -0,0 +1,40 @@
+"""Кэши look_if_not_target не устаревают между репликами."""
+
+import asyncio
+import time
+
+import pytest
+
+from utils.guards import NewDayUsers
+from utils.targets_cache import TargetsTodayCache
+
+
+def test_negative_result_is_not_cached():
+    cache = TargetsTodayCache(max_size=10)
+    cache.set(1, False, 180)
+    cache.set(2, True, 180)
+    assert cache.get(1) is None
+    assert cache.get(2) == 180
+
+
+def test_shared_mode_caps_ttl():
+    cache = TargetsTodayCache(max_size=10, max_ttl=30)
+    cache.set(1, True, 180)
+    _, expires_at = cache.cache._entries[1]
+    assert 0 < expires_at - time.monotonic() <= 30
+
+
+def test_new_day_flag_is_shared_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        # две реплики с общим Redis
+        first, second = NewDayUsers(10, redis), NewDayUsers(10, redis)
+        before = await second.contains(1)
+        await first.add(1, ttl=60)
+        return before, await second.contains(1), await redis.ttl("new_day:1")
+
+    before, after, ttl = asyncio.run(scenario())
+    assert (before, after) == (False, True)
+    assert 0 < ttl <= 60
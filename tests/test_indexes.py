@@ -0,0 +1,28 @@
+"""Горячие read-запросы идут по индексам (см. python -m core.database.migrations check_indexes)."""
+
+from core.database.migrations import _create_concurrently, _full_scans, check_indexes, create_indexes
+from core.database.models import Session, User
+
+
+def test_hot_queries_use_indexes(db, capsys):
+    ok = db(check_indexes())
+    assert ok, capsys.readouterr().out
+
+
+def test_full_scan_is_detected():
+    plan = ["SCAN sessions", "SEARCH users USING INDEX ix_users_tid (tid=?)"]
+    assert _full_scans(plan) == ["SCAN sessions"]
+    assert _full_scans(["SCAN targets USING COVERING INDEX ix_targets_user_day"]) == []
+
+
+def test_postgresql_indexes_built_concurrently():
+    indexes = {index.name: index for index in Session.__table__.indexes}
+    ddl = _create_concurrently(indexes["ix_sessions_active"])
+    assert ddl.startswith("CREATE INDEX CONCURRENTLY ix_sessions_active ON sessions")
+    assert ddl.endswith("WHERE is_active")
+    (tid_index,) = [index for index in User.__table__.indexes if index.name == "ix_users_tid"]
+    assert _create_concurrently(tid_index).startswith("CREATE UNIQUE INDEX CONCURRENTLY ix_users_tid")
+
+
+def test_create_indexes_is_noop_on_synced_base(db):
+    assert db(create_indexes()) == 0
@@ -0,0 +1,23 @@
+"""LevelTable: перечитывание config.ini и прежняя таблица при пропаже файла."""
+
+from utils.cfg_points import BASE_LEVEL, LevelTable
+
+
+def test_missing_config_keeps_previous_table(tmp_path):
+    config = tmp_path / "config.ini"
+    config.write_text("[levels]\n100 = 2\n300 = 3\n", encoding="utf-8")
+    table = LevelTable(str(config), check_interval=0)
+    assert table.items() == [(100, 2), (300, 3)]
+
+    config.unlink()
+    assert table.items() == [(100, 2), (300, 3)]
+    assert table.level_for(150) == 2
+
+    config.write_text("[levels]\n50 = 4\n", encoding="utf-8")
+    assert table.items() == [(50, 4)]
+
+
+def test_no_config_from_start():
+    table = LevelTable("/nonexistent/config.ini", check_interval=0)
+    assert table.items() == []
+    assert table.level_for(1000) == BASE_LEVEL
@@ -0,0 +1,92 @@
+"""Границы «сегодня» по поясу пользователя (users.utc_offset)."""
+
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, select
+
+from core.database.models import DailyActivity, Target, User, async_session
+from core.database.requests import SessionCRUD, TargetCRUD
+from utils.cache import seconds_until_local_midnight
+from utils.dates import day_bounds, local_today, split_by_day
+
+
+def test_seconds_until_local_midnight_uses_offset():
+    now = datetime(2026, 1, 1, 20, 0, tzinfo=timezone.utc)
+    assert seconds_until_local_midnight(0, now) == 4 * 3600
+    # UTC+3: 23:00 местного
+    assert seconds_until_local_midnight(180, now) == 3600
+    # UTC+10: уже 06:00 следующего дня
+    assert seconds_until_local_midnight(600, now) == 18 * 3600
+
+
+def test_day_bounds_in_server_time():
+    now = datetime(2026, 1, 1, 20, 0, tzinfo=timezone.utc)
+    day = local_today(600, now)
+    assert day == datetime(2026, 1, 2).date()
+    # полночь UTC+10 — это 17:00 предыдущего дня по UTC+3
+    assert day_bounds(day, 600) == (datetime(2026, 1, 1, 17), datetime(2026, 1, 2, 17))
+
+
+def test_split_by_day_uses_local_days():
+    # 16:00–18:00 по UTC+3 — это 23:00–01:00 по UTC+10
+    start, end = datetime(2026, 1, 1, 16), datetime(2026, 1, 1, 18)
+    assert split_by_day(start, end) == {datetime(2026, 1, 1).date(): 7200}
+    assert split_by_day(start, end, 600) == {
+        datetime(2026, 1, 1).date(): 3600,
+        datetime(2026, 1, 2).date(): 3600,
+    }
+
+
+def test_has_targets_today_by_user_offset(db):
+    async def scenario():
+        offset = 600
+        start, _ = day_bounds(local_today(offset), offset)
+        async with async_session() as session:
+            await session.execute(
+                insert(User), [{"tid": 1, "utc_offset": offset}, {"tid": 2, "utc_offset": offset}]
+            )
+            await session.execute(
+                insert(Target),
+                [
+                    {"user_id": 1, "description": "сегодня", "date_add": start},
+                    {"user_id": 2, "description": "вчера", "date_add": start - timedelta(seconds=1)},
+                ],
+            )
+            await session.commit()
+        return (
+            await TargetCRUD.has_targets_today(1),
+            await TargetCRUD.has_targets_today(2),
+            await TargetCRUD.has_targets_today(3),
+        )
+
+    assert db(scenario()) == ((True, 600), (False, 600), None)
+
+
+def test_today_windows_follow_user_offset(db):
+    async def scenario():
+        offset = 600
+        today = local_today(offset)
+        start, _ = day_bounds(today, offset)
+        async with async_session() as session:
+            await session.execute(insert(User), [{"tid": 1, "utc_offset": offset}])
+            await session.execute(
+                insert(Target),
+                [
+                    {"user_id": 1, "description": "сегодня", "date_add": start},
+                    {"user_id": 1, "description": "вчера", "date_add": start - timedelta(seconds=1)},
+                ],
+            )
+            await session.commit()
+        # сессия через местную полночь: час вчера, час сегодня
+        await SessionCRUD.add_closed(1, None, start - timedelta(hours=1), start + timedelta(hours=1))
+        _, targets = await TargetCRUD.get_all_target_today(1)
+        async with async_session() as session:
+            res = await session.execute(
+                select(DailyActivity.day, DailyActivity.seconds).order_by(DailyActivity.day)
+            )
+            days = [tuple(row) for row in res]
+        return [t.description for t in targets], days, today
+
+    descriptions, days, today = db(scenario())
+    assert descriptions == ["сегодня"]
+    assert days == [(today - timedelta(days=1), 3600), (today, 3600)]
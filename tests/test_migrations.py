@@ -0,0 +1,82 @@
+"""Перенос устаревшего users.count_time в total_seconds и пересборка daily_activity."""
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, select, update
+
+from core.database.migrations import backfill_daily_activity
+from core.database.models import DailyActivity, User, _convert_count_time, async_session
+
+EPOCH = datetime(1970, 1, 1)
+
+
+async def _seed(rows):
+    async with async_session() as session:
+        await session.execute(insert(User), rows)
+        await session.commit()
+
+
+async def _totals():
+    async with async_session() as session:
+        res = await session.execute(select(User.tid, User.total_seconds).order_by(User.tid))
+        return dict(res.all())
+
+
+def test_convert_is_idempotent_and_resumable(db):
+    async def scenario():
+        await _seed(
+            [
+                {"tid": 1, "count_time": EPOCH + timedelta(hours=2, seconds=5)},
+                # время, набранное уже в total_seconds, сохраняется
+                {"tid": 2, "count_time": EPOCH + timedelta(hours=1), "total_seconds": 60},
+                {"tid": 3, "count_time": None},
+                {"tid": 4, "count_time": EPOCH + timedelta(seconds=90)},
+            ]
+        )
+        # прерванный перенос: первая пачка успела закоммититься
+        async with async_session() as session:
+            await session.execute(
+                update(User).where(User.tid == 1).values(total_seconds=7205, count_time=None)
+            )
+            await session.commit()
+        await _convert_count_time(batch_size=1)
+        first = await _totals()
+        await _convert_count_time(batch_size=1)
+        return first, await _totals()
+
+    first, second = db(scenario())
+    assert first == {1: 7205, 2: 3660, 3: 0, 4: 90}
+    assert second == first
+
+
+def test_converted_time_is_not_recredited(db):
+    async def scenario():
+        await _seed([{"tid": 1, "count_time": EPOCH + timedelta(seconds=100)}])
+        await _convert_count_time()
+        converted = await _totals()
+        # пользователь вычел всё время — total_seconds снова 0
+        async with async_session() as session:
+            await session.execute(update(User).where(User.tid == 1).values(total_seconds=0))
+            await session.commit()
+        # перезапуск бота
+        await _convert_count_time()
+        return converted, await _totals()
+
+    assert db(scenario()) == ({1: 100}, {1: 0})
+
+
+def test_backfill_drops_orphans_despite_null_tid(db):
+    async def scenario():
+        # пользователь без tid: NOT IN (..., NULL) не удалил бы ни одной строки
+        await _seed([{"tid": 1}, {"tid": None}])
+        async with async_session() as session:
+            await session.execute(
+                insert(DailyActivity),
+                [{"user_id": 2, "target_id": 0, "day": date(2026, 1, 1), "seconds": 60}],
+            )
+            await session.commit()
+        await backfill_daily_activity()
+        async with async_session() as session:
+            return (await session.execute(select(DailyActivity.user_id))).scalars().all()
+
+    assert db(scenario()) == []
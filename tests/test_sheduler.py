@@ -0,0 +1,123 @@
+"""
+Ночной batch-расчёт поинтов: день оценивается после закрытия окна отметок,
+ровно один раз, пропущенные дни наверстываются; задания выполняет один лидер.
+"""
+
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import insert
+
+from core.database.models import ScoredDay, Target, User, async_session
+from core.database.requests import TargetCRUD, UserCRUD
+from utils.cfg_points import BOOST, CHECKOFF_WINDOW, NO_TARGETS_PENALTY, xyz
+from utils.dates import checkoff_day, day_bounds
+from utils.sheduler import SchedulerLeader, score_closed_days, send_midnight_messages
+
+OFFSET = 0
+DAY = date(2026, 1, 1)
+# местная полночь пояса UTC+0 после дня DAY
+MIDNIGHT = datetime(2026, 1, 2, tzinfo=timezone.utc)
+WINDOW = timedelta(minutes=CHECKOFF_WINDOW)
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, **kwargs):
+        self.sent.append(kwargs["user_id"])
+
+
+async def _seed_user_with_target():
+    """Пользователь с одной целью на DAY; предыдущий день пояса уже оценён."""
+    start, _ = day_bounds(DAY, OFFSET)
+    async with async_session() as session:
+        await session.execute(insert(User), [{"tid": 1, "utc_offset": OFFSET, "points": 50}])
+        await session.execute(
+            insert(Target),
+            [{"user_id": 1, "description": "цель", "date_add": start + timedelta(hours=12)}],
+        )
+        await session.execute(
+            insert(ScoredDay), [{"utc_offset": OFFSET, "day": DAY - timedelta(days=1)}]
+        )
+        await session.commit()
+
+
+async def _points() -> int:
+    return (await UserCRUD.get_by_tid(1)).points
+
+
+def test_checkoff_day_covers_window():
+    assert checkoff_day(0, 360, MIDNIGHT + timedelta(hours=5)) == DAY
+    assert checkoff_day(0, 360, MIDNIGHT + timedelta(hours=6)) == date(2026, 1, 2)
+    assert checkoff_day(0, 0, MIDNIGHT) == date(2026, 1, 2)
+
+
+def test_checkoff_after_rollover_is_scored(db):
+    async def scenario():
+        await _seed_user_with_target()
+        bot = RecordingBot()
+        await send_midnight_messages(bot, [OFFSET])
+        # в полночь день ещё не оценивается — окно отметок открыто
+        at_midnight = await score_closed_days(MIDNIGHT)
+
+        # пользователь отмечает цель уже после ночного сообщения
+        _, targets = await TargetCRUD.get_all_target_today(1, DAY)
+        await TargetCRUD.set_done_bulk(done_ids=[t.id for t in targets], undone_ids=[])
+
+        after_window = await score_closed_days(MIDNIGHT + WINDOW)
+        return bot.sent, at_midnight, after_window, await _points()
+
+    sent, at_midnight, after_window, points = db(scenario())
+    assert sent == [1]
+    assert at_midnight == []
+    assert after_window == [(OFFSET, DAY)]
+    assert points == 50 + xyz(1, 1, BOOST)
+
+
+def test_day_is_scored_once(db):
+    async def scenario():
+        await _seed_user_with_target()
+        # повторный тик и параллельная реплика
+        first = await score_closed_days(MIDNIGHT + WINDOW)
+        again = await asyncio.gather(
+            score_closed_days(MIDNIGHT + WINDOW), score_closed_days(MIDNIGHT + WINDOW)
+        )
+        return first, again, await _points()
+
+    first, again, points = db(scenario())
+    assert first == [(OFFSET, DAY)]
+    assert again == [[], []]
+    assert points == 50
+
+
+def test_missed_days_are_caught_up(db):
+    async def scenario():
+        await _seed_user_with_target()
+        # бот лежал двое суток — тиков за DAY и следующий день не было
+        scored = await score_closed_days(MIDNIGHT + timedelta(days=2) + WINDOW)
+        return scored, await _points()
+
+    scored, points = db(scenario())
+    assert scored == [(OFFSET, DAY + timedelta(days=n)) for n in range(3)]
+    # DAY без отметок — 0, два дня без целей — штраф
+    assert points == max(50 + 2 * NO_TARGETS_PENALTY, 0)
+
+
+def test_single_leader_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        first, second = SchedulerLeader(redis, ttl=60), SchedulerLeader(redis, ttl=60)
+        both = await first.renew(), await second.renew()
+        # лидер продлевает ключ и остаётся лидером
+        renewed = await first.renew()
+        # ключ лидера истёк (реплика упала) — лидерство переходит
+        await redis.delete("scheduler:leader")
+        taken = await second.renew(), await first.renew()
+        return both, renewed, taken
+
+    assert asyncio.run(scenario()) == ((True, False), True, (True, False))
@@ -0,0 +1,90 @@
+"""FSM-хранилище: кодеки данных, TTL в Redis и чтение состояния с данными за один запрос."""
+
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utils.states import UserStates  # noqa: E402
+from utils.storage import MemoryStorage, RedisStorage, StorageContext, dumps, loads  # noqa: E402
+
+DATA = {
+    "started": datetime(2026, 1, 2, 3, 4, 5),
+    "day": date(2026, 1, 2),
+    "done": {1, 2},
+    "nested": {"at": [datetime(2026, 1, 2)]},
+    "mid": "abc",
+}
+
+
+def test_codec_round_trip():
+    assert loads(dumps(DATA)) == DATA
+    assert loads(None) == {}
+
+
+def _redis():
+    return fakeredis.FakeAsyncRedis()
+
+
+def test_redis_ttl_and_round_trip():
+    async def scenario():
+        redis = _redis()
+        backend = RedisStorage(redis, ttl=100, prefix="t")
+        ctx = StorageContext(1, 2, backend=backend)
+        await ctx.set_state(UserStates.counted_time)
+        await ctx.set_data(DATA)
+        ttls = await redis.ttl("t:1:2:s"), await redis.ttl("t:1:2:d")
+
+        fresh = StorageContext(1, 2, backend=backend)
+        state = await fresh.get_state()
+        data = await fresh.get_data()
+        await fresh.clear()
+        return ttls, state, data, await redis.exists("t:1:2:s", "t:1:2:d")
+
+    ttls, state, data, left = asyncio.run(scenario())
+    assert all(0 < ttl <= 100 for ttl in ttls)
+    assert state is UserStates.counted_time
+    assert data == DATA
+    assert left == 0
+
+
+def test_state_and_data_in_one_round_trip():
+    async def scenario():
+        redis = _redis()
+        backend = RedisStorage(redis, ttl=100, prefix="t")
+        await StorageContext(1, 2, backend=backend).update_data(mid="abc")
+
+        calls = []
+        for name in ("get", "mget"):
+            original = getattr(redis, name)
+
+            async def counted(*args, _name=name, _original=original, **kwargs):
+                calls.append(_name)
+                return await _original(*args, **kwargs)
+
+            setattr(redis, name, counted)
+
+        ctx = StorageContext(1, 2, backend=backend)
+        await ctx.get_state()
+        first = await ctx.get_data()
+        # предзагрузка одноразовая: дальше — свежие данные из бэкенда
+        await ctx.update_data(mid="def")
+        second = await ctx.get_data()
+        return calls, first, second
+
+    calls, first, second = asyncio.run(scenario())
+    assert calls == ["mget", "get", "get"]
+    assert first == {"mid": "abc"}
+    assert second == {"mid": "def"}
+
+
+def test_memory_backend_context():
+    async def scenario():
+        ctx = StorageContext(1, 2, backend=MemoryStorage())
+        await ctx.set_state(UserStates.new_day)
+        await ctx.update_data(mid="abc")
+        return await ctx.get_state(), await ctx.get_data()
+
+    assert asyncio.run(scenario()) == (UserStates.new_day, {"mid": "abc"})
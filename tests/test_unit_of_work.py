@@ -0,0 +1,72 @@
+"""unit_of_work на хендлере: исключение хендлера откатывает его запись, вызов API — фиксирует."""
+
+import time
+from types import SimpleNamespace
+
+from maxapi import Bot, Dispatcher, F, Router
+from maxapi.methods.types.getted_updates import process_update_webhook
+from maxapi.types import MessageCreated
+
+from core.database.requests import UserCRUD, checkpoint, unit_of_work
+from utils.dispatch import scope_handlers
+
+NOW_MS = int(time.time() * 1000)
+
+
+class StubBot(Bot):
+    def __init__(self):
+        super().__init__("test", auto_requests=False)
+
+    async def get_me(self):
+        return SimpleNamespace(user_id=0, username="test", first_name="test")
+
+    async def get_subscriptions(self):
+        return SimpleNamespace(subscriptions=[])
+
+
+def _message(uid: int, text: str) -> dict:
+    user = {"user_id": uid, "first_name": "u", "is_bot": False, "last_activity_time": NOW_MS}
+    return {
+        "update_type": "message_created",
+        "timestamp": NOW_MS,
+        "message": {
+            "sender": user,
+            "recipient": {"chat_id": uid, "chat_type": "dialog", "user_id": 0},
+            "timestamp": NOW_MS,
+            "body": {"mid": "m1", "seq": 1, "text": text, "attachments": None},
+        },
+    }
+
+
+def _router() -> Router:
+    router = Router()
+
+    @router.message_created(F.message.body.text == "fail")
+    async def write_then_fail(event: MessageCreated):
+        await UserCRUD.create(tid=1, chat_id=1, name="a", username="a")
+        raise RuntimeError("сбой после записи")
+
+    @router.message_created(F.message.body.text == "api")
+    async def write_call_api_then_fail(event: MessageCreated):
+        await UserCRUD.create(tid=2, chat_id=2, name="b", username="b")
+        # так commit_before_api фиксирует единицу работы перед запросом к Max API
+        await checkpoint()
+        await UserCRUD.create(tid=3, chat_id=3, name="c", username="c")
+        raise RuntimeError("сбой после вызова API")
+
+    return router
+
+
+def test_handler_exception_rolls_back(db):
+    async def scenario():
+        bot = StubBot()
+        router = _router()
+        scope_handlers(unit_of_work, router)
+        dp = Dispatcher()
+        dp.include_routers(router)
+        await dp.startup(bot)
+        for text in ("fail", "api"):
+            await dp.handle(await process_update_webhook(event_json=_message(1, text), bot=bot))
+        return [await UserCRUD.get_by_tid(tid) is not None for tid in (1, 2, 3)]
+
+    assert db(scenario()) == [False, True, False]
@@ -0,0 +1,313 @@
+"""
+Конкурентная рассылка: пул воркеров, общий лимитер под лимиты Max API,
+повторы с экспоненциальной задержкой и счётчики прогресса.
+
+Лимит BROADCAST_RPS — на бота, а не на рассылку: все Broadcaster'ы процесса
+берут токены из одного лимитера (shared_limiter), а при FSM_STORAGE=redis —
+из общего для всех реплик счётчика в Redis.
+
+Отправка сообщения не идемпотентна: повтор после того, как запрос ушёл
+на сервер, может продублировать сообщение. Поэтому send_message повторяется
+только если запрос точно не отправлен (не удалось соединиться) или сервер
+ответил 429 — тогда пауза берётся из Retry-After. Идемпотентные вызовы
+(edit_message) повторяются и на обрывах связи, и на 5xx.
+"""
+
+import asyncio
+import os
+import random
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable
+
+from aiohttp import (
+    ClientConnectionError,
+    ClientConnectorError,
+    ConnectionTimeoutError,
+    TraceConfig,
+)
+from maxapi.exceptions.max import MaxConnection
+
+from utils.storage import FSM_STORAGE
+
+# Max API допускает ~30 запросов в секунду на бота — оставляем запас
+BROADCAST_RPS = float(os.getenv("BROADCAST_RPS", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "16"))
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", "4"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# сервер отклонил запрос, не выполняя его — повтор безопасен для любого вызова
+TOO_MANY_REQUESTS = 429
+
+# Retry-After последнего ответа 429 в текущей задаче (заполняет retry_after_trace)
+_retry_after: ContextVar[float | None] = ContextVar("retry_after", default=None)
+
+
+class BroadcastError(Exception):
+    """Max API вернул ошибку, которую не удалось пережить повторами."""
+
+    def __init__(self, code: int, raw: Any = None):
+        super().__init__(f"Max API error {code}: {raw}")
+        self.code = code
+        self.raw = raw
+
+
+def _status_of(obj: Any) -> int | None:
+    """HTTP-код из ответа/исключения maxapi: Error(code=...) в 0.9.x, MaxApiError в новых."""
+    code = getattr(obj, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def _not_sent(error: BaseException) -> bool:
+    """Запрос не дошёл до сервера: соединение не установилось или сессия закрылась до отправки."""
+    cause = error.__cause__ if isinstance(error, MaxConnection) else error
+    if isinstance(cause, (ClientConnectorError, ConnectionTimeoutError)):
+        return True
+    # maxapi превращает RuntimeError закрытой сессии в ClientConnectionError
+    return isinstance(cause, ClientConnectionError) and isinstance(
+        cause.__cause__, RuntimeError
+    )
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """Retry-After: секунды или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_after_trace() -> TraceConfig:
+    """
+    TraceConfig для aiohttp-сессии бота: maxapi не отдаёт заголовки ответа
+    в MaxApiError, поэтому Retry-After ответа 429 запоминается здесь.
+    """
+
+    async def on_request_end(session, context, params):
+        if params.response.status == TOO_MANY_REQUESTS:
+            _retry_after.set(_parse_retry_after(params.response.headers.get("Retry-After")))
+
+    trace = TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, всплеск до capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RedisRateLimiter:
+    """
+    Лимит на все реплики: не больше rate запросов в каждую секунду
+    (INCR счётчика текущей секунды в Redis). Окно фиксированное, поэтому
+    BROADCAST_RPS и держим ниже лимита Max API.
+    """
+
+    def __init__(self, redis, rate: float, prefix: str = "broadcast:rps"):
+        self.redis = redis
+        self.limit = max(1, int(rate))
+        self.prefix = prefix
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.time()
+            second = int(now)
+            key = f"{self.prefix}:{second}"
+            async with self.redis.pipeline(transaction=True) as pipe:
+                count, _ = await pipe.incr(key).expire(key, 2).execute()
+            if count <= self.limit:
+                return
+            # разброс, чтобы ждущие реплики не ударили разом в начало секунды
+            await asyncio.sleep(second + 1 - now + random.uniform(0, 0.05))
+
+
+_shared_limiter: TokenBucket | RedisRateLimiter | None = None
+
+
+def shared_limiter() -> TokenBucket | RedisRateLimiter:
+    """Один лимитер BROADCAST_RPS на процесс, при FSM_STORAGE=redis — на все реплики."""
+    global _shared_limiter
+    if _shared_limiter is None:
+        if FSM_STORAGE == "redis":
+            from utils.redis import get_redis_async
+
+            _shared_limiter = RedisRateLimiter(get_redis_async(), BROADCAST_RPS)
+        else:
+            _shared_limiter = TokenBucket(BROADCAST_RPS)
+    return _shared_limiter
+
+
+class BroadcastStats:
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.api_calls = 0
+        self.retried = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def __str__(self) -> str:
+        rate = self.processed / self.elapsed if self.elapsed else 0.0
+        return (
+            f"обработано={self.processed} ошибок={self.failed} "
+            f"запросов={self.api_calls} повторов={self.retried} "
+            f"за {self.elapsed:.1f}с ({rate:.1f}/с)"
+        )
+
+
+class _LimitedBot:
+    """Прокси бота: send_message/edit_message идут через лимитер и повторы."""
+
+    def __init__(self, bot, broadcaster: "Broadcaster"):
+        self._bot = bot
+        self._broadcaster = broadcaster
+
+    async def send_message(self, **kwargs):
+        return await self._broadcaster.call(self._bot.send_message, idempotent=False, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        return await self._broadcaster.call(self._bot.edit_message, idempotent=True, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        workers: int = BROADCAST_WORKERS,
+        rate: float | None = None,
+        retries: int = BROADCAST_RETRIES,
+        progress_every: int = 1000,
+    ):
+        self.workers = workers
+        self.retries = retries
+        self.progress_every = progress_every
+        # rate задают только тесты и бенчмарки — свой лимитер мимо общего
+        self.bucket = TokenBucket(rate) if rate is not None else shared_limiter()
+        self.stats = BroadcastStats()
+
+    def wrap(self, bot) -> _LimitedBot:
+        return _LimitedBot(bot, self)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(30.0, 0.5 * 2**attempt) + random.uniform(0, 0.5)
+
+    async def call(
+        self, func: Callable[..., Awaitable[Any]], *args, idempotent: bool = False, **kwargs
+    ):
+        """
+        Один запрос к API с учётом лимита. Повторяются 429 (с паузой из
+        Retry-After) и ошибки до отправки запроса; обрывы связи и 5xx —
+        только для идемпотентных вызовов.
+        """
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            self.stats.api_calls += 1
+            _retry_after.set(None)
+            try:
+                result = await func(*args, **kwargs)
+            except (MaxConnection, asyncio.TimeoutError, ConnectionError) as e:
+                if attempt == self.retries or not (idempotent or _not_sent(e)):
+                    raise
+                error: Exception = e
+                status = None
+            except Exception as e:
+                status = _status_of(e)
+                if not self._retryable(status, idempotent) or attempt == self.retries:
+                    raise
+                error = e
+            else:
+                status = _status_of(result)
+                if status is None or status < 400:
+                    return result
+                error = BroadcastError(status, getattr(result, "raw", None))
+                if not self._retryable(status, idempotent) or attempt == self.retries:
+                    raise error
+
+            self.stats.retried += 1
+            delay = self._backoff(attempt)
+            if status == TOO_MANY_REQUESTS:
+                delay = max(delay, _retry_after.get() or 0.0)
+            print(f"↻ Повтор через {delay:.1f}с после ошибки: {error}")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retryable(status: int | None, idempotent: bool) -> bool:
+        if status == TOO_MANY_REQUESTS:
+            return True
+        return idempotent and status in RETRY_STATUSES
+
+    async def run(
+        self,
+        items: AsyncIterable[Any] | Iterable[Any],
+        job: Callable[[Any], Awaitable[Any]],
+    ) -> BroadcastStats:
+        """
+        Прогоняет job по всем items пулом из self.workers воркеров.
+        Ошибка job для одного элемента не прерывает рассылку.
+        """
+        self.stats = BroadcastStats()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        done = object()
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                try:
+                    await job(item)
+                except Exception as e:
+                    self.stats.failed += 1
+                    print(f"❌ Ошибка рассылки для {item!r}: {e}")
+                self.stats.processed += 1
+                if self.stats.processed % self.progress_every == 0:
+                    print(f"📨 Рассылка: {self.stats}")
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            if hasattr(items, "__aiter__"):
+                async for item in items:  # type: ignore
+                    await queue.put(item)
+            else:
+                for item in items:  # type: ignore
+                    await queue.put(item)
+        finally:
+            for _ in tasks:
+                await queue.put(done)
+            await asyncio.gather(*tasks)
+        return self.stats
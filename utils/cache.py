@@ -0,0 +1,128 @@
+"""
+Ограниченный по размеру кэш с TTL и счётчиками для процессных кэшей бота.
+Не импортирует core — им пользуются и guards, и CRUD.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Hashable
+
+from utils.dates import tz_from_offset
+
+_MISSING = object()
+
+# кэши с записями до полуночи пользователя (см. purge_expired_day_caches)
+_day_caches: list["BoundedCache"] = []
+
+
+def seconds_until_local_midnight(
+    utc_offset: int | None = None, now: datetime | None = None
+) -> float:
+    """Секунд до полуночи в поясе utc_offset (минуты от UTC, None — пояс по умолчанию)."""
+    tz = tz_from_offset(utc_offset)
+    now = (now or datetime.now(tz)).astimezone(tz)
+    midnight = datetime.combine(
+        now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo
+    )
+    return (midnight - now).total_seconds()
+
+
+class BoundedCache:
+    """
+    LRU на max_size ключей; запись живёт ttl секунд (None — без срока).
+    Счётчики hits/misses/evictions/expired доступны через stats().
+    day_scoped=True — просроченные записи кэша вычищает purge_expired_day_caches().
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int,
+        ttl: float | None = None,
+        day_scoped: bool = False,
+    ):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, float | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        if day_scoped:
+            _day_caches.append(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry  # type: ignore
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """ttl перекрывает срок по умолчанию для этой записи."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]  # type: ignore
+
+    def purge(self) -> int:
+        """Удаляет все записи, возвращает сколько было."""
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        stale = [
+            key
+            for key, (_, expires_at) in self._entries.items()
+            if expires_at is not None and now >= expires_at
+        ]
+        for key in stale:
+            del self._entries[key]
+        self.expired += len(stale)
+        return len(stale)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __str__(self) -> str:
+        return f"{self.name}: " + " ".join(f"{k}={v}" for k, v in self.stats().items())
+
+
+def purge_expired_day_caches() -> None:
+    """
+    Удаляет из day_scoped кэшей записи, чья полночь уже наступила, и пишет
+    счётчики в лог. Общего сброса нет: у каждого пользователя своя полночь.
+    """
+    for cache in _day_caches:
+        print(f"🧹 Кэш {cache} — удалено просроченных {cache.purge_expired()}")
@@ -1,14 +1,113 @@
+import bisect
 import configparser
+import os
+import time
 
 from core.database.requests import TargetCRUD, SessionCRUD, UserCRUD
-from datetime import datetime, timedelta
+from datetime import date, timedelta
+from utils.dates import checkoff_day, format_utc_offset
 
-config = configparser.ConfigParser()
+# user — поинты считаются, когда пользователь жмёт «Готово» в итогах дня;
+# batch — одним проходом по всем пользователям пояса, когда закроется окно отметок (см. sheduler)
+SCORING_MODE = os.getenv("SCORING_MODE", "user")
+# сколько минут после местной полуночи итоги дня показывают вчерашние цели;
+# batch оценивает день, когда это окно закрылось
+CHECKOFF_WINDOW = int(os.getenv("CHECKOFF_WINDOW", "360"))
+if not 0 <= CHECKOFF_WINDOW < 24 * 60:
+    raise ValueError(f"CHECKOFF_WINDOW должен быть в [0, 1440) минут, получено {CHECKOFF_WINDOW}")
 
+BOOST = 0.6314
+NO_TARGETS_PENALTY = -10
+ACTIVITY_BONUS = 3
+ACTIVITY_BONUS_AFTER = timedelta(hours=3)
 
-def get_levels_config(config_path="config.ini"):
-    config.read(config_path, encoding="utf-8-sig")
-    return dict(config["levels"])
+BASE_LEVEL = 1
+
+
+class LevelTable:
+    """
+    Секция [levels] из config.ini: «порог поинтов = уровень».
+    Разбирается один раз в числа, отсортированные по порогу; файл
+    перечитывается, только если сменился его mtime (проверка не чаще
+    раза в check_interval секунд). Поиск уровня — bisect, O(log n).
+    Пропавший или битый файл не сбрасывает таблицу — остаётся прежняя.
+    """
+
+    def __init__(self, config_path: str = "config.ini", check_interval: float = 1.0):
+        self.config_path = config_path
+        self.check_interval = check_interval
+        self._mtime: int | None = None
+        self._checked_at = float("-inf")
+        self._thresholds: list[int] = []
+        self._levels: list[int] = []
+        # _reached[i] — наибольший уровень среди первых i порогов
+        self._reached: list[int] = [BASE_LEVEL]
+        self._missing = False
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError as e:
+            # пишем один раз на пропажу, а не на каждую проверку
+            if not self._missing:
+                print(f"⚠️ Нет {self.config_path} ({e}) — остаётся прежняя таблица уровней")
+            self._missing = True
+            return
+        self._missing = False
+        if mtime == self._mtime:
+            return
+
+        parser = configparser.ConfigParser()
+        try:
+            parser.read(self.config_path, encoding="utf-8-sig")
+            table = sorted(
+                (int(threshold), int(level))
+                for threshold, level in (
+                    parser["levels"].items() if parser.has_section("levels") else ()
+                )
+            )
+        except (configparser.Error, ValueError) as e:
+            # битый конфиг не роняет бота — остаётся прежняя таблица
+            print(f"❌ Не удалось прочитать уровни из {self.config_path}: {e}")
+            self._mtime = mtime
+            return
+
+        self._mtime = mtime
+        self._thresholds = [threshold for threshold, _ in table]
+        self._levels = [level for _, level in table]
+        self._reached = [BASE_LEVEL]
+        for level in self._levels:
+            self._reached.append(max(self._reached[-1], level))
+        print(f"📶 Таблица уровней: {table}")
+
+    def items(self) -> list[tuple[int, int]]:
+        """[(порог, уровень)] по возрастанию порога."""
+        self._refresh()
+        return list(zip(self._thresholds, self._levels))
+
+    def level_for(self, points: int) -> int:
+        """Наибольший уровень, порог которого набран (BASE_LEVEL, если ни один)."""
+        self._refresh()
+        return self._reached[bisect.bisect_right(self._thresholds, points)]
+
+    def points_to_next(self, points: int) -> int | None:
+        """Сколько поинтов до ближайшего ненабранного порога; None — уровень максимальный."""
+        self._refresh()
+        i = bisect.bisect_right(self._thresholds, points)
+        if i == len(self._thresholds):
+            return None
+        return self._thresholds[i] - points
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._thresholds)
+
+
+levels = LevelTable()
 
 
 async def check_level(user_id) -> bool:
@@ -17,22 +116,11 @@ async def check_level(user_id) -> bool:
         print(f"ERROR {user}")
         return False
 
-    levels_cfg = get_levels_config()
-    if not levels_cfg:
-        print(f"ERROR lvl cfg{levels_cfg}")
+    if not levels:
+        print(f"ERROR lvl cfg {levels.config_path}")
         return False
 
-    sorted_thresholds = sorted(levels_cfg.keys())
-    new_level = user.level
-
-    for threshold in sorted_thresholds:
-        if user.points >= int(threshold):
-            candidate_level = levels_cfg[threshold]
-            if candidate_level > new_level:
-                new_level = candidate_level
-        else:
-            break
-
+    new_level = max(user.level, levels.level_for(user.points))
     if new_level != user.level:
         await UserCRUD.update(user_id=user_id, level=new_level)
 
@@ -49,10 +137,13 @@ def xyz(total_target, count_done_target, boost):
 
 
 async def calculate_points_and_level(user_id: int) -> None:
-    """Производит расчет поинтов и обновление уровня, если поинтов достаточно
+    """Производит расчет поинтов за день, открытый для отметок (CHECKOFF_WINDOW),
+    и обновление уровня, если поинтов достаточно
     Args: user_id"""
     try:
-        _, targets = await TargetCRUD.get_all_target_today(user_id, datetime.today())
+        user, targets = await TargetCRUD.get_all_target_today(
+            user_id, checkoff_window=CHECKOFF_WINDOW
+        )
     except Exception as e:
         print(f"ERROR {e}")
         return
@@ -60,16 +151,19 @@ async def calculate_points_and_level(user_id: int) -> None:
     action_points = 0
 
     if len(targets) == 0:
-        action_points = -10
+        action_points = NO_TARGETS_PENALTY
         print(action_points)
         await UserCRUD.points(user_id, action_points)
         return
     else:
-        session = await SessionCRUD.total_active_time_on_date(user_id, datetime.now())
-        if session > timedelta(hours=3):
-            action_points = 3
-
-    boost = 0.6314
+        utc_offset = user.utc_offset if user is not None else None
+        session = await SessionCRUD.total_active_time_on_date(
+            user_id, checkoff_day(utc_offset, CHECKOFF_WINDOW), utc_offset
+        )
+        if session > ACTIVITY_BONUS_AFTER:
+            action_points = ACTIVITY_BONUS
+
+    boost = BOOST
     count_done_target = 0
     total_target = len(targets)
     for target in targets:
@@ -82,3 +176,31 @@ async def calculate_points_and_level(user_id: int) -> None:
         print("SUCCESS check_level")
     else:
         print("ERROR check_level")
+
+
+async def calculate_points_and_levels_batch(day: date, utc_offset: int) -> tuple[int, int] | None:
+    """
+    Тот же расчёт, что calculate_points_and_level, но за местный день day и сразу
+    для всех пользователей пояса utc_offset: два UPDATE на стороне БД вместо ~6
+    запросов на пользователя. Возвращает (оценено пользователей, повышено уровней)
+    или None, если этот день пояса уже оценён.
+    """
+    started = time.perf_counter()
+    result = await UserCRUD.score_day(
+        day,
+        utc_offset,
+        levels=levels.items(),
+        done_points=3 * BOOST,
+        bonus=ACTIVITY_BONUS,
+        bonus_after=ACTIVITY_BONUS_AFTER,
+        penalty=NO_TARGETS_PENALTY,
+    )
+    if result is None:
+        print(f"🏅 Поинты за {day} ({format_utc_offset(utc_offset)}) уже начислены")
+        return None
+    scored, leveled = result
+    print(
+        f"🏅 Поинты за {day} ({format_utc_offset(utc_offset)}): оценено {scored}, "
+        f"новый уровень у {leveled} за {time.perf_counter() - started:.2f}с"
+    )
+    return scored, leveled
@@ -1,38 +1,44 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Sequence
 
-from utils.dates import UTC_PLUS_3
+from utils.dates import UTC_PLUS_3, format_duration
+from utils.broadcast import Broadcaster
+from core.database.models import User
 from core.database.requests import SessionCRUD
 
 
-async def stop_all_sessions(bot):
-    """Функция смотрит все активные сессии в бд и закрывает их."""
-    sessions = await SessionCRUD.get_all_active_session()
+async def stop_all_sessions(
+    bot, users_where: Sequence = (), broadcaster: Broadcaster | None = None
+) -> int:
+    """
+    Закрывает все активные сессии (или сессии пользователей из users_where)
+    одним bulk-запросом и уведомляет только тех, у кого сессия была.
+    Уведомления уходят параллельно через Broadcaster. Возвращает число пользователей.
+    """
     now = datetime.now(UTC_PLUS_3).replace(tzinfo=None)
-    print("Смотрю активные сессии....")
-    for session in sessions:
-        print("Нашел сессию!")
-        await SessionCRUD.update(session_id=session.id, date_end=now, is_active=False)
-        await bot.send_message(
-            chat_id=session.user_id,
-            text="Твоя сессия автоматически завершена и учтена!",
+    closed = await SessionCRUD.close_active(now, users_where)
+    if not closed:
+        return 0
+
+    added: dict[int, timedelta] = {}
+    for row in closed:
+        added[row.user_id] = added.get(row.user_id, timedelta()) + (now - row.date_start)
+    print(f"Закрыто активных сессий: {len(closed)} у {len(added)} пользователей")
+
+    broadcaster = broadcaster or Broadcaster()
+    limited_bot = broadcaster.wrap(bot)
+
+    async def notify(item):
+        user_id, elapsed = item
+        await limited_bot.send_message(
+            user_id=user_id,
+            text=f"Твоя сессия автоматически завершена и учтена! \nДобавлено: `{format_duration(elapsed)}`",
         )
 
+    stats = await broadcaster.run(added.items(), notify)
+    print(f"✅ Уведомления о закрытых сессиях: {stats}")
+    return len(added)
+
 
 async def stop_one_sessions(bot, user_id):
-    session = await SessionCRUD.get_active_session(user_id)
-    now = datetime.now(UTC_PLUS_3).replace(tzinfo=None)
-    print("Смотрю активные сессии....")
-    if not session:
-        print(f"На ретерн попал, user_id = {user_id}")
-        return
-    else:
-        elapsed = now - session.date_start
-        total_seconds = int(elapsed.total_seconds())
-        h = total_seconds // 3600
-        m = (total_seconds % 3600) // 60
-        s = total_seconds % 60
-        await SessionCRUD.update(session_id=session.id, date_end=now, is_active=False)
-        await bot.send_message(
-            user_id=session.user_id,
-            text=f"Твоя сессия автоматически завершена и учтена! \nДобавлено: `{h:02d}:{m:02d}:{s:02d}`",
-        )
+    await stop_all_sessions(bot, (User.tid == user_id,))
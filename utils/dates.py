@@ -1,7 +1,98 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone, timedelta, date, time
 
 UTC_PLUS_3 = timezone(timedelta(hours=3))
-EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# время в БД хранится без пояса, в часовом поясе сервера (UTC+3)
+SERVER_UTC_OFFSET = 180
+# часовой пояс пользователя по умолчанию — смещение от UTC в минутах (users.utc_offset)
+DEFAULT_UTC_OFFSET = 180
+MIN_UTC_OFFSET = -12 * 60
+MAX_UTC_OFFSET = 14 * 60
+
+
+def tz_from_offset(offset_minutes: int | None) -> timezone:
+    if offset_minutes is None:
+        offset_minutes = DEFAULT_UTC_OFFSET
+    return timezone(timedelta(minutes=offset_minutes))
+
+
+def server_now() -> datetime:
+    """Текущее время сервера без пояса — в таком виде время хранится в БД."""
+    return datetime.now(UTC_PLUS_3).replace(tzinfo=None)
+
+
+def local_today(offset_minutes: int | None, now: datetime | None = None) -> date:
+    """Сегодняшняя дата в поясе пользователя; now — aware-время (по умолчанию текущее)."""
+    now = now or datetime.now(timezone.utc)
+    return now.astimezone(tz_from_offset(offset_minutes)).date()
+
+
+def checkoff_day(
+    offset_minutes: int | None, window_minutes: int, now: datetime | None = None
+) -> date:
+    """
+    Местный день, итоги которого пользователь ещё отмечает: в первые
+    window_minutes после полуночи — вчерашний, дальше — сегодняшний.
+    """
+    now = now or datetime.now(timezone.utc)
+    return local_today(offset_minutes, now - timedelta(minutes=window_minutes))
+
+
+def day_bounds(day: date, offset_minutes: int | None) -> tuple[datetime, datetime]:
+    """
+    Границы местного дня пользователя [начало, начало следующего) в серверном
+    времени БД (naive UTC+3) — для отбора целей и сессий по Target.date_add и т.п.
+    """
+    if offset_minutes is None:
+        offset_minutes = DEFAULT_UTC_OFFSET
+    start = datetime.combine(day, time.min) + timedelta(
+        minutes=SERVER_UTC_OFFSET - offset_minutes
+    )
+    return start, start + timedelta(days=1)
+
+
+def parse_utc_offset(value: str) -> int | None:
+    """
+    '+5', '-3', '+5:30', 'UTC+3', 'GMT-4:30' -> смещение в минутах.
+    None — если строка не похожа на смещение или оно вне [-12:00, +14:00]
+    либо не кратно 15 минутам.
+    """
+    value = value.strip().upper().removeprefix("UTC").removeprefix("GMT").strip()
+    if not value:
+        return 0
+    sign = -1 if value[0] == "-" else 1
+    hours, _, minutes = value.lstrip("+-").partition(":")
+    try:
+        offset = sign * (int(hours) * 60 + int(minutes or 0))
+    except ValueError:
+        return None
+    if minutes and not 0 <= int(minutes) < 60:
+        return None
+    if not MIN_UTC_OFFSET <= offset <= MAX_UTC_OFFSET or offset % 15:
+        return None
+    return offset
+
+
+def format_utc_offset(offset_minutes: int) -> str:
+    sign = "-" if offset_minutes < 0 else "+"
+    hours, minutes = divmod(abs(offset_minutes), 60)
+    return f"UTC{sign}{hours}" + (f":{minutes:02d}" if minutes else "")
+
+
+def offsets_at_midnight(now_utc: datetime, step_minutes: int) -> list[int]:
+    """
+    Смещения (в минутах), у которых местная полночь попадает в
+    [now_utc, now_utc + step_minutes). Их может быть два: например,
+    UTC-12 и UTC+12 встречают полночь одновременно.
+    """
+    minute_of_day = now_utc.hour * 60 + now_utc.minute
+    offsets = []
+    for shift in range(step_minutes):
+        # местное время = UTC + offset ≡ 0 (mod сутки)
+        base = -(minute_of_day + shift) % (24 * 60)
+        for offset in (base, base - 24 * 60):
+            if MIN_UTC_OFFSET <= offset <= MAX_UTC_OFFSET and offset % 15 == 0:
+                offsets.append(offset)
+    return sorted(set(offsets))
 
 
 def format_duration(td):
@@ -13,19 +104,12 @@ def format_duration(td):
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
-def format_total_duration(count_time_dt: datetime | None) -> str:
+def format_total_duration(total_seconds: int | None) -> str:
     """
-    Преобразует DateTime вида EPOCH+seconds в строку HH:MM:SS.
+    Форматирует накопленные секунды (users.total_seconds) в строку HH:MM:SS.
     Если None — возвращает 00:00:00.
     """
-    if not count_time_dt:
-        return "00:00:00"
-
-    # если хранится без tzinfo (SQLite), считаем это UTC-naive
-    if count_time_dt.tzinfo is None:
-        count_time_dt = count_time_dt.replace(tzinfo=timezone.utc)
-
-    total_seconds = int((count_time_dt - EPOCH).total_seconds())
+    total_seconds = int(total_seconds or 0)
     hours = total_seconds // 3600
     minutes = (total_seconds % 3600) // 60
     seconds = total_seconds % 60
@@ -47,3 +131,28 @@ def hhmmss_to_timedelta(value: str) -> timedelta | None:
     if seconds == None:
         return
     return timedelta(seconds)
+
+
+def split_by_day(
+    start: datetime, end: datetime, offset_minutes: int | None = None
+) -> dict[date, float]:
+    """
+    Разбивает интервал [start, end) серверного времени по местным дням
+    пользователя (offset_minutes — users.utc_offset): {день: секунды}.
+    Отрицательный интервал (ручное вычитание времени) целиком относится к дню start.
+    """
+    if offset_minutes is None:
+        offset_minutes = DEFAULT_UTC_OFFSET
+    shift = timedelta(minutes=offset_minutes - SERVER_UTC_OFFSET)
+    start = start.replace(tzinfo=None) + shift
+    end = end.replace(tzinfo=None) + shift
+    if end <= start:
+        return {start.date(): (end - start).total_seconds()}
+
+    parts = {}
+    cur = start
+    while cur < end:
+        nxt = min(datetime.combine(cur.date() + timedelta(days=1), time.min), end)
+        parts[cur.date()] = (nxt - cur).total_seconds()
+        cur = nxt
+    return parts
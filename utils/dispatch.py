@@ -0,0 +1,181 @@
+"""
+Порядок обработки обновлений поверх изоляции событий maxapi: события одного
+пользователя выполняются строго по очереди (SimpleEventIsolation, при
+FSM_STORAGE=redis — RedisEventIsolation на все реплики), разные пользователи —
+параллельно, но не больше DISPATCH_CONCURRENCY хендлеров одновременно.
+Повторный callback с тем же payload, пришедший в течение DISPATCH_DEDUP_WINDOW
+секунд, пока предыдущий ещё ждёт или выполняется, отбрасывается (двойное
+нажатие кнопки).
+
+Каждое событие — своя задача (spawn_handle_task): задача, ждущая очереди
+своего пользователя, не занимает ни слот параллельности, ни воркера, поэтому
+пользователь с длинной очередью не задерживает остальных. Всего принятых и
+ещё не обработанных событий — не больше DISPATCH_MAX_PENDING: polling не берёт
+следующую пачку, а вебхук не достаёт событие из очереди, пока не появится место.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import time
+from typing import Any, Hashable
+
+from maxapi import Dispatcher
+from maxapi.context import BaseEventIsolation, RedisEventIsolation, SimpleEventIsolation
+
+from core.database.requests import checkpoint
+from utils.storage import FSM_STORAGE
+
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "32"))
+DISPATCH_DEDUP_WINDOW = float(os.getenv("DISPATCH_DEDUP_WINDOW", "1.0"))
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+def _dedup_key(event: Any) -> tuple[Hashable, str] | None:
+    """(пользователь, payload нажатой кнопки); для остальных событий дедупликации нет."""
+    payload = getattr(getattr(event, "callback", None), "payload", None)
+    if payload is None:
+        return None
+    return event.get_ids(), payload
+
+
+class LimitedIsolation(BaseEventIsolation):
+    """
+    Изоляция maxapi с общим лимитом параллельности: семафор берётся уже под
+    блокировкой пользователя, поэтому ждущие своей очереди события одного
+    пользователя не занимают слоты остальных.
+    """
+
+    def __init__(self, inner: BaseEventIsolation, concurrency: int = DISPATCH_CONCURRENCY):
+        self.inner = inner
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key):
+        async with self.inner.lock(key):
+            async with self._semaphore:
+                yield
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+def create_event_isolation(concurrency: int = DISPATCH_CONCURRENCY) -> LimitedIsolation:
+    if FSM_STORAGE == "redis":
+        from utils.redis import get_redis_async
+
+        inner: BaseEventIsolation = RedisEventIsolation(get_redis_async(), key_prefix="fsm")
+    else:
+        inner = SimpleEventIsolation()
+    return LimitedIsolation(inner, concurrency)
+
+
+def _scoped(scope, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with scope():
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def scope_handlers(scope, *routers) -> None:
+    """
+    Оборачивает каждый хендлер роутеров в scope (например, unit_of_work — одна
+    транзакция БД на обновление). Обёртка стоит на самом хендлере, а не вокруг
+    dp.handle: maxapi ловит исключения хендлеров внутри handle, и только так
+    исключение выходит из scope и откатывает транзакцию.
+    """
+    for router in routers:
+        for handler in router.event_handlers:
+            handler.func_event = _scoped(scope, handler.func_event)
+
+
+def commit_before_api() -> None:
+    """
+    Каждый запрос к Max API (BaseConnection.request — через него ходят все
+    методы maxapi) сначала фиксирует текущую единицу работы: соединение с БД
+    не держится, пока хендлер ждёт ответа API.
+    """
+    from maxapi.connection.base import BaseConnection
+
+    request = BaseConnection.request
+    if getattr(request, "_commits_unit", False):
+        return
+
+    @functools.wraps(request)
+    async def committed_request(self, *args, **kwargs):
+        await checkpoint()
+        return await request(self, *args, **kwargs)
+
+    committed_request._commits_unit = True  # type: ignore
+    BaseConnection.request = committed_request  # type: ignore
+
+
+class OrderedDispatcher(Dispatcher):
+    """
+    Dispatcher с изоляцией событий по пользователю, отбросом двойных нажатий
+    и ограничением числа событий в работе (max_pending).
+    """
+
+    def __init__(
+        self,
+        *args,
+        dedup_window: float = DISPATCH_DEDUP_WINDOW,
+        max_pending: int = DISPATCH_MAX_PENDING,
+        **kwargs,
+    ):
+        kwargs.setdefault("event_isolation", create_event_isolation())
+        super().__init__(*args, **kwargs)
+        self.dedup_window = dedup_window
+        # (пользователь, payload) -> время получения ждущего или выполняющегося события
+        self._in_flight: dict[tuple[Hashable, str], float] = {}
+        self.dropped = 0
+        self.max_pending = max_pending
+        self.pending = 0
+        self._room = asyncio.Event()
+        self._room.set()
+
+    def spawn_handle_task(self, event_object) -> asyncio.Task:
+        task = super().spawn_handle_task(event_object)
+        self.pending += 1
+        if self.pending >= self.max_pending:
+            self._room.clear()
+        task.add_done_callback(self._handle_task_done)
+        return task
+
+    def _handle_task_done(self, task: asyncio.Task) -> None:
+        self.pending -= 1
+        if self.pending < self.max_pending:
+            self._room.set()
+
+    async def wait_for_room(self) -> None:
+        """Ждёт, пока событий в работе станет меньше max_pending."""
+        while self.pending >= self.max_pending:
+            await self._room.wait()
+
+    async def _dispatch_fetched_events(self, *args, **kwargs) -> None:
+        # polling: пачка (до 100 событий) запускается целиком через
+        # spawn_handle_task, поэтому место проверяем перед ней
+        await self.wait_for_room()
+        await super()._dispatch_fetched_events(*args, **kwargs)
+
+    async def handle(self, event_object) -> None:
+        key = _dedup_key(event_object)
+        now = time.monotonic()
+        if key is not None:
+            received_at = self._in_flight.get(key)
+            if received_at is not None and now - received_at <= self.dedup_window:
+                self.dropped += 1
+                logger.info("Дубликат %r от %s отброшен", key[1], key[0])
+                return
+            self._in_flight[key] = now
+        try:
+            await super().handle(event_object)
+        finally:
+            if key is not None and self._in_flight.get(key) == now:
+                del self._in_flight[key]
@@ -1,15 +1,54 @@
 import functools
+import os
 from typing import Callable, Awaitable, Any
-from datetime import datetime
 
 from maxapi.types import MessageCreated
 
 from core.database.requests import TargetCRUD
 from utils.message_utils import update_menu
 from utils.states import UserStates
+from utils.targets_cache import targets_today
+from utils.cache import BoundedCache, seconds_until_local_midnight
+from utils.storage import FSM_STORAGE
 from core.user_handlers.kb import stop_kb
 
-CACHE_ = dict()
+
+class NewDayUsers:
+    """
+    Пользователи, уже отправленные в new_day сегодня: дальше пропускаем без
+    проверок, пока они пишут цели. Флаг живёт до полуночи пользователя.
+    При FSM_STORAGE=redis он хранится в Redis: следующее событие может прийти
+    на другую реплику, и без общего флага она снова сбросила бы пользователя
+    в new_day.
+    """
+
+    def __init__(self, max_size: int, redis=None, prefix: str = "new_day"):
+        self.cache = BoundedCache("new_day_users", max_size, day_scoped=True)
+        self.redis = redis
+        self.prefix = prefix
+
+    async def contains(self, user_id: int) -> bool:
+        if self.redis is None:
+            return self.cache.get(user_id, False)
+        return bool(await self.redis.exists(f"{self.prefix}:{user_id}"))
+
+    async def add(self, user_id: int, ttl: float) -> None:
+        if self.redis is None:
+            self.cache.set(user_id, True, ttl=ttl)
+        else:
+            await self.redis.set(f"{self.prefix}:{user_id}", 1, ex=max(1, int(ttl)))
+
+
+def _new_day_users() -> NewDayUsers:
+    redis = None
+    if FSM_STORAGE == "redis":
+        from utils.redis import get_redis_async
+
+        redis = get_redis_async()
+    return NewDayUsers(int(os.getenv("GUARD_CACHE_SIZE", "50000")), redis)
+
+
+new_day_users = _new_day_users()
 
 
 def look_if_not_target(
@@ -42,29 +81,29 @@ def look_if_not_target(
                 )  # type: ignore
                 return None
 
-            if CACHE_.get(user_id, False):
-                print(f"NOT IN CACHE state = {user_state}")
+            # «сегодня» — по поясу пользователя (users.utc_offset);
+            # в кэше только те, у кого цели есть
+            if targets_today.get(user_id) is not None or await new_day_users.contains(
+                user_id
+            ):
                 result = await func(*args, **kwargs)
                 return result
 
-            user, targets = await TargetCRUD.get_all_target_today(
-                user_id, datetime.today()
-            )
-
-            print(f"User - {user}")
-            if user is None:
+            cached = await TargetCRUD.has_targets_today(user_id)
+            if cached is None:
+                # пользователя ещё нет в БД — его создаст сам хендлер
                 result = await func(*args, **kwargs)
                 return result
+            targets_today.set(user_id, *cached)
+            has_targets, utc_offset = cached
 
-            print(f"Targets - {targets}")
-            if targets:
-                print(f"Do it func")
+            if has_targets:
                 result = await func(*args, **kwargs)
                 return result
             else:
                 print(f"Get state UserStates.new_day")
                 await context.set_state(UserStates.new_day)
-                CACHE_[user_id] = True
+                await new_day_users.add(user_id, seconds_until_local_midnight(utc_offset))
 
         except Exception as e:
             raise e  # Пробрасываем исключение дальше
@@ -0,0 +1,222 @@
+"""
+Метрики хендлеров: время, SQL-запросы, строки, соединения с БД и вызовы Max API
+на каждый хендлер роутеров.
+
+    METRICS_ENABLED=1         — включить (по умолчанию выключено: ни слушателей
+                                SQLAlchemy, ни обёрток хендлеров не ставится)
+    METRICS_LOG_INTERVAL=60   — раз в N секунд печатать строку с приростом за период
+                                (0 — не печатать)
+
+В режиме вебхука метрики в формате Prometheus отдаются на GET /metrics.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import time
+from typing import Any, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") not in ("", "0", "false", "False")
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+
+# границы гистограммы времени хендлера, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+FIELDS = ("calls", "errors", "seconds", "statements", "rows", "sessions", "api_calls")
+
+
+class HandlerMetrics:
+    __slots__ = FIELDS + ("max_seconds", "buckets")
+
+    def __init__(self):
+        for field in FIELDS:
+            setattr(self, field, 0)
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds: float) -> None:
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def snapshot(self) -> dict[str, float]:
+        return {field: getattr(self, field) for field in FIELDS}
+
+
+class _Current:
+    """Счётчики выполняющегося хендлера (живут в contextvar)."""
+
+    __slots__ = ("statements", "rows", "sessions", "api_calls")
+
+    def __init__(self):
+        self.statements = self.rows = self.sessions = self.api_calls = 0
+
+
+_current: contextvars.ContextVar[_Current | None] = contextvars.ContextVar(
+    "handler_metrics", default=None
+)
+registry: dict[str, HandlerMetrics] = {}
+
+
+# ---------- Источники счётчиков ----------
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    current = _current.get()
+    if current is not None:
+        current.statements += 1
+
+
+def _on_after_execute(conn, cursor, statement, parameters, context, executemany):
+    # rowcount известен для INSERT/UPDATE/DELETE; для SELECT считаем ORM-объекты ниже
+    current = _current.get()
+    if current is not None and cursor.rowcount and cursor.rowcount > 0:
+        current.rows += cursor.rowcount
+
+
+def _on_load(target, context):
+    current = _current.get()
+    if current is not None:
+        current.rows += 1
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    current = _current.get()
+    if current is not None:
+        current.sessions += 1
+
+
+def instrument_engine(engine) -> None:
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _on_execute)
+    event.listen(sync_engine, "after_cursor_execute", _on_after_execute)
+    event.listen(sync_engine.pool, "checkout", _on_checkout)
+    event.listen(Mapper, "load", _on_load)
+
+
+def instrument_api() -> None:
+    """
+    Все методы maxapi ходят в Max API через BaseConnection.request
+    (super().request из классов методов), поэтому оборачиваем его на классе.
+    """
+    from maxapi.connection.base import BaseConnection
+
+    request = BaseConnection.request
+    # маркер, а не __wrapped__: запрос может быть уже обёрнут не метриками
+    if getattr(request, "_counts_api_calls", False):
+        return
+
+    @functools.wraps(request)
+    async def counted_request(self, *args, **kwargs):
+        current = _current.get()
+        if current is not None:
+            current.api_calls += 1
+        return await request(self, *args, **kwargs)
+
+    counted_request._counts_api_calls = True  # type: ignore
+    BaseConnection.request = counted_request  # type: ignore
+
+
+def _wrap_handler(name: str, func):
+    metrics = registry.setdefault(name, HandlerMetrics())
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        current = _Current()
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            metrics.errors += 1
+            raise
+        finally:
+            _current.reset(token)
+            metrics.calls += 1
+            metrics.observe(time.perf_counter() - started)
+            metrics.statements += current.statements
+            metrics.rows += current.rows
+            metrics.sessions += current.sessions
+            metrics.api_calls += current.api_calls
+
+    return wrapper
+
+
+def instrument_routers(*routers) -> None:
+    for router in routers:
+        for handler in router.event_handlers:
+            func = handler.func_event
+            handler.func_event = _wrap_handler(func.__name__, func)
+
+
+# ---------- Вывод ----------
+def render_prometheus() -> str:
+    lines = []
+
+    def counter(metric: str, help_text: str, field: str) -> None:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, metrics in registry.items():
+            lines.append(f'{metric}{{handler="{name}"}} {getattr(metrics, field)}')
+
+    counter("bot_handler_calls_total", "Вызовы хендлера", "calls")
+    counter("bot_handler_errors_total", "Исключения в хендлере", "errors")
+    counter("bot_handler_sql_statements_total", "SQL-запросы из хендлера", "statements")
+    counter("bot_handler_rows_total", "Строки: ORM-объекты и затронутые DML", "rows")
+    counter("bot_handler_db_sessions_total", "Соединения, взятые из пула", "sessions")
+    counter("bot_handler_api_calls_total", "Запросы к Max API", "api_calls")
+
+    lines.append("# HELP bot_handler_duration_seconds Время выполнения хендлера")
+    lines.append("# TYPE bot_handler_duration_seconds histogram")
+    for name, metrics in registry.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS, metrics.buckets):
+            cumulative += count
+            lines.append(
+                f'bot_handler_duration_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(
+            f'bot_handler_duration_seconds_bucket{{handler="{name}",le="+Inf"}} {metrics.calls}'
+        )
+        lines.append(f'bot_handler_duration_seconds_sum{{handler="{name}"}} {metrics.seconds}')
+        lines.append(f'bot_handler_duration_seconds_count{{handler="{name}"}} {metrics.calls}')
+    return "\n".join(lines) + "\n"
+
+
+async def log_metrics(interval: float = METRICS_LOG_INTERVAL) -> None:
+    """Раз в interval секунд — одна JSON-строка с приростом по каждому хендлеру."""
+    previous: dict[str, dict[str, float]] = {}
+    while True:
+        await asyncio.sleep(interval)
+        period = {}
+        for name, metrics in registry.items():
+            now = metrics.snapshot()
+            before = previous.get(name, {})
+            delta = {field: now[field] - before.get(field, 0) for field in FIELDS}
+            previous[name] = now
+            if delta["calls"]:
+                delta["avg_ms"] = round(delta.pop("seconds") / delta["calls"] * 1000, 2)
+                period[name] = delta
+        if period:
+            print(f"📊 metrics {json.dumps(period, ensure_ascii=False)}")
+
+
+def setup_metrics(engine, routers: Iterable[Any]) -> asyncio.Task | None:
+    """
+    Ставит слушатели и обёртки, если METRICS_ENABLED; вызывать до запуска
+    диспетчера и внутри работающего event loop (для периодического лога).
+    """
+    if not METRICS_ENABLED:
+        return None
+    instrument_engine(engine)
+    instrument_api()
+    instrument_routers(*routers)
+    if METRICS_LOG_INTERVAL > 0:
+        return asyncio.create_task(log_metrics())
+    return None
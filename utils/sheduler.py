@@ -1,72 +1,223 @@
+import asyncio
+import os
+import time
+import uuid
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import date, datetime, timedelta, timezone
 
-from core.database.requests import UserCRUD
-from utils.dates import UTC_PLUS_3
-from utils.close_activity import stop_one_sessions
+from core.database.models import User
+from core.database.requests import ScoredDayCRUD, UserCRUD
+from utils.dates import checkoff_day, format_utc_offset, offsets_at_midnight
+from utils.storage import FSM_STORAGE
+from utils.close_activity import stop_all_sessions
+from utils.broadcast import Broadcaster
 from core.user_handlers.kb import checking_done_target_kb
+from utils.cache import purge_expired_day_caches
+from utils.cfg_points import CHECKOFF_WINDOW, SCORING_MODE, calculate_points_and_levels_batch
 
-from utils.guards import CACHE_
+# шаг проверки в минутах: раз в шаг берутся пояса, у которых сейчас наступила полночь
+ROLLOVER_TICK_MINUTES = int(os.getenv("ROLLOVER_TICK_MINUTES", "15"))
+# cron "*/N" сбрасывается в начале часа: другой шаг пропустил бы часть поясов
+if ROLLOVER_TICK_MINUTES <= 0 or 60 % ROLLOVER_TICK_MINUTES:
+    raise ValueError(
+        f"ROLLOVER_TICK_MINUTES должен делить 60 без остатка, получено {ROLLOVER_TICK_MINUTES}"
+    )
+# за сколько секунд после полуночи равномерно обойти всех пользователей пояса
+ROLLOVER_WINDOW = float(os.getenv("ROLLOVER_WINDOW", "600"))
+# лидерство реплики в Redis: срок ключа и как часто его продлевать, секунд
+SCHEDULER_LEADER_TTL = int(os.getenv("SCHEDULER_LEADER_TTL", "60"))
+SCHEDULER_LEADER_RENEW = SCHEDULER_LEADER_TTL / 3
 
+# задачи поясов: держим ссылки, пока они выполняются
+_running: set[asyncio.Task] = set()
 
-def setup_midnight_messages(bot):
+
+async def _paced(items, total: int, window: float):
+    """Отдаёт элементы равномерно за window секунд (total — сколько их ожидается)."""
+    step = window / total if total and window > 0 else 0.0
+    started = time.monotonic()
+    index = 0
+    async for item in items:
+        delay = started + index * step - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield item
+        index += 1
+
+
+async def send_midnight_messages(bot, offsets: list[int]) -> None:
     """
-    Настраивает асинхронную отправку сообщений всем пользователям в 12 ночи
+    Полночь поясов offsets: закрывает активные сессии их пользователей и
+    рассылает приглашение отметить итоги дня.
     """
+    zones = ", ".join(format_utc_offset(offset) for offset in offsets)
+    try:
+        where = (User.utc_offset.in_(offsets),)
+        total = await UserCRUD.count(*where)
+        if not total:
+            return
+        print(
+            f"🚀 Запуск ночной рассылки для {zones}: {total} пользователей "
+            f"за {ROLLOVER_WINDOW:.0f}с"
+        )
+
+        broadcaster = Broadcaster()
+        limited_bot = broadcaster.wrap(bot)
 
-    async def send_midnight_messages():
-        """Асинхронная функция для отправки сообщений всем пользователям"""
         try:
-            print(f"🚀 Запуск ночной рассылки в {datetime.now(UTC_PLUS_3)}")
-
-            # Асинхронно получаем список пользователей
-            users = list(await UserCRUD.list())
-            next_users = 101
-            while len(users) > 0:
-                sent_count = 0
-                for user in users:
-                    try:
-                        CACHE_.pop(user.tid)
-                        try:
-                            await stop_one_sessions(bot, user.tid)
-                        except Exception as e:
-                            print(f"stop_one_sessions ERROR {e}")
-                        try:
-                            await bot.send_message(
-                                user_id=user.tid,
-                                text="Вот и закончился день, начался новый, пора отмечать что сделал, а что нет!",
-                                attachments=[checking_done_target_kb],
-                            )
-                        except Exception as e:
-                            print(f"checking_done_target_kb ERROR {e}")
-                        sent_count += 1
-                    except Exception as e:
-                        print(f"❌ Ошибка отправки пользователю {user.tid}: {e}")
-                if len(users) == 100:
-                    users = list(await UserCRUD.list(offset=next_users))
-                    next_users += 100
-                    print(
-                        f"✅ Рассылка завершена. Успешно отправлено: {sent_count}/{len(users)}"
-                    )
-                else:
-                    print(
-                        f"✅ Рассылка завершена. Успешно отправлено: {sent_count}/{len(users)}"
-                    )
-                    break
+            await stop_all_sessions(bot, where, broadcaster)
+        except Exception as e:
+            print(f"stop_all_sessions ERROR {e}")
+
+        async def night_job(user):
+            await limited_bot.send_message(
+                user_id=user.tid,
+                text="Вот и закончился день, начался новый, пора отмечать что сделал, а что нет!",
+                attachments=[checking_done_target_kb],
+            )
+
+        users = UserCRUD.iter_all(batch_size=500, columns=(User.tid,), where=where)
+        stats = await broadcaster.run(_paced(users, total, ROLLOVER_WINDOW), night_job)
+        print(f"✅ Рассылка для {zones} завершена: {stats}")
+
+    except Exception as e:
+        print(f"❌ Критическая ошибка в рассылке для {zones}: {e}")
+
+
+async def score_closed_days(now_utc: datetime) -> list[tuple[int, date]]:
+    """
+    SCORING_MODE=batch: оценивает по каждому поясу все местные дни, окно
+    отметок (CHECKOFF_WINDOW) которых уже закрылось и которых ещё нет в
+    scored_days, — включая пропущенные из-за рестарта или потерянного тика.
+    Пояс без единой отметки начинает с последнего закрытого дня. Границы дня —
+    те же day_bounds, по которым пишутся цели и daily_activity; повторная
+    оценка дня невозможна (см. UserCRUD.score_day). Возвращает [(пояс, день)].
+    """
+    last_scored = await ScoredDayCRUD.last_days()
+    scored = []
+    for offset in await UserCRUD.offsets():
+        # день, ещё открытый для отметок, и все после него не трогаем
+        closed = checkoff_day(offset, CHECKOFF_WINDOW, now_utc) - timedelta(days=1)
+        day = last_scored[offset] + timedelta(days=1) if offset in last_scored else closed
+        while day <= closed:
+            try:
+                if await calculate_points_and_levels_batch(day, offset) is not None:
+                    scored.append((offset, day))
+            except Exception as e:
+                print(f"calculate_points_and_levels_batch ERROR {e}")
+                break
+            day += timedelta(days=1)
+    return scored
+
+
+class SchedulerLeader:
+    """
+    Ночные задания выполняет одна реплика: при FSM_STORAGE=redis лидер держит
+    ключ SET NX с TTL и продлевает его; упавшего лидера через TTL сменяет
+    другая реплика. Без Redis реплика одна — она и лидер.
+    """
+
+    def __init__(self, redis=None, key: str = "scheduler:leader", ttl: int = SCHEDULER_LEADER_TTL):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.instance = uuid.uuid4().hex
+        self.is_leader = redis is None
 
+    async def renew(self) -> bool:
+        if self.redis is None:
+            return True
+        try:
+            if await self.redis.set(self.key, self.instance, nx=True, ex=self.ttl):
+                acquired = True
+            else:
+                owner = await self.redis.get(self.key)
+                acquired = owner is not None and owner.decode() == self.instance
+                if acquired:
+                    await self.redis.expire(self.key, self.ttl)
         except Exception as e:
-            print(f"❌ Критическая ошибка в рассылке: {e}")
+            print(f"❌ Не удалось продлить лидерство планировщика: {e}")
+            acquired = False
+        if acquired != self.is_leader:
+            print(
+                "👑 Реплика стала лидером планировщика"
+                if acquired
+                else "⚠️ Реплика больше не лидер планировщика"
+            )
+        self.is_leader = acquired
+        return acquired
+
+
+def create_leader() -> SchedulerLeader:
+    if FSM_STORAGE == "redis":
+        from utils.redis import get_redis_async
+
+        return SchedulerLeader(get_redis_async())
+    return SchedulerLeader()
+
+
+def _spawn(coro) -> None:
+    # пояс обходится в своей задаче: долгая рассылка не задерживает следующий шаг
+    task = asyncio.create_task(coro)
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+
+
+async def rollover_tick(bot, leader: SchedulerLeader, now_utc: datetime | None = None) -> None:
+    if not await leader.renew():
+        return
+    now_utc = now_utc or datetime.now(timezone.utc)
+    offsets = offsets_at_midnight(now_utc, ROLLOVER_TICK_MINUTES)
+    if offsets:
+        _spawn(send_midnight_messages(bot, offsets))
+    if SCORING_MODE == "batch":
+        _spawn(score_closed_days(now_utc))
+
+
+async def purge_caches() -> None:
+    # кэши процессные — чистит каждая реплика, не только лидер
+    # корутина выполняется в цикле событий бота, а не в пуле потоков планировщика
+    purge_expired_day_caches()
 
+
+def setup_midnight_messages(bot):
+    """
+    Настраивает асинхронную отправку сообщений пользователям в 12 ночи
+    по их часовому поясу (users.utc_offset)
+    """
+    leader = create_leader()
     scheduler = AsyncIOScheduler()
 
     scheduler.add_job(
-        send_midnight_messages,
-        trigger=CronTrigger(hour=16, minute=53),
+        leader.renew,
+        trigger=IntervalTrigger(seconds=SCHEDULER_LEADER_RENEW),
+        id="scheduler_leader",
+        next_run_time=datetime.now(timezone.utc),
+    )
+    # опоздавший тик (занятый цикл событий) всё равно выполняется; пропущенную
+    # оценку дня наверстает следующий тик — она идёт по scored_days
+    scheduler.add_job(
+        rollover_tick,
+        trigger=CronTrigger(minute=f"*/{ROLLOVER_TICK_MINUTES}", timezone=timezone.utc),
+        args=(bot, leader),
         id="midnight_messages",
+        misfire_grace_time=ROLLOVER_TICK_MINUTES * 60,
+        coalesce=True,
+    )
+    # записи процессных кэшей живут до полуночи своего пользователя —
+    # раз в час вычищаем просроченные, чтобы они не занимали место до вытеснения
+    scheduler.add_job(
+        purge_caches,
+        trigger=CronTrigger(minute=0, timezone=timezone.utc),
+        id="purge_day_caches",
     )
 
     scheduler.start()
 
-    print("⏰ Асинхронная рассылка в 00:00 настроена!")
+    print(
+        f"⏰ Ночная рассылка настроена: полночь по поясу пользователя, "
+        f"проверка каждые {ROLLOVER_TICK_MINUTES} мин"
+    )
     return scheduler
@@ -0,0 +1,231 @@
+"""
+Хранилище FSM-контекста (состояние + данные) с подменяемым бэкендом.
+
+    FSM_STORAGE=memory  — в памяти процесса (по умолчанию)
+    FSM_STORAGE=redis   — в Redis (REDIS_URL), можно запускать несколько реплик
+
+StorageContext — контекст maxapi (BaseContext) поверх бэкенда:
+    Dispatcher(storage=StorageContext, backend=create_storage())
+Свой контекст вместо maxapi RedisContext: данные хранятся компактным JSON
+с кодеками для datetime/date/set (их кладут хендлеры), а состояние и данные
+читаются одним запросом к бэкенду.
+"""
+
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Callable
+
+from maxapi.context import BaseContext, State
+
+from utils.cache import BoundedCache
+from utils.states import FirstStates, UserStates
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_TTL = int(os.getenv("FSM_TTL", "57600"))
+FSM_MEMORY_SIZE = int(os.getenv("FSM_MEMORY_SIZE", "100000"))
+
+# бэкенд хранит строку состояния — хендлерам отдаём тот же объект State,
+# что объявлен в группе состояний
+STATES: dict[str, State] = {
+    str(state): state
+    for group in (FirstStates, UserStates)
+    for state in vars(group).values()
+    if isinstance(state, State)
+}
+
+
+def state_from_str(value: str | None) -> State | str | None:
+    if value is None:
+        return None
+    return STATES.get(value, value)
+
+
+# ---------- Сериализация данных контекста ----------
+# Небазовые типы кодируются как {"__t": тег, "v": значение}
+_ENCODERS: dict[type, tuple[str, Callable[[Any], Any]]] = {}
+_DECODERS: dict[str, Callable[[Any], Any]] = {}
+
+
+def register_codec(
+    cls: type, tag: str, encode: Callable[[Any], Any], decode: Callable[[Any], Any]
+) -> None:
+    _ENCODERS[cls] = (tag, encode)
+    _DECODERS[tag] = decode
+
+
+def _default(obj: Any) -> Any:
+    codec = _ENCODERS.get(type(obj))
+    if codec is None:
+        raise TypeError(f"Не умею сериализовать {type(obj).__name__}")
+    tag, encode = codec
+    return {"__t": tag, "v": encode(obj)}
+
+
+def _object_hook(obj: dict) -> Any:
+    tag = obj.get("__t")
+    if tag is not None and len(obj) == 2 and "v" in obj:
+        return _DECODERS[tag](obj["v"])
+    return obj
+
+
+def dumps(data: dict[str, Any]) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+
+def loads(raw: str | bytes | None) -> dict[str, Any]:
+    if not raw:
+        return {}
+    return json.loads(raw, object_hook=_object_hook)
+
+
+register_codec(datetime, "dt", datetime.isoformat, datetime.fromisoformat)
+register_codec(date, "d", date.isoformat, date.fromisoformat)
+register_codec(set, "set", list, set)
+
+
+# ---------- Бэкенды ----------
+class MemoryStorage:
+    """Контексты в памяти процесса: LRU на FSM_MEMORY_SIZE ключей с TTL."""
+
+    def __init__(self, max_size: int = FSM_MEMORY_SIZE, ttl: int = FSM_TTL):
+        self._states = BoundedCache("fsm_states", max_size, ttl=ttl)
+        self._data = BoundedCache("fsm_data", max_size, ttl=ttl)
+
+    async def get_state(self, key: str) -> str | None:
+        return self._states.get(key)
+
+    async def load(self, key: str) -> tuple[str | None, dict[str, Any]]:
+        """Состояние и данные разом."""
+        return await self.get_state(key), await self.get_data(key)
+
+    async def set_state(self, key: str, state: str | None) -> None:
+        if state is None:
+            self._states.pop(key)
+        else:
+            self._states.set(key, state)
+
+    async def get_data(self, key: str) -> dict[str, Any]:
+        data = self._data.get(key)
+        if data is None:
+            data = {}
+            self._data.set(key, data)
+        return data
+
+    async def set_data(self, key: str, data: dict[str, Any]) -> None:
+        self._data.set(key, data)
+
+    async def update_data(self, key: str, values: dict[str, Any]) -> dict[str, Any]:
+        data = await self.get_data(key)
+        data.update(values)
+        return data
+
+    async def clear(self, key: str) -> None:
+        self._states.pop(key)
+        self._data.pop(key)
+
+
+def _decode(raw: str | bytes | None) -> str | None:
+    return raw.decode() if isinstance(raw, bytes) else raw
+
+
+class RedisStorage:
+    """
+    Контексты в Redis: ключи <prefix>:<key>:s (строка состояния) и
+    <prefix>:<key>:d (компактный JSON данных), оба с TTL.
+    Запись всегда продлевает TTL обоих ключей одним pipeline.
+    """
+
+    def __init__(self, redis, ttl: int = FSM_TTL, prefix: str = "fsm"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, key: str) -> tuple[str, str]:
+        base = f"{self.prefix}:{key}"
+        return f"{base}:s", f"{base}:d"
+
+    async def get_state(self, key: str) -> str | None:
+        return _decode(await self.redis.get(self._keys(key)[0]))
+
+    async def load(self, key: str) -> tuple[str | None, dict[str, Any]]:
+        """Состояние и данные одним MGET."""
+        state, data = await self.redis.mget(self._keys(key))
+        return _decode(state), loads(data)
+
+    async def set_state(self, key: str, state: str | None) -> None:
+        state_key, data_key = self._keys(key)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, state, ex=self.ttl)
+            pipe.expire(data_key, self.ttl)
+            await pipe.execute()
+
+    async def get_data(self, key: str) -> dict[str, Any]:
+        return loads(await self.redis.get(self._keys(key)[1]))
+
+    async def set_data(self, key: str, data: dict[str, Any]) -> None:
+        state_key, data_key = self._keys(key)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(data_key, dumps(data), ex=self.ttl)
+            pipe.expire(state_key, self.ttl)
+            await pipe.execute()
+
+    async def update_data(self, key: str, values: dict[str, Any]) -> dict[str, Any]:
+        data = await self.get_data(key)
+        data.update(values)
+        await self.set_data(key, data)
+        return data
+
+    async def clear(self, key: str) -> None:
+        await self.redis.delete(*self._keys(key))
+
+
+# ---------- Контекст ----------
+class StorageContext(BaseContext):
+    """
+    Контекст maxapi поверх бэкенда хранилища (backend — MemoryStorage или RedisStorage).
+    Диспетчер начинает каждое событие с get_state: вместе с состоянием читаются
+    и данные, и первый get_data в хендлере отдаёт их без второго запроса.
+    """
+
+    def __init__(self, chat_id: int | None, user_id: int | None, backend, **kwargs: Any):
+        super().__init__(chat_id, user_id, **kwargs)
+        self.backend = backend
+        self.key = f"{chat_id}:{user_id}"
+        self._prefetched: dict[str, Any] | None = None
+
+    async def get_data(self) -> dict[str, Any]:
+        data, self._prefetched = self._prefetched, None
+        if data is None:
+            data = await self.backend.get_data(self.key)
+        return data
+
+    async def set_data(self, data: dict[str, Any]) -> None:
+        self._prefetched = None
+        await self.backend.set_data(self.key, data)
+
+    async def update_data(self, **kwargs: Any) -> dict[str, Any]:
+        self._prefetched = None
+        return await self.backend.update_data(self.key, kwargs)
+
+    async def set_state(self, state: State | str | None = None) -> None:
+        await self.backend.set_state(self.key, str(state) if state is not None else None)
+
+    async def get_state(self) -> State | str | None:
+        state, self._prefetched = await self.backend.load(self.key)
+        return state_from_str(state)
+
+    async def clear(self) -> None:
+        self._prefetched = None
+        await self.backend.clear(self.key)
+
+
+def create_storage():
+    if FSM_STORAGE == "redis":
+        from utils.redis import get_redis_async
+
+        return RedisStorage(get_redis_async())
+    return MemoryStorage()
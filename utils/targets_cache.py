@@ -0,0 +1,61 @@
+"""
+Кэш «у пользователя есть цели на сегодня» для look_if_not_target.
+Не импортирует core — его дёргает TargetCRUD при удалении целей.
+
+Кэшируется только положительный ответ: отрицательный устаревает, как только
+пользователь поставит цели (в том числе через другую реплику), и guard снова
+отправил бы его в new_day. При FSM_STORAGE=redis реплики не видят
+инвалидаций друг друга, поэтому запись живёт не дольше TARGETS_CACHE_SHARED_TTL.
+"""
+
+import os
+
+from utils.cache import BoundedCache, seconds_until_local_midnight
+from utils.dates import local_today
+from utils.storage import FSM_STORAGE
+
+TARGETS_CACHE_SIZE = int(os.getenv("TARGETS_CACHE_SIZE", "50000"))
+TARGETS_CACHE_SHARED_TTL = float(os.getenv("TARGETS_CACHE_SHARED_TTL", "30"))
+
+
+class TargetsTodayCache:
+    """
+    user_id -> (местный день, utc_offset) поверх BoundedCache — только для тех,
+    у кого цели на сегодня есть. Запись живёт до полуночи в поясе пользователя
+    (и не дольше max_ttl) и только для того дня, на который её посчитали.
+    """
+
+    def __init__(self, max_size: int = TARGETS_CACHE_SIZE, max_ttl: float | None = None):
+        self.cache = BoundedCache("targets_today", max_size, day_scoped=True)
+        self.max_ttl = max_ttl
+
+    def get(self, user_id: int) -> int | None:
+        """utc_offset, если у пользователя точно есть цели сегодня, иначе None."""
+        entry = self.cache.get(user_id)
+        if entry is None:
+            return None
+        day, utc_offset = entry
+        if day != local_today(utc_offset):
+            self.cache.pop(user_id)
+            return None
+        return utc_offset
+
+    def set(self, user_id: int, has_targets: bool, utc_offset: int) -> None:
+        if not has_targets:
+            self.cache.pop(user_id)
+            return
+        ttl = seconds_until_local_midnight(utc_offset)
+        if self.max_ttl is not None:
+            ttl = min(ttl, self.max_ttl)
+        self.cache.set(user_id, (local_today(utc_offset), utc_offset), ttl=ttl)
+
+    def invalidate(self, user_id: int) -> None:
+        self.cache.pop(user_id)
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+
+targets_today = TargetsTodayCache(
+    max_ttl=TARGETS_CACHE_SHARED_TTL if FSM_STORAGE == "redis" else None
+)
@@ -0,0 +1,147 @@
+"""
+Приём обновлений Max через вебхук вместо long polling (UPDATES_MODE=webhook).
+
+POST на WEBHOOK_PATH проверяется (секрет, JSON, тип обновления), событие
+кладётся в очередь и сразу получает 200; разборщик очереди запускает каждое
+событие в своей задаче (dp.spawn_handle_task) — те же роутеры, та же изоляция
+по пользователю и тот же лимит DISPATCH_MAX_PENDING, что и при polling.
+Переполненная очередь отвечает 503, чтобы Max повторил доставку позже.
+"""
+
+import asyncio
+import hmac
+import json
+import os
+
+from aiohttp import web
+from maxapi.enums.update import UpdateType
+from maxapi.methods.types.getted_updates import process_update_webhook
+
+from utils.metrics import METRICS_ENABLED, render_prometheus
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+# публичный адрес для подписки (POST /subscriptions); пусто — подписка вручную
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or None
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000"))
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+SECRET_HEADER = "X-Max-Bot-Api-Secret"
+UPDATE_TYPES = {update_type.value for update_type in UpdateType}
+
+
+def validate_update(payload) -> str | None:
+    """Причина отказа для тела запроса или None, если это похоже на обновление Max."""
+    if not isinstance(payload, dict):
+        return "ожидался JSON-объект"
+    if payload.get("update_type") not in UPDATE_TYPES:
+        return f"неизвестный update_type: {payload.get('update_type')!r}"
+    if not isinstance(payload.get("timestamp"), int):
+        return "нет timestamp"
+    return None
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dp,
+        bot,
+        path: str = WEBHOOK_PATH,
+        secret: str | None = WEBHOOK_SECRET,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._consumer: asyncio.Task | None = None
+        self._runner: web.AppRunner | None = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=WEBHOOK_MAX_BODY)
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.health)
+        if METRICS_ENABLED:
+            app.router.add_get("/metrics", self.metrics)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret is not None and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret
+        ):
+            return web.json_response({"ok": False, "error": "forbidden"}, status=403)
+
+        try:
+            payload = json.loads(await request.read())
+        except ValueError:
+            return web.json_response({"ok": False, "error": "невалидный JSON"}, status=400)
+
+        error = validate_update(payload)
+        if error is not None:
+            return web.json_response({"ok": False, "error": error}, status=400)
+
+        try:
+            event = await process_update_webhook(event_json=payload, bot=self.bot)
+        except Exception as e:
+            print(f"❌ Не удалось разобрать обновление {payload.get('update_type')}: {e}")
+            return web.json_response({"ok": False, "error": "невалидное обновление"}, status=400)
+        if event is None:
+            return web.json_response({"ok": True})
+
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            return web.json_response({"ok": False, "error": "перегружен"}, status=503)
+        return web.json_response({"ok": True})
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "queue": self.queue.qsize()})
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=render_prometheus(), content_type="text/plain")
+
+    async def _consume(self) -> None:
+        """
+        Не ждёт обработки события: задача, стоящая в очереди своего
+        пользователя, не держит разбор очереди. Ошибки задач логирует maxapi.
+        """
+        while True:
+            await self.dp.wait_for_room()
+            event = await self.queue.get()
+            task = self.dp.spawn_handle_task(event)
+            task.add_done_callback(lambda _: self.queue.task_done())
+
+    async def start_consumer(self) -> None:
+        await self.dp.startup(self.bot)
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        await self.start_consumer()
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"🌐 Вебхук слушает http://{host}:{port}{self.path}")
+        if WEBHOOK_URL:
+            await self.bot.subscribe_webhook(url=WEBHOOK_URL, secret=self.secret)
+            print(f"🔗 Подписка на {WEBHOOK_URL} оформлена")
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Не дождались {self.queue.qsize()} обновлений в очереди")
+        if self._consumer is not None:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+
+    async def serve(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        await self.start(host, port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()